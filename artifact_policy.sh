@@ -0,0 +1,58 @@
+#!/bin/bash
+# artifact_policy.sh: Storage policy for post-stats intermediates, sourced by calc_post_stats_thresh.sh
+# Created for RECOVER project, Oct 2026
+#
+# Every map written by post-stats is either persisted (final maps read by data_processor.py
+# and the CSVs) or ephemeral (remasked/hemisphere-split maps and their native-space copies that
+# are only read to compute the CSV). ARTIFACT_POLICY selects how ephemeral maps are stored:
+#   ephemeral (default) - written uncompressed to a per-task scratch folder under
+#                         ARTIFACT_SCRATCH_ROOT (/dev/shm when available, else $TMPDIR or /tmp)
+#                         and removed when the task finishes
+#   keep                - previous behaviour: gzipped next to the FEAT outputs and kept
+# Persisted maps are always written with FSLOUTPUTTYPE (NIFTI_GZ) at the FSL/ANTs default compression.
+
+ARTIFACT_POLICY=${ARTIFACT_POLICY:-ephemeral}
+if [ -z "$ARTIFACT_SCRATCH_ROOT" ]; then
+    if [ -d /dev/shm ] && [ -w /dev/shm ]; then
+        ARTIFACT_SCRATCH_ROOT=/dev/shm
+    else
+        ARTIFACT_SCRATCH_ROOT=${TMPDIR:-/tmp}
+    fi
+fi
+
+# Create the scratch folder for one unit of work ($1 = label, e.g. subject_task); sets EPHEMERAL_DIR
+artifact_init() {
+    local label=$1
+    if [ "$ARTIFACT_POLICY" == "keep" ]; then
+        EPHEMERAL_DIR=""
+        return 0
+    fi
+    EPHEMERAL_DIR=$(mktemp -d "${ARTIFACT_SCRATCH_ROOT}/recover_${label}_XXXXXX")
+    echo "Ephemeral post-stats maps for ${label} written to $EPHEMERAL_DIR"
+}
+
+# Map the persisted-style path $1 to the path an ephemeral map should be written to
+ephemeral() {
+    local path=$1
+    if [ "$ARTIFACT_POLICY" == "keep" ] || [ -z "$EPHEMERAL_DIR" ]; then
+        echo "$path"
+    else
+        echo "${EPHEMERAL_DIR}/$(basename "${path%.nii.gz}").nii"
+    fi
+}
+
+# Run an FSL command whose output is ephemeral (uncompressed unless the policy is keep)
+fsl_ephemeral() {
+    if [ "$ARTIFACT_POLICY" == "keep" ]; then
+        "$@"
+    else
+        FSLOUTPUTTYPE=NIFTI "$@"
+    fi
+}
+
+# Remove the scratch folder created by artifact_init
+artifact_cleanup() {
+    if [ -n "$EPHEMERAL_DIR" ] && [ -d "$EPHEMERAL_DIR" ]; then
+        rm -rf "$EPHEMERAL_DIR"
+    fi
+}
@@ -0,0 +1,193 @@
+#!/opt/anaconda3/bin/python
+# Python 3.8.20
+# run_benchmarks.py: Times the pipeline's Python hot paths on synthetic data and stores results per commit
+# Created for RECOVER project, Oct 2026
+#
+# Usage:
+#   python benchmarks/run_benchmarks.py run [--repeat 3] [--only plot_] [--workdir DIR]
+#   python benchmarks/run_benchmarks.py compare benchmarks/results/<base>.json [benchmarks/results/<new>.json]
+# Results are written to benchmarks/results/<commit>.json. Runs offline without FSL or ANTs.
+
+import os
+import sys
+import json
+import time
+import platform
+import argparse
+import statistics
+import subprocess
+import tempfile
+
+os.environ.setdefault('MPLBACKEND', 'Agg')
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCH_DIR)
+RESULTS_DIR = os.path.join(BENCH_DIR, "results")
+sys.path.insert(0, REPO_DIR)
+
+SUBJECT = "SYNTH01"
+
+
+def _git_revision():
+    try:
+        rev = subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=REPO_DIR, text=True).strip()
+        dirty = subprocess.call(['git', 'diff', '--quiet', 'HEAD'], cwd=REPO_DIR) != 0
+        return rev + ('-dirty' if dirty else '')
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def build_cases(root, n_vols):
+    """Return (name, setup, run) triples; setup returns the state passed to run."""
+    import matplotlib.pyplot as plt
+    import numpy as np
+    from nilearn import image
+    import synthetic
+    import roi_stats
+    import confounds
+    import ica_corr
+    from data_processor import DataProcessor
+    from output_generator import OutputGenerator
+
+    subdir = synthetic.make_subject(root, SUBJECT, n_vols=n_vols)
+    feat = os.path.join(subdir, f"fsl_stats/sub-{SUBJECT}_task-motor_run-01_contrasts.feat")
+    roi_dir = os.path.join(subdir, "ROI")
+
+    def processor():
+        return DataProcessor(SUBJECT, subdir, os.path.join(root, "ROI"))
+
+    def roi_maps():
+        return {
+            'z': roi_stats.load_map(os.path.join(feat, "stats/remasked_zstat1.nii.gz")),
+            'thresh': roi_stats.load_map(os.path.join(feat, "thresh_zstat1.nii.gz")),
+            'tfce': roi_stats.load_map(os.path.join(feat, "randomise_time_series_tfce_corrp_tstat1.nii.gz")),
+            'rois': [roi_stats.load_map(os.path.join(roi_dir, f"SMA_PMC_sub{s}.nii.gz")) for s in ("", "_left", "_right")],
+        }
+
+    def sparse_roi_maps():
+        return {
+            'z': roi_stats.load_sparse_map(os.path.join(feat, "stats/remasked_zstat1.nii.gz")),
+            'thresh': roi_stats.load_sparse_map(os.path.join(feat, "thresh_zstat1.nii.gz")),
+            'rois': [roi_stats.load_sparse_map(os.path.join(roi_dir, f"SMA_PMC_sub{s}.nii.gz")) for s in ("", "_left", "_right")],
+        }
+
+    def run_roi_stats(m):
+        return [roi_stats.compute_roi_stats(m['thresh'], m['z'], roi) for roi in m['rois']]
+
+    def run_dice_coverage(m):
+        sig = np.where(m['tfce'] >= 0.95, m['tfce'], 0)
+        return roi_stats.calculate_dice(sig, m['thresh']), roi_stats.calculate_coverage(sig, m['thresh'])
+
+    def ica_inputs():
+        ic = image.load_img(os.path.join(feat, "filtered_func_data.ica/melodic_IC.nii.gz"))
+        mix = np.loadtxt(os.path.join(feat, "filtered_func_data.ica/melodic_mix"))
+        regressor = synthetic.task_regressor(mix.shape[0])
+        best, _ = ica_corr.find_best_component(mix, regressor)
+        return {
+            'func': image.load_img(os.path.join(feat, "filtered_func_data.nii.gz")),
+            'ic': ic, 'mix': mix, 'regressor': regressor, 'best': best, 'best_map': image.index_img(ic, best),
+            'glm': image.load_img(os.path.join(feat, "stats/zstat1.nii.gz")),
+            'ts': np.zeros(mix.shape[0]),
+        }
+
+    def output_data():
+        dp = processor()
+        data = dp.process_data()
+        plt.close('all')
+        return data
+
+    def run_save_pdf(data):
+        return OutputGenerator(SUBJECT, root)._save_pdf(data)
+
+    def run_save_html(data):
+        return OutputGenerator(SUBJECT, root)._save_html(data)
+
+    def closing(func):
+        def wrapped(state):
+            result = func(state)
+            plt.close('all')
+            return result
+        return wrapped
+
+    bold = os.path.join(subdir, f"func/sub-{SUBJECT}_ses-01_task-motor_run-01_space-MNI152NLin6Asym_desc-preproc_bold.nii.gz")
+    return [
+        ("confounds_stream_dvars", lambda: bold, lambda p: confounds.stream_dvars(p)),
+        ("roi_stats", roi_maps, run_roi_stats),
+        ("roi_stats_sparse", sparse_roi_maps, run_roi_stats),
+        ("dice_coverage", roi_maps, run_dice_coverage),
+        ("plot_roi_mni_3.1", processor, closing(lambda dp: dp.plot_roi('MNI', threshold=3.1))),
+        ("plot_roi_native_2.35", processor, closing(lambda dp: dp.plot_roi('Native', threshold=2.35))),
+        ("plot_table_mni_3.1", processor, closing(lambda dp: dp.plot_table('MNI', threshold=3.1))),
+        ("save_pdf", output_data, closing(run_save_pdf)),
+        ("save_html", output_data, closing(run_save_html)),
+        ("ica_find_best_component", ica_inputs, lambda s: ica_corr.find_best_component(s['mix'], s['regressor'])),
+        ("ica_spatial_correlation", ica_inputs, lambda s: ica_corr.spatial_correlation(s['best_map'], s['glm'])),
+        ("ica_top_voxel_timeseries", ica_inputs, lambda s: ica_corr.top_voxel_timeseries(s['func'], s['best_map'])),
+        ("ica_dual_regression", ica_inputs, lambda s: ica_corr.dual_regression(s['func'], s['ic'])),
+        ("ica_threshold_map", ica_inputs, lambda s: ica_corr.threshold_ica_map(s['best_map'])),
+        ("ica_plot_timeseries", ica_inputs, closing(lambda s: ica_corr.plot_timeseries(s['ts'], s['best']))),
+        ("ica_plot_map", ica_inputs, closing(lambda s: ica_corr.plot_ica_map(s['best_map'], s['best']))),
+    ]
+
+
+def run(args):
+    workdir = args.workdir or os.path.join(tempfile.gettempdir(), "recover_bench_data")
+    os.makedirs(workdir, exist_ok=True)
+    os.environ.setdefault('NIFTI_SCRATCH_DIR', os.path.join(workdir, "nifti_cache"))
+    sys.path.insert(0, BENCH_DIR)
+
+    results = {}
+    for name, setup, func in build_cases(workdir, args.n_vols):
+        if args.only and not any(pattern in name for pattern in args.only):
+            continue
+        state = setup()
+        timings = []
+        for _ in range(args.repeat):
+            start = time.perf_counter()
+            func(state)
+            timings.append(time.perf_counter() - start)
+        results[name] = {'min': min(timings), 'median': statistics.median(timings),
+                         'mean': statistics.mean(timings), 'repeat': args.repeat}
+        print(f"{name:<28} min {min(timings):8.3f}s  median {statistics.median(timings):8.3f}s")
+
+    revision = _git_revision()
+    record = {'revision': revision, 'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+              'python': platform.python_version(), 'machine': platform.node(),
+              'n_vols': args.n_vols, 'cases': results}
+    output = args.output or os.path.join(RESULTS_DIR, f"{revision}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, 'w') as f:
+        json.dump(record, f, indent=2)
+    print(f"Results saved to {output}")
+    return output
+
+
+def compare(args):
+    with open(args.base) as f:
+        base = json.load(f)
+    new_path = args.new or os.path.join(RESULTS_DIR, f"{_git_revision()}.json")
+    with open(new_path) as f:
+        new = json.load(f)
+    print(f"{'case':<28} {base['revision']:>14} {new['revision']:>14}   change")
+    for name in sorted(set(base['cases']) | set(new['cases'])):
+        old_t = base['cases'].get(name, {}).get('median')
+        new_t = new['cases'].get(name, {}).get('median')
+        if old_t is None or new_t is None:
+            print(f"{name:<28} {old_t or '-':>14} {new_t or '-':>14}")
+            continue
+        print(f"{name:<28} {old_t:13.3f}s {new_t:13.3f}s   {(new_t - old_t) / old_t * 100:+6.1f}%")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="RECOVER pipeline benchmarks on synthetic data")
+    sub = parser.add_subparsers(dest='command', required=True)
+    p_run = sub.add_parser('run', help="Run the benchmarks and store results for this commit")
+    p_run.add_argument('--repeat', type=int, default=3, help="Timed repetitions per case")
+    p_run.add_argument('--only', nargs='+', help="Run only cases whose name contains one of these strings")
+    p_run.add_argument('--workdir', help="Where the synthetic data is generated (reused between runs)")
+    p_run.add_argument('--n-vols', type=int, default=80, help="Volumes in the synthetic BOLD runs")
+    p_run.add_argument('--output', help="Results file (default: benchmarks/results/<commit>.json)")
+    p_cmp = sub.add_parser('compare', help="Compare two stored results")
+    p_cmp.add_argument('base', help="Baseline results file")
+    p_cmp.add_argument('new', nargs='?', help="New results file (default: results for the current commit)")
+    args = parser.parse_args()
+    run(args) if args.command == 'run' else compare(args)
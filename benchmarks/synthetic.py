@@ -0,0 +1,252 @@
+#!/opt/anaconda3/bin/python
+# Python 3.8.20
+# synthetic.py: Synthetic RECOVER derivatives tree for benchmarks (no FSL or ANTs needed)
+# Created for RECOVER project, Oct 2026
+#
+# Writes one subject laid out exactly like the pipeline expects under <root>:
+#   ROI/                                       MNI ROI templates
+#   derivatives/sub-<id>/ses-01/anat|func      fMRIPrep-style T1w (native + MNI), BOLD runs and masks
+#   derivatives/sub-<id>/ses-01/ROI            subject ROIs (MNI, native, left/right)
+#   derivatives/sub-<id>/ses-01/fsl_stats      FEAT/randomise/melodic outputs with block activation
+#   derivatives/sub-<id>/ses-01/post_stats     ROI stats CSVs as written by calc_post_stats_thresh.sh
+
+import os
+import sys
+import json
+import numpy as np
+import pandas as pd
+import nibabel as nib
+from scipy import ndimage
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import roi_stats  # noqa: E402
+
+GENERATOR_VERSION = 1
+MNI_SHAPE = (91, 109, 91)
+MNI_AFFINE = np.array([[-2., 0., 0., 90.],
+                       [0., 2., 0., -126.],
+                       [0., 0., 2., -72.],
+                       [0., 0., 0., 1.]])
+NATIVE_SHAPE = (160, 192, 160)
+NATIVE_AFFINE = np.array([[1., 0., 0., -80.],
+                          [0., 1., 0., -112.],
+                          [0., 0., 1., -62.],
+                          [0., 0., 0., 1.]])
+TASKS = ['motor_run-01', 'motor_run-02', 'lang']
+
+# ROI centres and radii in world mm (left and right blobs)
+ROI_BLOBS = {
+    'SMA_PMC': [((-22, -8, 58), (14, 16, 14)), ((22, -8, 58), (14, 16, 14)), ((0, -4, 62), (8, 14, 10))],
+    'STG': [((-56, -18, 4), (8, 24, 8)), ((56, -18, 4), (8, 24, 8))],
+    'Heschl': [((-44, -22, 10), (6, 6, 5)), ((44, -22, 10), (6, 6, 5))],
+}
+TASK_ROIS = {'motor_run-01': ['SMA_PMC'], 'motor_run-02': ['SMA_PMC'], 'lang': ['STG', 'Heschl']}
+ROI_LABELS = {
+    'SMA_PMC': ["Whole-brain", "Left", "Right"],
+    'STG': ["Whole-brain STG", "Left STG", "Right STG"],
+    'Heschl': ["Whole-brain Heschl", "Left Heschl", "Right Heschl"],
+}
+CSV_COLUMNS = ["Subject", "Task", "Space", "ROI", "Threshold", "Stat Type",
+               "Activated Voxels across Whole Brain (counts)", "Activated Voxels within ROI (counts)",
+               "Activated Voxels across Whole Brain (%)", "Activated Voxels within ROI (%)",
+               "Activated ROI/WB (%)", "%Activated ROI/%Activated WB (ratio)", "Voxels in ROI (counts)",
+               "Voxels in Whole Brain (counts)", "Dice Coefficient", "Coverage T-map (%)", "Coverage Z-map (%)",
+               "Coverage T-map ROI (%)", "Coverage Z-map ROI (%)"]
+
+
+def world_coords(shape, affine):
+    """World (mm) coordinates of every voxel, shape (3,) + shape."""
+    ijk = np.indices(shape, dtype=np.float32).reshape(3, -1)
+    xyz = affine[:3, :3].astype(np.float32) @ ijk + affine[:3, 3:4].astype(np.float32)
+    return xyz.reshape((3,) + tuple(shape))
+
+
+def ellipsoid(coords, center, radii):
+    d = sum(((coords[i] - center[i]) / radii[i]) ** 2 for i in range(3))
+    return d <= 1.0
+
+
+def roi_mask(coords, roi):
+    mask = np.zeros(coords.shape[1:], dtype=bool)
+    for center, radii in ROI_BLOBS[roi]:
+        mask |= ellipsoid(coords, center, radii)
+    return mask
+
+
+def brain_mask(coords):
+    return ellipsoid(coords, (0, -18, 12), (68, 86, 70))
+
+
+def hemisphere_split(data, space):
+    """Left/right halves as the pipeline splits them (fslmaths -roi on the x index in MNI)."""
+    left, right = np.zeros_like(data), np.zeros_like(data)
+    if space == 'MNI':
+        left[1:46] = data[1:46]
+        right[45:] = data[45:]
+    else:
+        mid = data.shape[0] // 2
+        left[:mid] = data[:mid]
+        right[mid:] = data[mid:]
+    return left, right
+
+
+def smooth_noise(shape, rng, sigma=2.0):
+    noise = ndimage.gaussian_filter(rng.standard_normal(shape).astype(np.float32), sigma)
+    return noise / (noise.std() + 1e-6)
+
+
+def to_native(data, order=1):
+    """Resample an MNI-grid volume onto the native grid (world coordinates are shared)."""
+    m = np.linalg.inv(MNI_AFFINE) @ NATIVE_AFFINE
+    return ndimage.affine_transform(data, m[:3, :3], m[:3, 3], output_shape=NATIVE_SHAPE, order=order)
+
+
+def task_regressor(n_vols, block=20):
+    return np.resize(np.r_[np.ones(block), np.zeros(block)], n_vols)
+
+
+def save(data, affine, path, dtype=np.float32):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    img = nib.Nifti1Image(np.asarray(data, dtype=dtype), affine)
+    img.header.set_data_dtype(dtype)
+    nib.save(img, path)
+    return path
+
+
+def _csv_rows(subject, task, space, maps, rois):
+    rows = []
+    z, z_l, z_r = maps['z'], maps['z_left'], maps['z_right']
+    for thresh_label, key in [("Z=3.1", 'thresh_31'), ("Z=2.35", 'thresh_235')]:
+        t, t_l, t_r = maps[key], maps[key + '_left'], maps[key + '_right']
+        for roi in rois:
+            for label, zm, tm, rm in zip(ROI_LABELS[roi], (z, z_l, z_r), (t, t_l, t_r), rois[roi]):
+                stats = roi_stats.compute_roi_stats(tm, zm, rm)
+                rows.append(dict(stats, **{"Subject": subject, "Task": task, "Space": space, "ROI": label,
+                                           "Threshold": thresh_label, "Stat Type": "Z-stat"}))
+    tfce, tfce_l, tfce_r = maps['tfce'], maps['tfce_left'], maps['tfce_right']
+    for roi in rois:
+        for label, tm, zt, rm in zip(ROI_LABELS[roi], (tfce, tfce_l, tfce_r),
+                                     (maps['thresh_31'], maps['thresh_31_left'], maps['thresh_31_right']), rois[roi]):
+            sig = np.where(tm >= 0.95, tm, 0)
+            stats = roi_stats.compute_roi_stats(sig, tm, rm, stat_type='TFCE')
+            coverage_t, coverage_z = roi_stats.calculate_coverage(sig, zt)
+            rows.append(dict(stats, **{"Subject": subject, "Task": task, "Space": space, "ROI": label,
+                                       "Threshold": "TFCE", "Stat Type": "TFCE",
+                                       "Dice Coefficient": roi_stats.calculate_dice(sig, zt),
+                                       "Coverage T-map (%)": coverage_t, "Coverage Z-map (%)": coverage_z}))
+    return rows
+
+
+def make_subject(root, subject="SYNTH01", n_vols=80, n_components=10, seed=0):
+    """Write a full synthetic subject under root and return its session directory."""
+    rng = np.random.default_rng(seed)
+    subdir = os.path.join(root, f"derivatives/sub-{subject}/ses-01")
+    stamp = os.path.join(subdir, ".synthetic.json")
+    params = {'version': GENERATOR_VERSION, 'subject': subject, 'n_vols': n_vols,
+              'n_components': n_components, 'seed': seed}
+    if os.path.exists(stamp):
+        with open(stamp) as f:
+            if json.load(f) == params:
+                return subdir
+
+    mni = world_coords(MNI_SHAPE, MNI_AFFINE)
+    brain = brain_mask(mni)
+    anat, func, roi_dir = (os.path.join(subdir, d) for d in ("anat", "func", "ROI"))
+
+    # Structural images (skull-stripped native T1w and MNI T1w)
+    t1_mni = np.where(brain, 600 + 200 * smooth_noise(MNI_SHAPE, rng, 3), 0)
+    save(t1_mni, MNI_AFFINE, os.path.join(anat, f"sub-{subject}_ses-01_run-01_space-MNI152NLin6Asym_desc-preproc_T1w.nii.gz"))
+    save(to_native(t1_mni), NATIVE_AFFINE, os.path.join(anat, f"sub-{subject}_ses-01_run-01_desc-brain_T1w.nii.gz"))
+    save(to_native(brain.astype(np.float32), order=0), NATIVE_AFFINE,
+         os.path.join(anat, f"sub-{subject}_ses-01_run-01_desc-brain_mask.nii.gz"), np.uint8)
+
+    # ROI templates and subject ROIs
+    masks = {}
+    for roi in ROI_BLOBS:
+        mask = (roi_mask(mni, roi) & brain).astype(np.float32)
+        save(mask, MNI_AFFINE, os.path.join(root, "ROI", f"{roi}.nii.gz"))
+        native = to_native(mask, order=0)
+        masks[roi] = {'MNI': (mask,) + hemisphere_split(mask, 'MNI'),
+                      'Native': (native,) + hemisphere_split(native, 'Native')}
+        for suffix, data, space in [("_sub", mask, 'MNI'), ("_sub_t1w_native", native, 'Native')]:
+            whole, left, right = (data,) + hemisphere_split(data, space)
+            affine = MNI_AFFINE if space == 'MNI' else NATIVE_AFFINE
+            save(whole, affine, os.path.join(roi_dir, f"{roi}{suffix}.nii.gz"))
+            save(left, affine, os.path.join(roi_dir, f"{roi}{suffix}_left.nii.gz"))
+            save(right, affine, os.path.join(roi_dir, f"{roi}{suffix}_right.nii.gz"))
+
+    regressor = task_regressor(n_vols)
+    for task in TASKS:
+        feat = os.path.join(subdir, f"fsl_stats/sub-{subject}_task-{task}_contrasts.feat")
+        active = np.zeros(MNI_SHAPE, dtype=bool)
+        for roi in TASK_ROIS[task]:
+            active |= masks[roi]['MNI'][0] > 0
+
+        # 4D BOLD run with block activation inside the task ROIs
+        baseline = np.where(brain, 1000 + 50 * smooth_noise(MNI_SHAPE, rng, 3), 0).astype(np.float32)
+        bold = np.empty(MNI_SHAPE + (n_vols,), dtype=np.int16)
+        for t in range(n_vols):
+            vol = baseline * (1 + 0.02 * regressor[t] * active) + 8 * rng.standard_normal(MNI_SHAPE, dtype=np.float32)
+            bold[..., t] = np.where(brain, vol, 0)
+        bold_path = save(bold, MNI_AFFINE, os.path.join(
+            func, f"sub-{subject}_ses-01_task-{task}_space-MNI152NLin6Asym_desc-preproc_bold.nii.gz"), np.int16)
+        save(brain, MNI_AFFINE, os.path.join(
+            func, f"sub-{subject}_ses-01_task-{task}_space-MNI152NLin6Asym_desc-brain_mask.nii.gz"), np.uint8)
+        os.makedirs(feat, exist_ok=True)
+        func_data = os.path.join(feat, "filtered_func_data.nii.gz")
+        if os.path.exists(func_data):
+            os.remove(func_data)
+        try:
+            os.link(bold_path, func_data)
+        except OSError:
+            save(bold, MNI_AFFINE, func_data, np.int16)
+        del bold
+
+        # GLM, randomise and melodic outputs
+        z = np.where(brain, smooth_noise(MNI_SHAPE, rng) + 8 * ndimage.gaussian_filter(active.astype(np.float32), 2), 0)
+        maps_mni = {'z': z, 'thresh_31': np.where(z > 3.1, z, 0), 'thresh_235': np.where(z > 2.35, z, 0),
+                    'tfce': np.where(brain, 1 / (1 + np.exp(-(z - 2.5) * 3)), 0)}
+        save(z, MNI_AFFINE, os.path.join(feat, "stats/zstat1.nii.gz"))
+        save(z, MNI_AFFINE, os.path.join(feat, "stats/remasked_zstat1.nii.gz"))
+        save(maps_mni['thresh_31'], MNI_AFFINE, os.path.join(feat, "thresh_zstat1.nii.gz"))
+        save(maps_mni['thresh_235'], MNI_AFFINE, os.path.join(feat, "stats/thresh_zstat1_235.nii.gz"))
+        save(maps_mni['tfce'], MNI_AFFINE, os.path.join(feat, "randomise_time_series_tfce_corrp_tstat1.nii.gz"))
+        save(z * 1.1, MNI_AFFINE, os.path.join(feat, "randomise_time_series_tstat1.nii.gz"))
+
+        maps_native = {k: to_native(v) for k, v in maps_mni.items()}
+        save(maps_native['z'], NATIVE_AFFINE, os.path.join(feat, "stats/zstat1_native.nii.gz"))
+        save(maps_native['thresh_31'], NATIVE_AFFINE, os.path.join(feat, "stats/thresh_zstat1_native.nii.gz"))
+        save(maps_native['thresh_235'], NATIVE_AFFINE, os.path.join(feat, "stats/thresh_zstat1_235_native.nii.gz"))
+
+        components = np.stack([smooth_noise(MNI_SHAPE, rng) * brain for _ in range(n_components)], axis=-1)
+        components[..., 3] = z
+        save(components, MNI_AFFINE, os.path.join(feat, "filtered_func_data.ica/melodic_IC.nii.gz"))
+        mix = rng.standard_normal((n_vols, n_components))
+        mix[:, 3] = regressor + 0.3 * rng.standard_normal(n_vols)
+        np.savetxt(os.path.join(feat, "filtered_func_data.ica/melodic_mix"), mix, fmt='%.6f')
+
+        # ROI stats CSV (Z-stat and TFCE rows, MNI then Native)
+        rows = []
+        for space, maps in [('MNI', maps_mni), ('Native', maps_native)]:
+            for key in list(maps):
+                maps[key + '_left'], maps[key + '_right'] = hemisphere_split(maps[key], space)
+            rois = {roi: masks[roi][space] for roi in TASK_ROIS[task]}
+            rows.extend(_csv_rows(subject, task, space, maps, rois))
+        df = pd.DataFrame(rows).reindex(columns=CSV_COLUMNS).fillna("N/A")
+        os.makedirs(os.path.join(subdir, "post_stats"), exist_ok=True)
+        df.to_csv(os.path.join(subdir, f"post_stats/sub-{subject}_task-{task}_roi_stats.csv"), index=False)
+
+    with open(stamp, 'w') as f:
+        json.dump(params, f)
+    return subdir
+
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="Write a synthetic RECOVER subject")
+    parser.add_argument("root", help="Output root (plays the role of ARCHIVEDIR)")
+    parser.add_argument("--subject", default="SYNTH01")
+    parser.add_argument("--n-vols", type=int, default=80)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    print(make_subject(args.root, args.subject, args.n_vols, seed=args.seed))
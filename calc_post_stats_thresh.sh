@@ -7,11 +7,18 @@
 # Updated to include Dice and Coverage Percentage for TFCE vs. Z-stat comparison without re-thresholding TFCE, Mar 2025
 # Updated to compute two coverage percentages (t-map and z-map denominators) for TFCE and Z-stat, Apr 2025
 # Updated to include t-map splitting and inverse transformation to native space, Jun 2025
+# Updated to keep single-use intermediates uncompressed in scratch space (artifact_policy.sh), Oct 2026
+# Updated to isolate failures per subject and task, skip ICA rows when ICA maps are missing, and add POST_STATS_STEP, Oct 2026
+# Updated to write sparse sidecars of the thresholded maps (sparse_maps.py), Oct 2026
+# Updated to count the CSV rows from the sparse maps (roi_stats.py) instead of fslstats, Oct 2026
 
-# Exit on any error
+# Exit on any error (within each subject's ROI preparation and each task's post-stats)
 set -e
 set -x
 
+# Steps to run: all (default), rois (skull-strip T1w and transform ROIs) or tasks (per-task post-stats)
+POST_STATS_STEP=${POST_STATS_STEP:-all}
+
 # Check if at least one subject ID was provided
 if [ $# -eq 0 ]; then
     echo "Usage: $0 <subject_id1> <subject_id2> ... <subject_idN>"
@@ -30,62 +37,18 @@ if [ -z "$ARCHIVEDIR" ] || [ -z "$ROI" ]; then
     exit 1
 fi
 
-# Function to calculate percentage
-calculate_percentage() {
-    local numerator=$1
-    local denominator=$2
-    if [ -z "$denominator" ] || ! [[ "$denominator" =~ ^[0-9]+$ ]]; then
-        echo "ERROR: Denominator is empty or not an integer: $denominator" >&2
-        echo "0.0"
-        return 1
-    fi
-    if [ "$denominator" -gt 0 ]; then
-        local result=$(echo "scale=3; ($numerator / $denominator) * 100" | bc)
-        printf "%.3f" "$result"
-    else
-        echo "0.0"
-    fi
-}
+# Storage policy for intermediate maps (ephemeral vs persisted)
+source "$(dirname "${BASH_SOURCE[0]}")/artifact_policy.sh"
 
-# Function to calculate Dice coefficient
-calculate_dice() {
-    local t_map=$1    # TFCE map (thresholded or unthresholded) or other map
-    local z_map=$2    # Thresholded Z-map
-    local overlap=$(fslstats "$t_map" -k "$z_map" -l 0 -V | awk '{print $1}')
-    local total_t=$(fslstats "$t_map" -V | awk '{print $1}')
-    local total_z=$(fslstats "$z_map" -V | awk '{print $1}')
-    if [ "$total_t" -gt 0 ] && [ "$total_z" -gt 0 ]; then
-        local dice=$(echo "scale=3; (2 * $overlap) / ($total_t + $total_z)" | bc)
-        printf "%.3f" "$dice"
-    else
-        echo "0.0"
-    fi
-}
+# Counts, percentages, Dice and coverage of the CSV rows, from sparse maps (roi_stats.py); it also
+# writes the sparse sidecars of the thresholded maps read downstream (sparse_maps.py)
+PYTHON=${PYTHON:-python3}
+ROI_STATS=${ROI_STATS:-$(dirname "${BASH_SOURCE[0]}")/roi_stats.py}
 
-# Function to calculate coverage percentages (t-map and z-map denominators)
-calculate_coverage() {
-    local t_map=$1    # TFCE map (thresholded or unthresholded) or other map
-    local z_map=$2    # Thresholded Z-map
-    local overlap=$(fslstats "$t_map" -k "$z_map" -l 0 -V | awk '{print $1}')
-    local total_t=$(fslstats "$t_map" -V | awk '{print $1}')
-    local total_z=$(fslstats "$z_map" -V | awk '{print $1}')
-    local coverage_t="0.0"
-    local coverage_z="0.0"
-    
-    # Coverage with t-map (or input map) as denominator
-    if [ "$total_t" -gt 0 ]; then
-        coverage_t=$(echo "scale=3; ($overlap / $total_t) * 100" | bc)
-        coverage_t=$(printf "%.3f" "$coverage_t")
-    fi
-    
-    # Coverage with z-map as denominator
-    if [ "$total_z" -gt 0 ]; then
-        coverage_z=$(echo "scale=3; ($overlap / $total_z) * 100" | bc)
-        coverage_z=$(printf "%.3f" "$coverage_z")
-    fi
-    
-    # Return both coverage percentages as a comma-separated string
-    echo "$coverage_t,$coverage_z"
+# Append one CSV row to CSV_ROWS: the maps roi_stats.py counts for it (see ROW_FIELDS there)
+add_csv_row() {
+    local IFS=$'\t'
+    CSV_ROWS+=("$*")
 }
 
 # Function to preprocess subject (skull-strip T1w and inverse transform ROIs)
@@ -111,23 +74,23 @@ preprocess_subject() {
     mkdir -p "$SUBJ_ROI_DIR"
     if [ ! -d "$SUBJ_ROI_DIR" ]; then
         echo "Error: Failed to create directory $SUBJ_ROI_DIR" >&2
-        exit 1
+        return 1
     fi
 
     # Skull-strip T1w
     echo "Skull-stripping T1w for sub-${subject}..."
     if [ ! -f "$T1W_PREPROC" ]; then
         echo "Error: T1W_PREPROC file does not exist: $T1W_PREPROC" >&2
-        exit 1
+        return 1
     fi
     if [ ! -f "$BRAIN_MASK" ]; then
         echo "Error: BRAIN_MASK file does not exist: $BRAIN_MASK" >&2
-        exit 1
+        return 1
     fi
     fslmaths "$T1W_PREPROC" -mas "$BRAIN_MASK" "$T1W_SKULL_STRIPPED"
     if [ ! -f "$T1W_SKULL_STRIPPED" ]; then
         echo "Error: Failed to create skull-stripped T1w file: $T1W_SKULL_STRIPPED" >&2
-        exit 1
+        return 1
     fi
     echo "Skull-stripped T1w saved as: $T1W_SKULL_STRIPPED"
 
@@ -135,7 +98,7 @@ preprocess_subject() {
     for roi_file in "${ROI}/SMA_PMC.nii.gz" "${ROI}/STG.nii.gz" "${ROI}/Heschl.nii.gz"; do
         if [ ! -f "$roi_file" ]; then
             echo "Error: ROI file $roi_file does not exist" >&2
-            exit 1
+            return 1
         fi
     done
 
@@ -144,17 +107,17 @@ preprocess_subject() {
     flirt -in ${ROI}/SMA_PMC.nii.gz -ref ${SUBDIR}/fsl_stats/sub-${subject}_task-motor_run-01_contrasts.feat/stats/zstat1.nii.gz -applyxfm -usesqform -out ${SUBJ_ROI_DIR}/SMA_PMC_sub.nii.gz
     if [ ! -f "${SUBJ_ROI_DIR}/SMA_PMC_sub.nii.gz" ]; then
         echo "Error: Failed to create ${SUBJ_ROI_DIR}/SMA_PMC_sub.nii.gz" >&2
-        exit 1
+        return 1
     fi
     flirt -in ${ROI}/STG.nii.gz -ref ${SUBDIR}/fsl_stats/sub-${subject}_task-motor_run-01_contrasts.feat/stats/zstat1.nii.gz -applyxfm -usesqform -out ${SUBJ_ROI_DIR}/STG_sub.nii.gz
     if [ ! -f "${SUBJ_ROI_DIR}/STG_sub.nii.gz" ]; then
         echo "Error: Failed to create ${SUBJ_ROI_DIR}/STG_sub.nii.gz" >&2
-        exit 1
+        return 1
     fi
     flirt -in ${ROI}/Heschl.nii.gz -ref ${SUBDIR}/fsl_stats/sub-${subject}_task-motor_run-01_contrasts.feat/stats/zstat1.nii.gz -applyxfm -usesqform -out ${SUBJ_ROI_DIR}/Heschl_sub.nii.gz
     if [ ! -f "${SUBJ_ROI_DIR}/Heschl_sub.nii.gz" ]; then
         echo "Error: Failed to create ${SUBJ_ROI_DIR}/Heschl_sub.nii.gz" >&2
-        exit 1
+        return 1
     fi
 
     # Split ROIs into left and right hemispheres in MNI space
@@ -170,7 +133,7 @@ preprocess_subject() {
     # Verify transformation file
     if [ ! -f "$TRANSFORM" ]; then
         echo "Error: Transform file does not exist: $TRANSFORM" >&2
-        exit 1
+        return 1
     fi
 
     # Inverse transform ROIs (whole and split) to native T1w space
@@ -213,44 +176,49 @@ process_post_stats() {
     # Subject directory and FEAT output paths
     SUBJ_ROI_DIR=$SUBDIR/ROI  # Subject-specific ROI directory
     OUTPUT_DIR=$SUBDIR/fsl_stats/sub-${subject}_task-${task}_contrasts.feat
-    fslmaths ${OUTPUT_DIR}/stats/zstat1.nii.gz -mas ${SUBDIR}/func/sub-${subject}_ses-01_task-${task}_space-MNI152NLin6Asym_desc-brain_mask.nii.gz ${OUTPUT_DIR}/stats/remasked_zstat1.nii.gz
-    fslmaths ${OUTPUT_DIR}/thresh_zstat1.nii.gz -mas ${SUBDIR}/func/sub-${subject}_ses-01_task-${task}_space-MNI152NLin6Asym_desc-brain_mask.nii.gz ${OUTPUT_DIR}/remasked_thresh_zstat1.nii.gz
+
+    # Scratch folder for ephemeral maps, removed when this task's subshell exits
+    artifact_init "${subject}_${task}"
+    trap artifact_cleanup EXIT
+
     ZSTAT=${OUTPUT_DIR}/stats/remasked_zstat1.nii.gz
-    THRESH_ZSTAT=${OUTPUT_DIR}/remasked_thresh_zstat1.nii.gz
+    THRESH_ZSTAT=$(ephemeral ${OUTPUT_DIR}/remasked_thresh_zstat1.nii.gz)
+    fslmaths ${OUTPUT_DIR}/stats/zstat1.nii.gz -mas ${SUBDIR}/func/sub-${subject}_ses-01_task-${task}_space-MNI152NLin6Asym_desc-brain_mask.nii.gz "$ZSTAT"
+    fsl_ephemeral fslmaths ${OUTPUT_DIR}/thresh_zstat1.nii.gz -mas ${SUBDIR}/func/sub-${subject}_ses-01_task-${task}_space-MNI152NLin6Asym_desc-brain_mask.nii.gz "$THRESH_ZSTAT"
     THRESH_ZSTAT_235=${OUTPUT_DIR}/stats/thresh_zstat1_235.nii.gz
-    ZSTAT_LEFT=${OUTPUT_DIR}/stats/zstat1_left.nii.gz
-    ZSTAT_RIGHT=${OUTPUT_DIR}/stats/zstat1_right.nii.gz
-    THRESH_ZSTAT_LEFT=${OUTPUT_DIR}/stats/thresh_zstat1_left.nii.gz
-    THRESH_ZSTAT_RIGHT=${OUTPUT_DIR}/stats/thresh_zstat1_right.nii.gz
-    THRESH_ZSTAT_LEFT_235=${OUTPUT_DIR}/stats/thresh_zstat1_left_235.nii.gz
-    THRESH_ZSTAT_RIGHT_235=${OUTPUT_DIR}/stats/thresh_zstat1_right_235.nii.gz
+    ZSTAT_LEFT=$(ephemeral ${OUTPUT_DIR}/stats/zstat1_left.nii.gz)
+    ZSTAT_RIGHT=$(ephemeral ${OUTPUT_DIR}/stats/zstat1_right.nii.gz)
+    THRESH_ZSTAT_LEFT=$(ephemeral ${OUTPUT_DIR}/stats/thresh_zstat1_left.nii.gz)
+    THRESH_ZSTAT_RIGHT=$(ephemeral ${OUTPUT_DIR}/stats/thresh_zstat1_right.nii.gz)
+    THRESH_ZSTAT_LEFT_235=$(ephemeral ${OUTPUT_DIR}/stats/thresh_zstat1_left_235.nii.gz)
+    THRESH_ZSTAT_RIGHT_235=$(ephemeral ${OUTPUT_DIR}/stats/thresh_zstat1_right_235.nii.gz)
     TFCE_CORRP=${OUTPUT_DIR}/randomise_time_series_tfce_corrp_tstat1.nii.gz
-    TFCE_CORRP_LEFT=${OUTPUT_DIR}/stats/randomise_time_series_tfce_corrp_tstat1_left.nii.gz
-    TFCE_CORRP_RIGHT=${OUTPUT_DIR}/stats/randomise_time_series_tfce_corrp_tstat1_right.nii.gz
+    TFCE_CORRP_LEFT=$(ephemeral ${OUTPUT_DIR}/stats/randomise_time_series_tfce_corrp_tstat1_left.nii.gz)
+    TFCE_CORRP_RIGHT=$(ephemeral ${OUTPUT_DIR}/stats/randomise_time_series_tfce_corrp_tstat1_right.nii.gz)
     t_map=${OUTPUT_DIR}/randomise_time_series_tstat1.nii.gz
     TFCE_CORRP_NATIVE=${OUTPUT_DIR}/stats/randomise_time_series_tfce_corrp_tstat1_native.nii.gz
     t_map_NATIVE=${OUTPUT_DIR}/stats/randomise_time_series_tstat1_native.nii.gz
-    t_map_LEFT=${OUTPUT_DIR}/stats/randomise_time_series_tstat1_left.nii.gz
-    t_map_RIGHT=${OUTPUT_DIR}/stats/randomise_time_series_tstat1_right.nii.gz
-    TFCE_CORRP_LEFT_NATIVE=${OUTPUT_DIR}/stats/randomise_time_series_tfce_corrp_tstat1_left_native.nii.gz
-    TFCE_CORRP_RIGHT_NATIVE=${OUTPUT_DIR}/stats/randomise_time_series_tfce_corrp_tstat1_right_native.nii.gz
-    t_map_LEFT_NATIVE=${OUTPUT_DIR}/stats/randomise_time_series_tstat1_left_native.nii.gz
-    t_map_RIGHT_NATIVE=${OUTPUT_DIR}/stats/randomise_time_series_tstat1_right_native.nii.gz
+    t_map_LEFT=$(ephemeral ${OUTPUT_DIR}/stats/randomise_time_series_tstat1_left.nii.gz)
+    t_map_RIGHT=$(ephemeral ${OUTPUT_DIR}/stats/randomise_time_series_tstat1_right.nii.gz)
+    TFCE_CORRP_LEFT_NATIVE=$(ephemeral ${OUTPUT_DIR}/stats/randomise_time_series_tfce_corrp_tstat1_left_native.nii.gz)
+    TFCE_CORRP_RIGHT_NATIVE=$(ephemeral ${OUTPUT_DIR}/stats/randomise_time_series_tfce_corrp_tstat1_right_native.nii.gz)
+    t_map_LEFT_NATIVE=$(ephemeral ${OUTPUT_DIR}/stats/randomise_time_series_tstat1_left_native.nii.gz)
+    t_map_RIGHT_NATIVE=$(ephemeral ${OUTPUT_DIR}/stats/randomise_time_series_tstat1_right_native.nii.gz)
     ICA_MAP=${OUTPUT_DIR}/sub-${subject}_${task}_dual_regression_maps.nii.gz
     ICA_MAP_THRESH=${OUTPUT_DIR}/sub-${subject}_${task}_ica_thresholded.nii.gz
-    ICA_MAP_LEFT=${OUTPUT_DIR}/stats/sub-${subject}_${task}_dual_regression_maps_left.nii.gz
-    ICA_MAP_RIGHT=${OUTPUT_DIR}/stats/sub-${subject}_${task}_dual_regression_maps_right.nii.gz
-    ICA_MAP_THRESH_LEFT=${OUTPUT_DIR}/stats/sub-${subject}_${task}_ica_thresholded_left.nii.gz
-    ICA_MAP_THRESH_RIGHT=${OUTPUT_DIR}/stats/sub-${subject}_${task}_dual_regression_maps_right.nii.gz
+    ICA_MAP_LEFT=$(ephemeral ${OUTPUT_DIR}/stats/sub-${subject}_${task}_dual_regression_maps_left.nii.gz)
+    ICA_MAP_RIGHT=$(ephemeral ${OUTPUT_DIR}/stats/sub-${subject}_${task}_dual_regression_maps_right.nii.gz)
+    ICA_MAP_THRESH_LEFT=$(ephemeral ${OUTPUT_DIR}/stats/sub-${subject}_${task}_ica_thresholded_left.nii.gz)
+    ICA_MAP_THRESH_RIGHT=$(ephemeral ${OUTPUT_DIR}/stats/sub-${subject}_${task}_dual_regression_maps_right.nii.gz)
     ZSTAT_NATIVE=${OUTPUT_DIR}/stats/zstat1_native.nii.gz
     THRESH_ZSTAT_NATIVE=${OUTPUT_DIR}/stats/thresh_zstat1_native.nii.gz
     THRESH_ZSTAT_235_NATIVE=${OUTPUT_DIR}/stats/thresh_zstat1_235_native.nii.gz
-    ZSTAT_LEFT_NATIVE=${OUTPUT_DIR}/stats/zstat1_left_native.nii.gz
-    ZSTAT_RIGHT_NATIVE=${OUTPUT_DIR}/stats/zstat1_right_native.nii.gz
-    THRESH_ZSTAT_LEFT_NATIVE=${OUTPUT_DIR}/stats/thresh_zstat1_left_native.nii.gz
-    THRESH_ZSTAT_RIGHT_NATIVE=${OUTPUT_DIR}/stats/thresh_zstat1_right_native.nii.gz
-    THRESH_ZSTAT_LEFT_NATIVE_235=${OUTPUT_DIR}/stats/thresh_zstat1_left_235_native.nii.gz
-    THRESH_ZSTAT_RIGHT_NATIVE_235=${OUTPUT_DIR}/stats/thresh_zstat1_right_235_native.nii.gz
+    ZSTAT_LEFT_NATIVE=$(ephemeral ${OUTPUT_DIR}/stats/zstat1_left_native.nii.gz)
+    ZSTAT_RIGHT_NATIVE=$(ephemeral ${OUTPUT_DIR}/stats/zstat1_right_native.nii.gz)
+    THRESH_ZSTAT_LEFT_NATIVE=$(ephemeral ${OUTPUT_DIR}/stats/thresh_zstat1_left_native.nii.gz)
+    THRESH_ZSTAT_RIGHT_NATIVE=$(ephemeral ${OUTPUT_DIR}/stats/thresh_zstat1_right_native.nii.gz)
+    THRESH_ZSTAT_LEFT_NATIVE_235=$(ephemeral ${OUTPUT_DIR}/stats/thresh_zstat1_left_235_native.nii.gz)
+    THRESH_ZSTAT_RIGHT_NATIVE_235=$(ephemeral ${OUTPUT_DIR}/stats/thresh_zstat1_right_235_native.nii.gz)
     TRANSFORM=${SUBDIR}/anat/sub-${subject}_ses-01_run-01_from-MNI152NLin6Asym_to-T1w_mode-image_xfm.h5
     T1W_SKULL_STRIPPED=${SUBDIR}/anat/sub-${subject}_ses-01_run-01_desc-brain_T1w.nii.gz
     
@@ -259,25 +227,32 @@ process_post_stats() {
     fslmaths "$ZSTAT" -thr $CLUSTER_THRESHOLD "$THRESH_ZSTAT_235"
     cluster -i "$THRESH_ZSTAT_235" -t $CLUSTER_THRESHOLD --mm --no_table
 
-    # Split z-maps and TFCE maps into left and right hemispheres in MNI space
+    # Split z-maps and TFCE maps into left and right hemispheres in MNI space (ephemeral, only read for the CSV)
     echo "Splitting z-maps, TFCE maps, and t-maps for sub-${subject} task-${task} in MNI space..."
-    fslmaths "$ZSTAT" -roi 1 45 -1 -1 -1 -1 0 1 "$ZSTAT_LEFT"
-    fslmaths "$ZSTAT" -roi 45 90 -1 -1 -1 -1 0 1 "$ZSTAT_RIGHT"
-    fslmaths "$THRESH_ZSTAT" -roi 1 45 -1 -1 -1 -1 0 1 "$THRESH_ZSTAT_LEFT"
-    fslmaths "$THRESH_ZSTAT" -roi 45 90 -1 -1 -1 -1 0 1 "$THRESH_ZSTAT_RIGHT"
-    fslmaths "$THRESH_ZSTAT_235" -roi 1 45 -1 -1 -1 -1 0 1 "$THRESH_ZSTAT_LEFT_235"
-    fslmaths "$THRESH_ZSTAT_235" -roi 45 90 -1 -1 -1 -1 0 1 "$THRESH_ZSTAT_RIGHT_235"
-    fslmaths "$TFCE_CORRP" -roi 1 45 -1 -1 -1 -1 0 1 "$TFCE_CORRP_LEFT"
-    fslmaths "$TFCE_CORRP" -roi 45 90 -1 -1 -1 -1 0 1 "$TFCE_CORRP_RIGHT"
-    fslmaths "$t_map" -roi 1 45 -1 -1 -1 -1 0 1 "$t_map_LEFT"
-    fslmaths "$t_map" -roi 45 90 -1 -1 -1 -1 0 1 "$t_map_RIGHT"
+    fsl_ephemeral fslmaths "$ZSTAT" -roi 1 45 -1 -1 -1 -1 0 1 "$ZSTAT_LEFT"
+    fsl_ephemeral fslmaths "$ZSTAT" -roi 45 90 -1 -1 -1 -1 0 1 "$ZSTAT_RIGHT"
+    fsl_ephemeral fslmaths "$THRESH_ZSTAT" -roi 1 45 -1 -1 -1 -1 0 1 "$THRESH_ZSTAT_LEFT"
+    fsl_ephemeral fslmaths "$THRESH_ZSTAT" -roi 45 90 -1 -1 -1 -1 0 1 "$THRESH_ZSTAT_RIGHT"
+    fsl_ephemeral fslmaths "$THRESH_ZSTAT_235" -roi 1 45 -1 -1 -1 -1 0 1 "$THRESH_ZSTAT_LEFT_235"
+    fsl_ephemeral fslmaths "$THRESH_ZSTAT_235" -roi 45 90 -1 -1 -1 -1 0 1 "$THRESH_ZSTAT_RIGHT_235"
+    fsl_ephemeral fslmaths "$TFCE_CORRP" -roi 1 45 -1 -1 -1 -1 0 1 "$TFCE_CORRP_LEFT"
+    fsl_ephemeral fslmaths "$TFCE_CORRP" -roi 45 90 -1 -1 -1 -1 0 1 "$TFCE_CORRP_RIGHT"
+    fsl_ephemeral fslmaths "$t_map" -roi 1 45 -1 -1 -1 -1 0 1 "$t_map_LEFT"
+    fsl_ephemeral fslmaths "$t_map" -roi 45 90 -1 -1 -1 -1 0 1 "$t_map_RIGHT"
 
     # Split ICA maps and thresholded ICA maps into left and right hemispheres in MNI space
-    echo "Splitting ICA maps and thresholded ICA maps for sub-${subject} task-${task} in MNI space..."
-    fslmaths "$ICA_MAP" -roi 1 45 -1 -1 -1 -1 0 1 "$ICA_MAP_LEFT"
-    fslmaths "$ICA_MAP" -roi 45 90 -1 -1 -1 -1 0 1 "$ICA_MAP_RIGHT"
-    fslmaths "$ICA_MAP_THRESH" -roi 1 45 -1 -1 -1 -1 0 1 "$ICA_MAP_THRESH_LEFT"
-    fslmaths "$ICA_MAP_THRESH" -roi 45 90 -1 -1 -1 -1 0 1 "$ICA_MAP_THRESH_RIGHT"
+    # (without ICA outputs the Z-stat and TFCE rows are still written and the ICA rows are skipped)
+    HAVE_ICA=0
+    if [ -f "$ICA_MAP" ] && [ -f "$ICA_MAP_THRESH" ]; then
+        HAVE_ICA=1
+        echo "Splitting ICA maps and thresholded ICA maps for sub-${subject} task-${task} in MNI space..."
+        fsl_ephemeral fslmaths "$ICA_MAP" -roi 1 45 -1 -1 -1 -1 0 1 "$ICA_MAP_LEFT"
+        fsl_ephemeral fslmaths "$ICA_MAP" -roi 45 90 -1 -1 -1 -1 0 1 "$ICA_MAP_RIGHT"
+        fsl_ephemeral fslmaths "$ICA_MAP_THRESH" -roi 1 45 -1 -1 -1 -1 0 1 "$ICA_MAP_THRESH_LEFT"
+        fsl_ephemeral fslmaths "$ICA_MAP_THRESH" -roi 45 90 -1 -1 -1 -1 0 1 "$ICA_MAP_THRESH_RIGHT"
+    else
+        echo "Warning: ICA maps missing for sub-${subject} task-${task} ($ICA_MAP); ICA rows are skipped"
+    fi
     
     # Inverse transform z-maps, TFCE corrp, t-maps, and thresholded TFCE corrp to native T1w space
     echo "Inverse transforming z-maps, TFCE maps, t-maps, and thresholded TFCE maps for sub-${subject} task-${task}..."
@@ -339,10 +314,10 @@ process_post_stats() {
         return 1
     fi
 
-    # Output CSV file with added Dice and dual Coverage columns
+    # Output CSV file with added Dice and dual Coverage columns, written by roi_stats.py from CSV_ROWS
     mkdir -p "${SUBDIR}/post_stats"
     CSV_FILE=${SUBDIR}/post_stats/sub-${subject}_task-${task}_roi_stats.csv
-    echo "Subject,Task,Space,ROI,Threshold,Stat Type,Activated Voxels across Whole Brain (counts),Activated Voxels within ROI (counts),Activated Voxels across Whole Brain (%),Activated Voxels within ROI (%),Activated ROI/WB (%),%Activated ROI/%Activated WB (ratio),Voxels in ROI (counts),Voxels in Whole Brain (counts),Dice Coefficient,Coverage T-map (%),Coverage Z-map (%),Coverage T-map ROI (%),Coverage Z-map ROI (%)" > "$CSV_FILE"
+    CSV_ROWS=()
 
     # Process MNI and NATIVE space
     for space in "MNI" "Native"; do
@@ -453,35 +428,9 @@ process_post_stats() {
                     fi
                 fi
 
-                # Total voxels in the z-map (whole brain or hemisphere)
-                total_voxels=$(fslstats "$z_map" -V | awk '{print $1}')
-                # Total voxels in the ROI mask
-                roi_voxels=$(fslstats "$roi_path" -V | awk '{print $1}')
-
-                # Activated voxels in thresh_z_map (whole brain or hemisphere)
-                activated_voxels_wb=$(fslstats "$thresh_z_map" -k "$z_map" -l 0 -V | awk '{print $1}')
-                # Activated voxels in thresh_z_map within ROI
-                activated_voxels_roi=$(fslstats "$thresh_z_map" -k "$roi_path" -l 0 -V | awk '{print $1}')
-
-                # Calculate percentages
-                percentage_wb=$(calculate_percentage "$activated_voxels_wb" "$total_voxels")
-                percentage_roi=$(calculate_percentage "$activated_voxels_roi" "$roi_voxels")
-                percentage_roi_in_wb=$(calculate_percentage "$activated_voxels_roi" "$total_voxels")
-                if [ "$(echo "$percentage_wb > 0" | bc)" -eq 1 ]; then
-                    ratio_actv_roi_in_wb=$(printf "%.3f" $(bc -l <<< "scale=2; $percentage_roi / $percentage_wb"))
-                else
-                    ratio_actv_roi_in_wb="N/A"
-                fi
-
-                # Dice and coverage are N/A for Z-stat
-                dice="N/A"
-                coverage_t="N/A"
-                coverage_z="N/A"
-                coverage_t_roi="N/A"
-                coverage_z_roi="N/A"
-
-                # Append to CSV with "Z-stat" type
-                echo "$subject,$task,$space,$roi_label,$thresh_label,Z-stat,$activated_voxels_wb,$activated_voxels_roi,$percentage_wb,$percentage_roi,$percentage_roi_in_wb,$ratio_actv_roi_in_wb,$roi_voxels,$total_voxels,$dice,$coverage_t,$coverage_z,$coverage_t_roi,$coverage_z_roi" >> "$CSV_FILE"
+                # Voxels of the z-map (whole brain or hemisphere) and ROI; activated voxels of thresh_z_map
+                # within the z-map and within the ROI; Dice and coverage are N/A for Z-stat
+                add_csv_row "$space" "$roi_label" "$thresh_label" "Z-stat" "$z_map" "$roi_path" "$thresh_z_map" "$z_map" ""
             done
         done
 
@@ -512,54 +461,15 @@ process_post_stats() {
                 t_map_use="$t_map_RIGHT_USE"
             fi
 
-            # Total voxels in the t-map (whole brain or hemisphere)
-            total_voxels=$(fslstats "$t_map_use" -V | awk '{print $1}')
-            # Total voxels in the ROI mask
-            roi_voxels=$(fslstats "$roi_path" -V | awk '{print $1}')
-
-            # Activated voxels in tfce_map with values > 0, masked by t_map (whole brain or hemisphere)
-            if [ ! -f "$t_map_use" ]; then
-                echo "Error: t_map not found at $t_map_use" >&2
-                activated_voxels_wb=0
-            else
-                activated_voxels_wb=$(fslstats "$tfce_map" -l 0 -V | awk '{print $1}')
-            fi
-            # Activated voxels in tfce_map within ROI with values > 0
-            activated_voxels_roi=$(fslstats "$tfce_map" -k "$roi_path" -l 0 -V | awk '{print $1}')
-
-            # Calculate percentages
-            percentage_wb=$(calculate_percentage "$activated_voxels_wb" "$total_voxels")
-            percentage_roi=$(calculate_percentage "$activated_voxels_roi" "$roi_voxels")
-            percentage_roi_in_wb=$(calculate_percentage "$activated_voxels_roi" "$total_voxels")
-            if [ "$(echo "$percentage_wb > 0" | bc)" -eq 1 ]; then
-                ratio_actv_roi_in_wb=$(printf "%.3f" $(bc -l <<< "scale=3; $percentage_roi / $percentage_wb"))
-            else
-                ratio_actv_roi_in_wb="N/A"
-            fi
-
-            # Calculate Dice and Coverage for tfce_map (values > 0) vs. Z=3.1
-            dice=$(calculate_dice "$tfce_map" "$thresh_z_map")
-            coverage_values=$(calculate_coverage "$tfce_map" "$thresh_z_map")
-            coverage_t=$(echo "$coverage_values" | cut -d',' -f1)
-            coverage_z=$(echo "$coverage_values" | cut -d',' -f2)
-
-            # Calculate ROI-specific coverage percentages
-            activated_voxels_roi_z=$(fslstats "$thresh_z_map" -k "$roi_path" -l 0 -V | awk '{print $1}')
-            overlap_roi=$(fslstats "$tfce_map" -k "$thresh_z_map" -k "$roi_path" -l 0 -V | awk '{print $1}')
-            coverage_t_roi="0.0"
-            coverage_z_roi="0.0"
-            if [ "$activated_voxels_roi" -gt 0 ]; then
-                coverage_t_roi=$(calculate_percentage "$overlap_roi" "$activated_voxels_roi")
-            fi
-            if [ "$activated_voxels_roi_z" -gt 0 ]; then
-                coverage_z_roi=$(calculate_percentage "$overlap_roi" "$activated_voxels_roi_z")
-            fi
-
-            # Append to CSV with "TFCE" type
-            echo "$subject,$task,$space,$roi_label,$thresh_label,TFCE,$activated_voxels_wb,$activated_voxels_roi,$percentage_wb,$percentage_roi,$percentage_roi_in_wb,$ratio_actv_roi_in_wb,$roi_voxels,$total_voxels,$dice,$coverage_t,$coverage_z,$coverage_t_roi,$coverage_z_roi" >> "$CSV_FILE"
+            # Voxels of the t-map (whole brain or hemisphere) and ROI; tfce_map values > 0 across the
+            # whole map and within the ROI; Dice and coverage (whole map and ROI) against Z=3.1
+            add_csv_row "$space" "$roi_label" "$thresh_label" "TFCE" "$t_map_use" "$roi_path" "$tfce_map" "" "$thresh_z_map"
         done
 
         # Process thresholded ICA maps (Z=3.1) and compare with Z=3.1 z-map
+        if [ "$HAVE_ICA" -ne 1 ]; then
+            continue
+        fi
         thresh_label="Z=3.1"
         if [[ "$task" == "motor_run-01" || "$task" == "motor_run-02" ]]; then
             roi_labels=("Whole-brain" "Left" "Right")
@@ -586,48 +496,20 @@ process_post_stats() {
                 thresh_z_map="$THRESH_ZSTAT_RIGHT_USE"  # Compare with Z=3.1
             fi
 
-            # Total voxels in the ica_map (whole brain or hemisphere)
-            total_voxels=$(fslstats "$ica_map" -V | awk '{print $1}')
-            # Total voxels in the ROI mask
-            roi_voxels=$(fslstats "$roi_path" -V | awk '{print $1}')
-
-            # Activated voxels in thresh_ica_map (whole brain or hemisphere)
-            activated_voxels_wb=$(fslstats "$thresh_ica_map" -k "$ica_map" -l 0 -V | awk '{print $1}')
-            # Activated voxels in thresh_ica_map within ROI
-            activated_voxels_roi=$(fslstats "$thresh_ica_map" -k "$roi_path" -l 0 -V | awk '{print $1}')
-
-            # Calculate percentages
-            percentage_wb=$(calculate_percentage "$activated_voxels_wb" "$total_voxels")
-            percentage_roi=$(calculate_percentage "$activated_voxels_roi" "$roi_voxels")
-            percentage_roi_in_wb=$(calculate_percentage "$activated_voxels_roi" "$total_voxels")
-            if [ "$(echo "$percentage_wb > 0" | bc)" -eq 1 ]; then
-                ratio_actv_roi_in_wb=$(printf "%.3f" $(bc -l <<< "scale=3; $percentage_roi / $percentage_wb"))
-            else
-                ratio_actv_roi_in_wb="N/A"
-            fi
-
-            # Calculate Dice and Coverage for thresholded ICA map vs. Z=3.1
-            dice=$(calculate_dice "$thresh_ica_map" "$thresh_z_map")
-            coverage_values=$(calculate_coverage "$thresh_ica_map" "$thresh_z_map")
-            coverage_t=$(echo "$coverage_values" | cut -d',' -f1)
-            coverage_z=$(echo "$coverage_values" | cut -d',' -f2)
-
-            # Calculate ROI-specific coverage percentages
-            activated_voxels_roi_z=$(fslstats "$thresh_z_map" -k "$roi_path" -l 0 -V | awk '{print $1}')
-            overlap_roi=$(fslstats "$thresh_ica_map" -k "$thresh_z_map" -k "$roi_path" -l 0 -V | awk '{print $1}')
-            coverage_t_roi="0.0"
-            coverage_z_roi="0.0"
-            if [ "$activated_voxels_roi" -gt 0 ]; then
-                coverage_t_roi=$(calculate_percentage "$overlap_roi" "$activated_voxels_roi")
-            fi
-            if [ "$activated_voxels_roi_z" -gt 0 ]; then
-                coverage_z_roi=$(calculate_percentage "$overlap_roi" "$activated_voxels_roi_z")
-            fi
-
-            # Append to CSV with "ICA" type
-            echo "$subject,$task,$space,$roi_label,$thresh_label,ICA,$activated_voxels_wb,$activated_voxels_roi,$percentage_wb,$percentage_roi,$percentage_roi_in_wb,$ratio_actv_roi_in_wb,$roi_voxels,$total_voxels,$dice,$coverage_t,$coverage_z,$coverage_t_roi,$coverage_z_roi" >> "$CSV_FILE"
+            # Voxels of the ica_map (whole brain or hemisphere) and ROI; activated voxels of thresh_ica_map
+            # within the ica_map and within the ROI; Dice and coverage (whole map and ROI) against Z=3.1
+            add_csv_row "$space" "$roi_label" "$thresh_label" "ICA" "$ica_map" "$roi_path" "$thresh_ica_map" "$ica_map" "$thresh_z_map"
         done
     done
+
+    # Count every row from sparse maps (each map read once) and write the CSV, together with the sparse
+    # sidecars (<map>.sparse.npz) of the persisted thresholded maps; ROI masks get theirs on first use
+    local sparse_inputs=("${OUTPUT_DIR}/thresh_zstat1.nii.gz" "$THRESH_ZSTAT_235" "$TFCE_CORRP")
+    if [ $HAVE_ICA -eq 1 ]; then
+        sparse_inputs+=("$ICA_MAP_THRESH")
+    fi
+    printf '%s\n' "${CSV_ROWS[@]}" | "$PYTHON" "$ROI_STATS" --subject "$subject" --task "$task" --csv "$CSV_FILE" \
+        --sidecars "${sparse_inputs[@]}"
     echo "Completed post-stats processing for sub-${subject} task-${task}"
     echo "Results saved to $CSV_FILE"
 }
@@ -635,21 +517,47 @@ process_post_stats() {
 # Export functions for potential parallel use
 export -f preprocess_subject
 export -f process_post_stats
-export -f calculate_percentage
-export -f calculate_dice
-export -f calculate_coverage
+export -f add_csv_row
 
-# Main processing loop using command-line arguments
+# Main processing loop using command-line arguments.
+# A failed subject or task is reported and the others keep running; the exit status is 1 if anything failed.
+FAILED=""
 for subject in "$@"; do
-    echo "Preprocessing sub-${subject} (skull-stripping and ROI transformation)"
-    preprocess_subject "$subject"
+    SUBDIR=${DATADIR}/sub-${subject}/ses-01
+    if [ "$POST_STATS_STEP" != "tasks" ]; then
+        echo "Preprocessing sub-${subject} (skull-stripping and ROI transformation)"
+        set +e
+        ( preprocess_subject "$subject" )
+        rc=$?
+        set -e
+        if [ $rc -ne 0 ]; then
+            echo "Error: ROI preparation failed for sub-${subject}; skipping its tasks." >&2
+            FAILED="$FAILED sub-${subject}"
+            continue
+        fi
+    fi
+    if [ "$POST_STATS_STEP" == "rois" ]; then
+        continue
+    fi
+    mkdir -p "$SUBDIR/post_stats"
+    pids=()
+    pid_tasks=()
     for task in $TASKS; do
         echo "Processing post-stats for sub-${subject} task-${task}"
-        mkdir -p "$SUBDIR/post_stats"
         process_post_stats "$subject" "$task" > "$SUBDIR/post_stats/log_${subject}_${task}.txt" 2>&1 &
+        pids+=($!)
+        pid_tasks+=("$task")
+    done
+    for i in "${!pids[@]}"; do
+        if ! wait "${pids[$i]}"; then
+            echo "Error: post-stats failed for sub-${subject} task-${pid_tasks[$i]}; see $SUBDIR/post_stats/log_${subject}_${pid_tasks[$i]}.txt" >&2
+            FAILED="$FAILED sub-${subject}/${pid_tasks[$i]}"
+        fi
     done
-    wait
 done
 
-wait
-echo "All processing completed for subjects: $@"
\ No newline at end of file
+if [ -n "$FAILED" ]; then
+    echo "Processing completed with failures:$FAILED"
+    exit 1
+fi
+echo "All processing completed for subjects: $@"
@@ -0,0 +1,182 @@
+#!/opt/anaconda3/bin/python
+# Python 3.8.20
+# carpet.py: Carpet plots (voxels x time) of each FEAT run from a stratified voxel sample
+# Created for RECOVER project, Oct 2026
+#
+# Instead of plotting every brain voxel, about MAX_ROWS voxels are drawn, grouped into strata
+# in this order: the task ROIs (SMA + PMC, STG, Heschl), then grey matter, white matter and CSF
+# from the fMRIPrep MNI152NLin6Asym dseg when it exists (otherwise the rest of the brain as one stratum).
+# Each stratum gets rows in proportion to its size (at least MIN_ROWS, or all its voxels), drawn
+# with a fixed seed and kept in index order so reads stay local. filtered_func_data is streamed
+# from its memory-mapped working copy in chunks of CHUNK_SIZE volumes, keeping only the sampled
+# voxels, so memory is a few volumes plus the (rows, volumes) sample. Rows are z-scored, clipped
+# to +/-CLIP and quantised to uint8, and the PNG is drawn straight from that array.
+# Output: post_stats/sub-<id>_task-<task>_carpet.png, shown in the report's Signal QC tab.
+# Runs are skipped when the PNG is newer than filtered_func_data.
+# Usage: python carpet.py --sub_dir DIR [--tasks "..."] [--rows N] [--force] <subject_id>
+
+import os
+import sys
+import logging
+import argparse
+import numpy as np
+import nibabel as nib
+from nifti_cache import load_img
+import layout_index
+
+# Set up logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+DEFAULT_TASKS = "motor_run-01 motor_run-02 lang"
+CHUNK_SIZE = 20  # Volumes decoded per read
+MAX_ROWS = 1200  # Voxels drawn per carpet
+MIN_ROWS = 40  # Rows kept for a small stratum (if it has that many voxels)
+CLIP = 2.5  # z-score range mapped onto the grey scale
+SEED = 0
+MNI_SPACE = "MNI152NLin6Asym"  # Template of the fMRIPrep outputs the FEAT runs are on
+# Stratum label -> subject ROI file (MNI, on the FEAT grid)
+ROI_STRATA = [('SMA + PMC', "SMA_PMC_sub.nii.gz"), ('STG', "STG_sub.nii.gz"), ('Heschl', "Heschl_sub.nii.gz")]
+# fMRIPrep dseg label -> tissue stratum
+TISSUE_STRATA = [(1, 'GM'), (2, 'WM'), (3, 'CSF')]
+STRATUM_COLOURS = {'SMA + PMC': '#38cb82', 'STG': '#2f7fd8', 'Heschl': '#b404f8', 'GM': '#e0a030',
+                   'WM': '#d8d8d8', 'CSF': '#60c8e8', 'Brain': '#e0a030'}
+
+
+def carpet_path(sub_dir, subject, task):
+    return os.path.join(sub_dir, "post_stats", f"sub-{subject}_task-{task}_carpet.png")
+
+
+def strata(sub_dir, subject, feat_dir, ref_img, first_volume):
+    """[(label, sorted flat indices)] of the brain voxels, ROIs first; each voxel belongs to one stratum."""
+    import resample_cache
+    shape = ref_img.shape[:3]
+    mask_file = os.path.join(feat_dir, "mask.nii.gz")
+    if os.path.exists(mask_file):
+        brain = np.asarray(load_img(mask_file).dataobj).reshape(shape) > 0
+    else:
+        brain = first_volume != 0
+    free = brain.ravel().copy()
+    groups = []
+    for label, name in ROI_STRATA:
+        path = os.path.join(sub_dir, "ROI", name)
+        if not os.path.exists(path):
+            continue
+        roi = np.asarray(resample_cache.resampled(path, ref_img, interpolation='nearest').dataobj).reshape(-1) > 0
+        index = np.flatnonzero(roi & free)
+        free[index] = False
+        groups.append((label, index))
+
+    layout = layout_index.get_index(os.path.dirname(os.path.dirname(os.path.abspath(sub_dir))))
+    layout.refresh_subject(subject)
+    dseg = layout.get(subject=subject, datatype='anat', space=MNI_SPACE, desc='', suffix='dseg', ext='.nii.gz')
+    if dseg:
+        labels = np.asarray(resample_cache.resampled(dseg, ref_img, interpolation='nearest').dataobj).reshape(-1)
+        for value, label in TISSUE_STRATA:
+            groups.append((label, np.flatnonzero(free & (np.rint(labels) == value))))
+    else:
+        groups.append(('Brain', np.flatnonzero(free)))
+    return [(label, index) for label, index in groups if index.size]
+
+
+def sample_rows(groups, max_rows=MAX_ROWS, min_rows=MIN_ROWS, seed=SEED):
+    """[(label, sampled sorted flat indices)], rows allocated in proportion to stratum size."""
+    rng = np.random.default_rng(seed)
+    total = sum(index.size for _, index in groups)
+    sampled = []
+    for label, index in groups:
+        n = min(index.size, max(min_rows, int(round(max_rows * index.size / max(total, 1)))))
+        sampled.append((label, np.sort(rng.choice(index, n, replace=False)) if n < index.size else index))
+    return sampled
+
+
+def stream_rows(img, index, chunk_size=CHUNK_SIZE):
+    """(voxels, volumes) float32 time series of the flat indices, reading chunk_size volumes at a time."""
+    n_vols = img.shape[3]
+    rows = np.empty((index.size, n_vols), dtype=np.float32)
+    for start in range(0, n_vols, chunk_size):
+        stop = min(start + chunk_size, n_vols)
+        rows[:, start:stop] = np.asarray(img.dataobj[..., start:stop], dtype=np.float32).reshape(-1, stop - start)[index]
+    return rows
+
+
+def quantise(rows, clip=CLIP):
+    """Row-wise z-scores clipped to +/-clip, as uint8 grey levels."""
+    rows = rows - rows.mean(axis=1, keepdims=True)
+    std = rows.std(axis=1, keepdims=True)
+    std[std == 0] = 1
+    scaled = (np.clip(rows / std, -clip, clip) + clip) * (255 / (2 * clip))
+    return np.rint(scaled).astype(np.uint8)
+
+
+def render(carpet, sampled, tr, title, png_path, dpi=100):
+    """Write the uint8 carpet with a stratum colour strip and labels."""
+    import matplotlib.pyplot as plt
+    from matplotlib.colors import to_rgb
+    strip = np.vstack([np.tile(np.array(to_rgb(STRATUM_COLOURS[label])), (index.size, 1)) for label, index in sampled])
+    fig, (ax_strip, ax) = plt.subplots(1, 2, figsize=(10, 4), gridspec_kw={'width_ratios': [1, 40], 'wspace': 0.01})
+    ax_strip.imshow(strip[:, None, :], aspect='auto', interpolation='nearest')
+    ax_strip.set_xticks([])
+    bounds = np.cumsum([0] + [index.size for _, index in sampled])
+    ax_strip.set_yticks((bounds[:-1] + bounds[1:]) / 2)
+    ax_strip.set_yticklabels([label for label, _ in sampled], fontsize=7)
+    ax.imshow(carpet, aspect='auto', interpolation='nearest', cmap='gray', vmin=0, vmax=255)
+    for bound in bounds[1:-1]:
+        ax.axhline(bound - 0.5, color='#ff5050', linewidth=0.8)
+    ax.set_yticks([])
+    ax.set_xlabel(f"Volume (TR = {tr:g} s)" if tr else "Volume", fontsize=8)
+    ax.tick_params(axis='x', labelsize=7)
+    ax.set_title(title, fontdict={'fontweight': 'bold', 'fontsize': 10})
+    fig.savefig(png_path, dpi=dpi, bbox_inches='tight')
+    plt.close(fig)
+    return png_path
+
+
+def carpet_task(sub_dir, subject, task, force=False, max_rows=MAX_ROWS, chunk_size=CHUNK_SIZE):
+    """Write the carpet plot of one task; returns its path (None if the run is missing)."""
+    layout = layout_index.get_index(os.path.dirname(os.path.dirname(os.path.abspath(sub_dir))))
+    feat_dir = layout.feat_dir(subject, task) or os.path.join(sub_dir, "fsl_stats", f"sub-{subject}_task-{task}_contrasts.feat")
+    func_file = os.path.join(feat_dir, "filtered_func_data.nii.gz")
+    if not os.path.exists(func_file):
+        logging.error(f"filtered_func_data not found for sub-{subject} {task}: {func_file}")
+        return None
+    png_path = carpet_path(sub_dir, subject, task)
+    if not force and os.path.exists(png_path) and os.path.getmtime(png_path) >= os.path.getmtime(func_file):
+        logging.info(f"Carpet plot up to date: {png_path}")
+        return png_path
+
+    img = load_img(func_file)  # Memory-mapped working copy
+    ref_img = nib.Nifti1Image(np.zeros(img.shape[:3], dtype=np.uint8), img.affine)
+    groups = strata(sub_dir, subject, feat_dir, ref_img, np.asarray(img.dataobj[..., 0]))
+    sampled = sample_rows(groups, max_rows)
+    index = np.concatenate([i for _, i in sampled])
+    carpet = quantise(stream_rows(img, index, chunk_size))
+    zooms = img.header.get_zooms()
+    tr = float(zooms[3]) if len(zooms) > 3 else 0.0
+    os.makedirs(os.path.dirname(png_path), exist_ok=True)
+    render(carpet, sampled, tr, f"sub-{subject} {task}: {carpet.shape[0]} of "
+           f"{sum(g.size for _, g in groups)} brain voxels", png_path)
+    logging.info(f"Carpet plot ({carpet.shape[0]} voxels x {carpet.shape[1]} volumes) saved to {png_path}")
+    return png_path
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Carpet plots of each FEAT run from a stratified voxel sample")
+    parser.add_argument("--sub_dir", required=True, help="Subject session folder (derivatives/sub-<id>/ses-01)")
+    parser.add_argument("--tasks", default=os.environ.get('TASKS', DEFAULT_TASKS), help="Space-separated tasks")
+    parser.add_argument("--rows", type=int, default=MAX_ROWS, help="Voxels drawn per carpet")
+    parser.add_argument("--chunk-size", type=int, default=CHUNK_SIZE, help="Volumes read per chunk")
+    parser.add_argument("--force", action="store_true", help="Redraw even if the plot is up to date")
+    parser.add_argument("subject", help="Subject ID")
+    args = parser.parse_args(argv)
+
+    import matplotlib
+    matplotlib.use(os.environ.get('MPLBACKEND', 'Agg'))
+    failed = 0
+    for task in args.tasks.split():
+        if carpet_task(args.sub_dir, args.subject, task, args.force, args.rows, args.chunk_size) is None:
+            failed += 1
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
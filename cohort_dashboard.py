@@ -0,0 +1,175 @@
+#!/opt/anaconda3/bin/python
+# Python 3.8.20
+# cohort_dashboard.py: Cohort index page with a sortable ROI summary and per-subject detail tabs loaded on demand
+# Created for RECOVER project, Oct 2026
+#
+# Reads each subject's post-stats CSVs (post_stats/sub-<id>_task-<task>_roi_stats.csv) and writes
+# to <out_dir> (default $ARCHIVEDIR/group/dashboard):
+#   index.html                 summary table (one row per subject and task: MNI counts and
+#                              percentages of the task's main ROI, TFCE vs Z=3.1 Dice, cohort
+#                              similarity from cohort_similarity.py when available), sortable and filterable
+#   subjects/sub-<id>.js       all CSV rows of the subject and links to its reports, as JSON passed to
+#                              subjectLoaded(); loaded only when the subject's tab is first opened
+#   subjects/sub-<id>.summary.json   the subject's summary rows, reused while its CSVs and reports are unchanged
+# The page itself only carries the summary rows, so it stays small with hundreds of subjects.
+# Usage: python cohort_dashboard.py [--out_dir DIR] [<subject_id1> ...]   (default: every subject with CSVs)
+
+import os
+import csv
+import sys
+import glob
+import json
+import time
+import logging
+import argparse
+from html_template import DASHBOARD_TEMPLATE
+
+# Set up logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+DEFAULT_TASKS = "motor_run-01 motor_run-02 lang"
+# Main ROI of each task in the summary table (CSV "ROI" label)
+SUMMARY_ROIS = {'motor_run-01': 'Whole-brain', 'motor_run-02': 'Whole-brain', 'lang': 'Whole-brain STG'}
+SUMMARY_COLUMNS = ['Subject', 'Task', 'ROI', 'Z=3.1 WB Voxels', 'Z=3.1 ROI (%)', 'Z=3.1 ROI/WB Ratio',
+                   'Z=2.35 ROI (%)', 'TFCE ROI (%)', 'TFCE vs Z=3.1 Dice', 'ICA ROI (%)', 'Cohort Mean Dice (Z=3.1)']
+SUMMARY_VERSION = 1
+
+
+def stats_csv(datadir, subject, task):
+    return os.path.join(datadir, f"sub-{subject}", "ses-01", "post_stats", f"sub-{subject}_task-{task}_roi_stats.csv")
+
+
+def find_subjects(datadir):
+    """Subjects with at least one post-stats CSV."""
+    paths = glob.glob(os.path.join(datadir, "sub-*", "ses-01", "post_stats", "sub-*_task-*_roi_stats.csv"))
+    return sorted({os.path.basename(p).split('_task-')[0][len('sub-'):] for p in paths})
+
+
+def read_stats(path):
+    """(header, rows) of a post-stats CSV."""
+    with open(path, newline='') as f:
+        reader = csv.reader(f)
+        header = next(reader, [])
+        return header, [row for row in reader if row]
+
+
+def _summary_row(subject, task, header, rows):
+    """Summary values of the task's main ROI in MNI space."""
+    roi = SUMMARY_ROIS.get(task, 'Whole-brain')
+    by_type = {}
+    for row in rows:
+        record = dict(zip(header, row))
+        if record.get('Space') == 'MNI' and record.get('ROI') == roi:
+            by_type[(record.get('Stat Type'), record.get('Threshold'))] = record
+    z31 = by_type.get(('Z-stat', 'Z=3.1'), {})
+    z235 = by_type.get(('Z-stat', 'Z=2.35'), {})
+    tfce = next((r for (stat, _), r in by_type.items() if stat == 'TFCE'), {})
+    ica = next((r for (stat, _), r in by_type.items() if stat == 'ICA'), {})
+    return [subject, task, roi,
+            z31.get('Activated Voxels across Whole Brain (counts)', 'N/A'),
+            z31.get('Activated Voxels within ROI (%)', 'N/A'),
+            z31.get('%Activated ROI/%Activated WB (ratio)', 'N/A'),
+            z235.get('Activated Voxels within ROI (%)', 'N/A'),
+            tfce.get('Activated Voxels within ROI (%)', 'N/A'),
+            tfce.get('Dice Coefficient', 'N/A'),
+            ica.get('Activated Voxels within ROI (%)', 'N/A')]
+
+
+def _report_paths(datadir, subject):
+    post_stats = os.path.join(datadir, f"sub-{subject}", "ses-01", "post_stats")
+    return [("Task report", os.path.join(post_stats, f"sub-{subject}_task_pipeline_report.html")),
+            ("ICA report", os.path.join(post_stats, f"sub-{subject}_ica_report_alltasks.html")),
+            ("Task report (PDF)", os.path.join(post_stats, f"sub-{subject}_task_pipeline_report.pdf"))]
+
+
+def _report_links(datadir, subject, out_dir):
+    return [[label, os.path.relpath(path, out_dir)]
+            for label, path in _report_paths(datadir, subject) if os.path.exists(path)]
+
+
+def _write(path, text):
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, 'w') as f:
+        f.write(text)
+    os.replace(tmp_path, path)
+
+
+def subject_summary(datadir, subject, tasks, out_dir):
+    """Summary rows of one subject, rewriting its detail file only when a CSV or report changed."""
+    subjects_dir = os.path.join(out_dir, "subjects")
+    summary_path = os.path.join(subjects_dir, f"sub-{subject}.summary.json")
+    csvs = {task: stats_csv(datadir, subject, task) for task in tasks}
+    paths = list(csvs.values()) + [path for _, path in _report_paths(datadir, subject)]
+    stamp = [SUMMARY_VERSION] + [os.path.getmtime(p) if os.path.exists(p) else 0 for p in paths]
+    if os.path.exists(summary_path):
+        with open(summary_path) as f:
+            cached = json.load(f)
+        if cached.get('stamp') == stamp and os.path.exists(os.path.join(subjects_dir, f"sub-{subject}.js")):
+            return cached['rows']
+
+    rows, detail = [], {'subject': subject, 'columns': [], 'tasks': [],
+                        'reports': _report_links(datadir, subject, out_dir)}
+    for task, path in csvs.items():
+        if not os.path.exists(path):
+            continue
+        header, csv_rows = read_stats(path)
+        detail['columns'] = header
+        detail['tasks'].append({'task': task, 'rows': csv_rows})
+        rows.append(_summary_row(subject, task, header, csv_rows))
+    _write(os.path.join(subjects_dir, f"sub-{subject}.js"),
+           f"subjectLoaded({json.dumps(subject)}, {json.dumps(detail, separators=(',', ':'))});\n")
+    _write(summary_path, json.dumps({'stamp': stamp, 'rows': rows}))
+    return rows
+
+
+def cohort_dice(group_dir, tasks):
+    """{(subject, task): (mean Dice, outlier)} from cohort_similarity.py's Z=3.1 rankings."""
+    similarity = {}
+    for task in tasks:
+        path = os.path.join(group_dir, f"{task}_z31_outliers.csv")
+        if not os.path.exists(path):
+            continue
+        with open(path, newline='') as f:
+            for record in csv.DictReader(f):
+                similarity[(record['Subject'], task)] = (record['Mean Dice'], record['Outlier'] == 'True')
+    return similarity
+
+
+def build(datadir, out_dir, subjects, tasks, group_dir=None):
+    """Write the dashboard; returns the index path."""
+    os.makedirs(os.path.join(out_dir, "subjects"), exist_ok=True)
+    similarity = cohort_dice(group_dir, tasks) if group_dir else {}
+    summary = []
+    for subject in subjects:
+        for row in subject_summary(datadir, subject, tasks, out_dir):
+            mean_dice, outlier = similarity.get((row[0], row[1]), ('N/A', False))
+            summary.append(row + [mean_dice, outlier])
+    index_path = os.path.join(out_dir, "index.html")
+    _write(index_path, DASHBOARD_TEMPLATE.format(
+        n_subjects=len(subjects),
+        generated=time.strftime('%Y-%m-%d %H:%M'),
+        columns=json.dumps(SUMMARY_COLUMNS),
+        summary=json.dumps(summary, separators=(',', ':')),
+    ))
+    logging.info(f"Cohort dashboard for {len(subjects)} subjects saved at: {index_path}")
+    return index_path
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Cohort index page with per-subject detail tabs loaded on demand")
+    parser.add_argument("--tasks", default=os.environ.get('TASKS', DEFAULT_TASKS), help="Space-separated tasks")
+    parser.add_argument("--out_dir", default=None, help="Output folder (default: $ARCHIVEDIR/group/dashboard)")
+    parser.add_argument("subjects", nargs="*", help="Subject IDs (default: every subject with post-stats CSVs)")
+    args = parser.parse_args(argv)
+
+    archivedir = os.environ.get('ARCHIVEDIR', '')
+    datadir = os.environ.get('DATADIR', os.path.join(archivedir, "derivatives"))
+    group_dir = os.path.join(archivedir, "group")
+    out_dir = args.out_dir or os.path.join(group_dir, "dashboard")
+    subjects = args.subjects or find_subjects(datadir)
+    build(datadir, out_dir, subjects, args.tasks.split(), group_dir)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,194 @@
+#!/opt/anaconda3/bin/python
+# Python 3.8.20
+# cohort_similarity.py: Subject x subject Dice/Jaccard of binarized MNI activation maps, with an outlier ranking
+# Created for RECOVER project, Oct 2026
+#
+# For each task and threshold (z31: thresh_zstat1, z235: thresh_zstat1_235, tfce: TFCE 1-p >= 0.95)
+# every subject's map is binarized from its sparse sidecar (sparse_maps.py) and packed with
+# np.packbits into one row of a (subjects, bytes) bitset matrix, about 110 KB per MNI map. The
+# matrix is written once to a temporary .npy file that the workers memory-map; the upper triangle
+# is split into (block, block) tiles that a process pool reduces with AND + popcount, so each
+# pair costs one pass over 1/8 of a byte per voxel. Outputs in <out_dir> (default $ARCHIVEDIR/group):
+#   <task>_<threshold>_dice.csv, <task>_<threshold>_jaccard.csv   full matrices
+#   <task>_<threshold>_outliers.csv   subjects ranked by mean Dice to the rest of the cohort, with a
+#                                     robust z-score (median/MAD); Outlier is True below -OUTLIER_Z
+# Without subject IDs the cohort is every subject already in the task's group accumulators (group_maps.py).
+# Usage: python cohort_similarity.py [--tasks "..."] [--thresholds z31 z235 tfce] [--workers N] [<subject_id1> ...]
+
+import os
+import sys
+import shutil
+import logging
+import argparse
+import tempfile
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+import sparse_maps
+from group_maps import subject_maps, TFCE_THRESHOLD
+
+# Set up logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+DEFAULT_TASKS = "motor_run-01 motor_run-02 lang"
+THRESHOLDS = ('z31', 'z235', 'tfce')
+BLOCK_SIZE = 64  # Subjects per tile side
+OUTLIER_Z = 2.5
+# Set bits per byte value, for NumPy versions without np.bitwise_count
+POPCOUNT = np.array([bin(i).count('1') for i in range(256)], dtype=np.uint8)
+
+
+def popcount_rows(bits):
+    """Number of set bits in each row of a uint8 array."""
+    if hasattr(np, 'bitwise_count'):
+        return np.bitwise_count(bits).sum(axis=-1, dtype=np.int64)
+    return POPCOUNT[bits].sum(axis=-1, dtype=np.int64)
+
+
+def active_index(path, threshold):
+    """Sorted flat indices of the active voxels of a map and the map's shape."""
+    sparse_map = sparse_maps.load(path)
+    active = sparse_map.at_least(TFCE_THRESHOLD) if threshold == 'tfce' else sparse_map.above(0)
+    return active, sparse_map.shape
+
+
+def pack_cohort(datadir, subjects, task, threshold):
+    """(kept subjects, bitset matrix) of the subjects whose map exists on the common grid."""
+    kept, rows, shape = [], [], None
+    for subject in subjects:
+        path = subject_maps(datadir, subject, task)[threshold]
+        if not os.path.exists(path):
+            logging.warning(f"Missing {threshold} map for sub-{subject} {task}: {path}")
+            continue
+        active, map_shape = active_index(path, threshold)
+        if shape is None:
+            shape = map_shape
+        elif map_shape != shape:
+            logging.error(f"Skipping sub-{subject} {task}: grid {map_shape} differs from {shape}")
+            continue
+        mask = np.zeros(int(np.prod(shape)), dtype=bool)
+        mask[active] = True
+        rows.append(np.packbits(mask))
+        kept.append(subject)
+    bits = np.vstack(rows) if rows else np.zeros((0, 0), dtype=np.uint8)
+    return kept, bits
+
+
+def _tile(args):
+    """Intersection counts between the subjects of two blocks (rows read from the memory-mapped bitsets)."""
+    bits_path, i0, i1, j0, j1 = args
+    bits = np.load(bits_path, mmap_mode='r')
+    left, right = np.asarray(bits[i0:i1]), np.asarray(bits[j0:j1])
+    counts = np.empty((i1 - i0, j1 - j0), dtype=np.int64)
+    for r in range(i1 - i0):
+        counts[r] = popcount_rows(left[r] & right)
+    return i0, j0, counts
+
+
+def intersection_matrix(bits, workers=None, block_size=BLOCK_SIZE):
+    """Symmetric (subjects, subjects) matrix of |A ∩ B| from a packed bitset matrix."""
+    n = bits.shape[0]
+    inter = np.zeros((n, n), dtype=np.int64)
+    starts = list(range(0, n, block_size))
+    tmp_dir = tempfile.mkdtemp(prefix="cohort_similarity_")
+    try:
+        bits_path = os.path.join(tmp_dir, "bits.npy")
+        np.save(bits_path, bits)
+        tiles = [(bits_path, i, min(i + block_size, n), j, min(j + block_size, n))
+                 for a, i in enumerate(starts) for j in starts[a:]]
+        pool = ProcessPoolExecutor(max_workers=workers) if workers != 1 and len(tiles) > 1 else None
+        try:
+            for i0, j0, counts in (pool.map(_tile, tiles) if pool else map(_tile, tiles)):
+                inter[i0:i0 + counts.shape[0], j0:j0 + counts.shape[1]] = counts
+        finally:
+            if pool:
+                pool.shutdown()
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+    return np.triu(inter) + np.triu(inter, 1).T
+
+
+def similarity(inter):
+    """Dice and Jaccard matrices from intersection counts (the diagonal holds each map's size)."""
+    sizes = np.diag(inter).astype(np.float64)
+    total = sizes[:, None] + sizes[None, :]
+    with np.errstate(invalid='ignore', divide='ignore'):
+        dice = 2 * inter / total
+        jaccard = inter / (total - inter)
+    return dice, jaccard
+
+
+def outlier_ranking(subjects, dice, sizes, outlier_z=OUTLIER_Z):
+    """Subjects ranked from least to most similar to the rest of the cohort."""
+    import pandas as pd
+    others = dice.astype(np.float64).copy()
+    np.fill_diagonal(others, np.nan)
+    with np.errstate(invalid='ignore'):
+        mean_dice = np.nanmean(others, axis=1) if len(subjects) > 1 else np.full(len(subjects), np.nan)
+        median_dice = np.nanmedian(others, axis=1) if len(subjects) > 1 else np.full(len(subjects), np.nan)
+    centre = np.nanmedian(mean_dice) if np.isfinite(mean_dice).any() else np.nan
+    mad = 1.4826 * np.nanmedian(np.abs(mean_dice - centre)) if np.isfinite(mean_dice).any() else np.nan
+    with np.errstate(invalid='ignore', divide='ignore'):
+        robust_z = (mean_dice - centre) / mad if mad > 0 else np.zeros(len(subjects))
+    table = pd.DataFrame({
+        'Subject': subjects,
+        'Active Voxels': sizes.astype(int),
+        'Mean Dice': np.round(mean_dice, 4),
+        'Median Dice': np.round(median_dice, 4),
+        'Robust z': np.round(robust_z, 3),
+        'Outlier': robust_z < -outlier_z,
+    })
+    table = table.sort_values('Mean Dice', na_position='first').reset_index(drop=True)
+    table.insert(0, 'Rank', np.arange(1, len(table) + 1))
+    return table
+
+
+def cohort_subjects(group_dir, task):
+    """Subjects already in the task's group accumulators (group_maps.py)."""
+    state_path = os.path.join(group_dir, f"{task}_accumulators.npz")
+    if not os.path.exists(state_path):
+        return []
+    with np.load(state_path) as state:
+        return [str(s) for s in state['subjects']]
+
+
+def run_task(datadir, out_dir, task, subjects, thresholds, workers=None, outlier_z=OUTLIER_Z):
+    """Write the similarity matrices and outlier ranking of one task for each threshold."""
+    import pandas as pd
+    for threshold in thresholds:
+        kept, bits = pack_cohort(datadir, subjects, task, threshold)
+        if len(kept) < 2:
+            logging.warning(f"{task} {threshold}: fewer than two subjects with maps; skipping")
+            continue
+        inter = intersection_matrix(bits, workers)
+        dice, jaccard = similarity(inter)
+        prefix = os.path.join(out_dir, f"{task}_{threshold}")
+        pd.DataFrame(np.round(dice, 4), index=kept, columns=kept).to_csv(f"{prefix}_dice.csv", index_label='Subject')
+        pd.DataFrame(np.round(jaccard, 4), index=kept, columns=kept).to_csv(f"{prefix}_jaccard.csv", index_label='Subject')
+        ranking = outlier_ranking(kept, dice, np.diag(inter), outlier_z)
+        ranking.to_csv(f"{prefix}_outliers.csv", index=False)
+        flagged = ranking.loc[ranking['Outlier'], 'Subject'].tolist()
+        logging.info(f"{task} {threshold}: {len(kept)} subjects, outliers: {', '.join(flagged) if flagged else 'none'}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Pairwise Dice/Jaccard of activation maps across the cohort")
+    parser.add_argument("--tasks", default=os.environ.get('TASKS', DEFAULT_TASKS), help="Space-separated tasks")
+    parser.add_argument("--thresholds", nargs="+", choices=THRESHOLDS, default=list(THRESHOLDS), help="Binarized maps to compare")
+    parser.add_argument("--workers", type=int, default=None, help="Worker processes (default: CPU count)")
+    parser.add_argument("--outlier-z", type=float, default=OUTLIER_Z, help="Robust z below -Z flags an outlier")
+    parser.add_argument("--out_dir", default=None, help="Output folder (default: $ARCHIVEDIR/group)")
+    parser.add_argument("subjects", nargs="*", help="Subject IDs (default: subjects in the group accumulators)")
+    args = parser.parse_args(argv)
+
+    archivedir = os.environ.get('ARCHIVEDIR', '')
+    datadir = os.environ.get('DATADIR', os.path.join(archivedir, "derivatives"))
+    out_dir = args.out_dir or os.path.join(archivedir, "group")
+    os.makedirs(out_dir, exist_ok=True)
+    for task in args.tasks.split():
+        subjects = args.subjects or cohort_subjects(os.path.join(archivedir, "group"), task)
+        run_task(datadir, out_dir, task, subjects, args.thresholds, args.workers, args.outlier_z)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
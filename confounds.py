@@ -0,0 +1,128 @@
+#!/opt/anaconda3/bin/python
+# Python 3.8.20
+# confounds.py: Builds the spike-regressor confound file used by FEAT (replaces fsl_motion_outliers)
+# Created for RECOVER project, Oct 2026
+#
+# The spike regressors are taken from the fMRIPrep confounds TSV when it exists.
+# Otherwise DVARS is computed by streaming the 4D BOLD run in volume chunks, so
+# only one chunk and the previous volume are held in memory at a time.
+# The output has the same layout as fsl_motion_outliers: one column per outlier
+# volume with a 1 at that volume and 0 elsewhere.
+
+import os
+import argparse
+import logging
+import numpy as np
+import pandas as pd
+from nifti_cache import load_img
+
+# Set up logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+# Spike thresholds used in the fMRIPrep command (--fd-spike-threshold, --dvars-spike-threshold)
+FD_SPIKE_THRESHOLD = 0.5
+DVARS_SPIKE_THRESHOLD = 1.5
+CHUNK_SIZE = 20  # Volumes decoded per read when streaming the BOLD run
+
+
+def spikes_from_tsv(tsv_file, fd_threshold=FD_SPIKE_THRESHOLD, dvars_threshold=DVARS_SPIKE_THRESHOLD):
+    """Return a boolean outlier vector (one entry per volume) from an fMRIPrep confounds TSV."""
+    df = pd.read_csv(tsv_file, sep='\t')
+    outlier_cols = [c for c in df.columns if c.startswith('motion_outlier')]
+    if outlier_cols:
+        # fMRIPrep already applied its FD/DVARS spike thresholds
+        return df[outlier_cols].to_numpy().sum(axis=1) > 0
+
+    outliers = np.zeros(len(df), dtype=bool)
+    if 'framewise_displacement' in df.columns:
+        outliers |= df['framewise_displacement'].fillna(0).to_numpy() > fd_threshold
+    if 'std_dvars' in df.columns:
+        outliers |= df['std_dvars'].fillna(0).to_numpy() > dvars_threshold
+    return outliers
+
+
+def _intensity_mask(volume):
+    """Fallback brain mask from the first volume when no functional mask is available."""
+    cutoff = 0.1 * np.percentile(volume, 98)
+    return volume > cutoff
+
+
+def stream_dvars(bold_file, mask_file=None, chunk_size=CHUNK_SIZE):
+    """Compute DVARS for every volume of a 4D run, reading at most chunk_size volumes at a time."""
+    img = load_img(bold_file)  # Memory-mapped working copy, so chunks are read without gzip
+    n_vols = img.shape[3]
+    mask = None
+    if mask_file and os.path.exists(mask_file):
+        mask = np.asanyarray(load_img(mask_file).dataobj) > 0
+
+    dvars = np.zeros(n_vols)
+    prev = None
+    for start in range(0, n_vols, chunk_size):
+        stop = min(start + chunk_size, n_vols)
+        chunk = np.asarray(img.dataobj[..., start:stop], dtype=np.float32)
+        if mask is None:
+            mask = _intensity_mask(chunk[..., 0])
+        chunk = chunk[mask]  # (voxels, volumes)
+        if prev is not None:
+            chunk = np.concatenate([prev[:, None], chunk], axis=1)
+        diffs = np.diff(chunk, axis=1)
+        offset = start if prev is None else start - 1
+        dvars[offset + 1:offset + 1 + diffs.shape[1]] = np.sqrt(np.mean(diffs ** 2, axis=0))
+        prev = chunk[:, -1].copy()
+        logging.debug(f"DVARS computed for volumes {start}-{stop - 1} of {n_vols}")
+    return dvars
+
+
+def spikes_from_dvars(dvars):
+    """Flag DVARS outliers with the fsl_motion_outliers box-plot cutoff (P75 + 1.5 * IQR)."""
+    values = dvars[1:]  # The first volume has no predecessor
+    q1, q3 = np.percentile(values, [25, 75])
+    cutoff = q3 + 1.5 * (q3 - q1)
+    outliers = dvars > cutoff
+    outliers[0] = False
+    logging.info(f"DVARS outlier cutoff: {cutoff:.3f}")
+    return outliers
+
+
+def write_spike_regressors(outliers, out_file):
+    """Write one spike regressor column per outlier volume (fsl_motion_outliers format)."""
+    idx = np.flatnonzero(outliers)
+    design = np.zeros((len(outliers), len(idx)), dtype=int)
+    design[idx, np.arange(len(idx))] = 1
+    if len(idx) == 0:
+        logging.warning(f"No outlier volumes found, writing empty confounds file: {out_file}")
+        open(out_file, 'w').close()
+    else:
+        np.savetxt(out_file, design, fmt='%d', delimiter=' ')
+    logging.info(f"{len(idx)} spike regressors saved to {out_file}")
+    return out_file
+
+
+def build_confounds(subdir, subject, task, bold_file=None, chunk_size=CHUNK_SIZE):
+    """Create sub-*_task-*_confounds_motion.txt for one subject and task."""
+    tsv_file = os.path.join(subdir, f"func/sub-{subject}_ses-01_task-{task}_desc-confounds_timeseries.tsv")
+    mask_file = os.path.join(subdir, f"func/sub-{subject}_ses-01_task-{task}_space-MNI152NLin6Asym_desc-brain_mask.nii.gz")
+    out_file = os.path.join(subdir, f"sub-{subject}_ses-01_task-{task}_confounds_motion.txt")
+
+    if os.path.exists(tsv_file):
+        logging.info(f"Using fMRIPrep confounds: {tsv_file}")
+        outliers = spikes_from_tsv(tsv_file)
+    else:
+        if bold_file is None:
+            bold_file = os.path.join(subdir, f"func/sub-{subject}_ses-01_task-{task}_space-MNI152NLin6Asym_desc-preproc_bold.nii.gz")
+        if not os.path.exists(bold_file):
+            raise FileNotFoundError(f"Neither confounds TSV nor BOLD run found for sub-{subject} task-{task}")
+        logging.info(f"fMRIPrep confounds not found, streaming DVARS from {bold_file}")
+        outliers = spikes_from_dvars(stream_dvars(bold_file, mask_file, chunk_size))
+    return write_spike_regressors(outliers, out_file)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Generate spike-regressor confounds for FEAT")
+    parser.add_argument("--subdir", required=True, help="Subject session directory (derivatives/sub-<id>/ses-01)")
+    parser.add_argument("--subject", required=True, help="Subject ID")
+    parser.add_argument("--task", required=True, help="Task label (e.g., motor_run-01)")
+    parser.add_argument("--bold", help="Preprocessed BOLD run (default: fMRIPrep MNI152NLin6Asym output)")
+    parser.add_argument("--chunk-size", type=int, default=CHUNK_SIZE, help="Volumes read per chunk when streaming")
+    args = parser.parse_args()
+    build_confounds(args.subdir, args.subject, args.task, args.bold, args.chunk_size)
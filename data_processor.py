@@ -3,191 +3,284 @@
 # data_processor.py: Functions to get values and save in plots and tables
 # Updated to use subject-specific ROI folder, Mar 2025
 # Updated to separate STG and Heschl ROIs for language task and add ROI voxel percentage, Mar 2025
+# Updated to read NIfTI inputs through memory-mapped working copies (nifti_cache.py), Oct 2026
+# Updated to time each panel, table and viewer under --profile (profiling.py), Oct 2026
+# Updated to close figures once written and return file paths instead of open figures and viewers, Oct 2026
+# Updated to import nilearn, matplotlib and pandas only in the methods that use them, Oct 2026
+# Updated to render the ROI z-map mosaics with NumPy (mosaic.py); PLOT_RENDERER=nilearn keeps plot_stat_map, Oct 2026
+# Updated to reuse ROI mask/outline planes from a per-subject cache (ROI_contour_cache), Oct 2026
+# Updated to pass nilearn stat maps already resampled onto the background grid (resample_cache.py), Oct 2026
+# Updated to write coarse preview viewers (VIEWER_PREVIEW_MM) next to the full-resolution viewers, Oct 2026
+# Updated to add a quick-look mode (small figures, fewer cuts, preview viewers only), Oct 2026
+# Updated to decompress the next task's maps, ROIs and T1 in background threads while a task renders (prefetch.py), Oct 2026
+# Updated to resolve FEAT folders and T1s through the derivatives layout index (layout_index.py), Oct 2026
+# Updated to serve the old task pipeline from the same code through a per-pipeline entity and ROI table (PIPELINES), Oct 2026
 
 import os
-from nilearn import plotting
 import logging
-import matplotlib.pyplot as plt                 
-import pandas as pd
 import numpy as np
+from nifti_cache import load_img
+from profiling import profiler
+from prefetch import Prefetcher
+import resample_cache
+import layout_index
 
 # Set up logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
+# Filled ROI outlines drawn on the z-map rows of each task
+ROI_OUTLINES = {
+    'Motor 1': [('Whole-brain SMA + PMC', '#38cb82')],  # Green
+    'Motor 2': [('Whole-brain SMA + PMC', '#38cb82')],  # Green
+    'Language': [('Whole-brain STG', '#38cb82'), ('Whole-brain Heschl', '#b404f8')],  # Green, purple
+}
+
+# Report task -> pipeline task label, resolved to its FEAT folder through layout_index.py
+REPORT_TASKS = {'Motor 1': 'motor_run-01', 'Motor 2': 'motor_run-02', 'Language': 'lang'}
+# Maps of each space, relative to the task's FEAT folder
+FEAT_MAPS = {
+    'Native': {'z_map': "stats/zstat1_native.nii.gz", 'thresh_z_map_235': "stats/thresh_zstat1_235_native.nii.gz",
+               'thresh_z_map_31': "stats/thresh_zstat1_native.nii.gz"},
+    'MNI': {'z_map': "stats/remasked_zstat1.nii.gz", 'thresh_z_map_235': "stats/thresh_zstat1_235.nii.gz",
+            'thresh_z_map_31': "thresh_zstat1.nii.gz"},
+}
+# ROIs of each task: (label, file stem in the subject ROI folder, hemisphere suffix); native files add '_t1w_native'
+TASK_ROIS = {
+    'Motor 1': [('Whole-brain SMA + PMC', "SMA_PMC_sub", ""), ('Left SMA + PMC', "SMA_PMC_sub", "_left"),
+                ('Right SMA + PMC', "SMA_PMC_sub", "_right")],
+    'Motor 2': [('Whole-brain SMA + PMC', "SMA_PMC_sub", ""), ('Left SMA + PMC', "SMA_PMC_sub", "_left"),
+                ('Right SMA + PMC', "SMA_PMC_sub", "_right")],
+    'Language': [('Whole-brain STG', "STG_sub", ""), ('Left STG', "STG_sub", "_left"), ('Right STG', "STG_sub", "_right"),
+                 ('Whole-brain Heschl', "Heschl_sub", ""), ('Left Heschl', "Heschl_sub", "_left"),
+                 ('Right Heschl', "Heschl_sub", "_right")],
+}
+
+# Entity and ROI tables of each pipeline (output_generator.py --pipeline). The old task paradigm names its
+# runs run-1/run-2 in ses-BRAINxRESEARCHxFISCHER with MNI152NLin2009cAsym T1s, keeps its ROIs in the
+# global $ROI folder and outlines STG and Heschl as one language ROI.
+OLD_TASK_ROIS = {
+    'Motor 1': TASK_ROIS['Motor 1'],
+    'Motor 2': TASK_ROIS['Motor 2'],
+    'Language': [('Whole-brain STG + Heschl', "STG_Heschl_sub", ""), ('Left STG + Heschl', "STG_Heschl_sub", "_left"),
+                 ('Right STG + Heschl', "STG_Heschl_sub", "_right")],
+}
+PIPELINES = {
+    'current': {
+        'tasks': REPORT_TASKS, 'feat_maps': FEAT_MAPS, 'task_rois': TASK_ROIS, 'roi_outlines': ROI_OUTLINES,
+        'subject_rois': True, 'session': "ses-01", 'run': "run-01", 'mni_space': "MNI152NLin6Asym",
+    },
+    'old_task': {
+        'tasks': {'Motor 1': 'motor_run-1', 'Motor 2': 'motor_run-2', 'Language': 'lang'},
+        'feat_maps': {
+            'Native': {'z_map': "stats/zstat1_native.nii.gz", 'thresh_z_map_235': "stats/thresh_zstat1_235_native.nii.gz",
+                       'thresh_z_map_31': "thresh_zstat1_native.nii.gz"},
+            'MNI': {'z_map': "stats/zstat1.nii.gz", 'thresh_z_map_235': "stats/thresh_zstat1_235.nii.gz",
+                    'thresh_z_map_31': "thresh_zstat1.nii.gz"},
+        },
+        'task_rois': OLD_TASK_ROIS,
+        'roi_outlines': {'Motor 1': ROI_OUTLINES['Motor 1'], 'Motor 2': ROI_OUTLINES['Motor 2'],
+                         'Language': [('Whole-brain STG + Heschl', '#38cb82')]},
+        'subject_rois': False, 'session': "ses-BRAINxRESEARCHxFISCHER", 'run': "run-1", 'mni_space': "MNI152NLin2009cAsym",
+    },
+}
+# Column names of older post-stats CSVs
+CSV_COLUMN_ALIASES = {'Activated ROI/Activated WB (%)': 'Activated ROI/WB (%)'}
+
+# Voxel size (mm) of the preview viewers opened first in the report; 0 writes only full-resolution viewers
+VIEWER_PREVIEW_MM = 2.5
+# Figure resolution and cuts per row: full quality and quick-look QC
+FULL_DPI, FULL_CUTS = 150, 10
+QUICKLOOK_DPI, QUICKLOOK_CUTS = 50, 5
+
 class DataProcessor:
-    def __init__(self, subject, subject_path, roi_path):
+    def __init__(self, subject, subject_path, roi_path, quicklook=False, pipeline='current'):
         self.subject = subject
+        self.pipeline = PIPELINES[pipeline]  # Task labels, FEAT map names and ROIs of the pipeline
+        self.roi_outlines = self.pipeline['roi_outlines']
+        self.quicklook = quicklook  # Small figures, fewer cuts and preview viewers only
+        self.dpi = QUICKLOOK_DPI if quicklook else FULL_DPI
+        n_cuts = QUICKLOOK_CUTS if quicklook else FULL_CUTS
         self.roi_path = roi_path  # This is the global ROI path for initial templates
         self.subject_path = subject_path
         self.subj_roi_path = os.path.join(self.subject_path, "ROI")  # Subject-specific ROI folder
-        self.t1_native = os.path.join(self.subject_path, f"anat/sub-{subject}_ses-01_run-01_desc-brain_T1w.nii.gz")  # Native skull-stripped T1w
-        self.t1_mni = os.path.join(self.subject_path, f"anat/sub-{subject}_ses-01_run-01_space-MNI152NLin6Asym_desc-preproc_T1w.nii.gz")  # Standard MNI space
+        if not self.pipeline['subject_rois']:
+            self.subj_roi_path = roi_path  # The old task pipeline keeps the subject's ROIs in the global folder
+        self.renderer = os.environ.get('PLOT_RENDERER', 'mosaic')  # 'mosaic' (NumPy) or 'nilearn'
+        self.roi_contour_cache = os.path.join(self.subject_path, "ROI_contour_cache")  # Next to ROI/, which may be a link
+        # Input paths come from the derivatives index; the standard names are used for files not indexed
+        self.layout = layout_index.get_index(os.path.dirname(os.path.dirname(os.path.abspath(subject_path))))
+        prefix = f"anat/sub-{subject}_{self.pipeline['session']}_{self.pipeline['run']}"
+        self.t1_native = self.layout.t1w(subject) or os.path.join(
+            self.subject_path, f"{prefix}_desc-brain_T1w.nii.gz")  # Native skull-stripped T1w
+        self.t1_mni = self.layout.t1w(subject, space=self.pipeline['mni_space']) or os.path.join(
+            self.subject_path, f"{prefix}_space-{self.pipeline['mni_space']}_desc-preproc_T1w.nii.gz")  # Standard MNI space
         
         # Define cut_coords for Native space
-        self.native_motor_coords = np.linspace(15, 50, 10)
-        self.native_stg_coords = np.linspace(-25, 15, 10)
+        self.native_motor_coords = np.linspace(15, 50, n_cuts)
+        self.native_stg_coords = np.linspace(-25, 15, n_cuts)
         
         # Define cut_coords for MNI space
-        self.mni_motor_coords = np.linspace(20, 75, 10)
-        self.mni_stg_coords = np.linspace(-15, 40, 10)
+        self.mni_motor_coords = np.linspace(20, 75, n_cuts)
+        self.mni_stg_coords = np.linspace(-15, 40, n_cuts)
+        self.cut_coords = {'Native': {'Motor': self.native_motor_coords, 'Language': self.native_stg_coords},
+                           'MNI': {'Motor': self.mni_motor_coords, 'Language': self.mni_stg_coords}}
         
         logging.info(f"Initializing DataProcessor for subject {subject}")
         self.task_roi_mapping = self._create_task_roi_mapping()
+        self.prefetcher = Prefetcher()  # Decodes the next task's inputs while the current one renders
 
     def _create_task_roi_mapping(self):
-        return {
-            'Motor 1': {
-                'Native': {
-                    'z_map': os.path.join(self.subject_path, f"fsl_stats/sub-{self.subject}_task-motor_run-01_contrasts.feat/stats/zstat1_native.nii.gz"),
-                    'thresh_z_map_235': os.path.join(self.subject_path, f"fsl_stats/sub-{self.subject}_task-motor_run-01_contrasts.feat/stats/thresh_zstat1_235_native.nii.gz"),
-                    'thresh_z_map_31': os.path.join(self.subject_path, f"fsl_stats/sub-{self.subject}_task-motor_run-01_contrasts.feat/stats/thresh_zstat1_native.nii.gz"),
-                    'roi_paths': {
-                        'Whole-brain SMA + PMC': os.path.join(self.subj_roi_path, "SMA_PMC_sub_t1w_native.nii.gz"),
-                        'Left SMA + PMC': os.path.join(self.subj_roi_path, "SMA_PMC_sub_t1w_native_left.nii.gz"),
-                        'Right SMA + PMC': os.path.join(self.subj_roi_path, "SMA_PMC_sub_t1w_native_right.nii.gz")
-                    },
-                    'csv_file': os.path.join(self.subject_path, f"post_stats/sub-{self.subject}_task-motor_run-01_roi_stats.csv"),
-                    'cut_coords': self.native_motor_coords
-                },
-                'MNI': {
-                    'z_map': os.path.join(self.subject_path, f"fsl_stats/sub-{self.subject}_task-motor_run-01_contrasts.feat/stats/remasked_zstat1.nii.gz"),
-                    'thresh_z_map_235': os.path.join(self.subject_path, f"fsl_stats/sub-{self.subject}_task-motor_run-01_contrasts.feat/stats/thresh_zstat1_235.nii.gz"),
-                    'thresh_z_map_31': os.path.join(self.subject_path, f"fsl_stats/sub-{self.subject}_task-motor_run-01_contrasts.feat/thresh_zstat1.nii.gz"),
-                    'roi_paths': {
-                        'Whole-brain SMA + PMC': os.path.join(self.subj_roi_path, "SMA_PMC_sub.nii.gz"),
-                        'Left SMA + PMC': os.path.join(self.subj_roi_path, "SMA_PMC_sub_left.nii.gz"),
-                        'Right SMA + PMC': os.path.join(self.subj_roi_path, "SMA_PMC_sub_right.nii.gz")
-                    },
-                    'csv_file': os.path.join(self.subject_path, f"post_stats/sub-{self.subject}_task-motor_run-01_roi_stats.csv"),
-                    'cut_coords': self.mni_motor_coords
-                }
-            },
-            'Motor 2': {
-                'Native': {
-                    'z_map': os.path.join(self.subject_path, f"fsl_stats/sub-{self.subject}_task-motor_run-02_contrasts.feat/stats/zstat1_native.nii.gz"),
-                    'thresh_z_map_235': os.path.join(self.subject_path, f"fsl_stats/sub-{self.subject}_task-motor_run-02_contrasts.feat/stats/thresh_zstat1_235_native.nii.gz"),
-                    'thresh_z_map_31': os.path.join(self.subject_path, f"fsl_stats/sub-{self.subject}_task-motor_run-02_contrasts.feat/stats/thresh_zstat1_native.nii.gz"),
-                    'roi_paths': {
-                        'Whole-brain SMA + PMC': os.path.join(self.subj_roi_path, "SMA_PMC_sub_t1w_native.nii.gz"),
-                        'Left SMA + PMC': os.path.join(self.subj_roi_path, "SMA_PMC_sub_t1w_native_left.nii.gz"),
-                        'Right SMA + PMC': os.path.join(self.subj_roi_path, "SMA_PMC_sub_t1w_native_right.nii.gz")
-                    },
-                    'csv_file': os.path.join(self.subject_path, f"post_stats/sub-{self.subject}_task-motor_run-02_roi_stats.csv"),
-                    'cut_coords': self.native_motor_coords
-                },
-                'MNI': {
-                    'z_map': os.path.join(self.subject_path, f"fsl_stats/sub-{self.subject}_task-motor_run-02_contrasts.feat/stats/remasked_zstat1.nii.gz"),
-                    'thresh_z_map_235': os.path.join(self.subject_path, f"fsl_stats/sub-{self.subject}_task-motor_run-02_contrasts.feat/stats/thresh_zstat1_235.nii.gz"),
-                    'thresh_z_map_31': os.path.join(self.subject_path, f"fsl_stats/sub-{self.subject}_task-motor_run-02_contrasts.feat/thresh_zstat1.nii.gz"),
-                    'roi_paths': {
-                        'Whole-brain SMA + PMC': os.path.join(self.subj_roi_path, "SMA_PMC_sub.nii.gz"),
-                        'Left SMA + PMC': os.path.join(self.subj_roi_path, "SMA_PMC_sub_left.nii.gz"),
-                        'Right SMA + PMC': os.path.join(self.subj_roi_path, "SMA_PMC_sub_right.nii.gz")
-                    },
-                    'csv_file': os.path.join(self.subject_path, f"post_stats/sub-{self.subject}_task-motor_run-02_roi_stats.csv"),
-                    'cut_coords': self.mni_motor_coords
-                }
-            },
-            'Language': {
-                'Native': {
-                    'z_map': os.path.join(self.subject_path, f"fsl_stats/sub-{self.subject}_task-lang_contrasts.feat/stats/zstat1_native.nii.gz"),
-                    'thresh_z_map_235': os.path.join(self.subject_path, f"fsl_stats/sub-{self.subject}_task-lang_contrasts.feat/stats/thresh_zstat1_235_native.nii.gz"),
-                    'thresh_z_map_31': os.path.join(self.subject_path, f"fsl_stats/sub-{self.subject}_task-lang_contrasts.feat/stats/thresh_zstat1_native.nii.gz"),
-                    'roi_paths': {
-                        "Whole-brain STG": os.path.join(self.subj_roi_path, "STG_sub_t1w_native.nii.gz"),
-                        'Left STG': os.path.join(self.subj_roi_path, "STG_sub_t1w_native_left.nii.gz"),
-                        'Right STG': os.path.join(self.subj_roi_path, "STG_sub_t1w_native_right.nii.gz"),
-                        "Whole-brain Heschl": os.path.join(self.subj_roi_path, "Heschl_sub_t1w_native.nii.gz"),
-                        'Left Heschl': os.path.join(self.subj_roi_path, "Heschl_sub_t1w_native_left.nii.gz"),
-                        'Right Heschl': os.path.join(self.subj_roi_path, "Heschl_sub_t1w_native_right.nii.gz")
-                    },
-                    'csv_file': os.path.join(self.subject_path, f"post_stats/sub-{self.subject}_task-lang_roi_stats.csv"),
-                    'cut_coords': self.native_stg_coords
-                },
-                'MNI': {
-                    'z_map': os.path.join(self.subject_path, f"fsl_stats/sub-{self.subject}_task-lang_contrasts.feat/stats/remasked_zstat1.nii.gz"),
-                    'thresh_z_map_235': os.path.join(self.subject_path, f"fsl_stats/sub-{self.subject}_task-lang_contrasts.feat/stats/thresh_zstat1_235.nii.gz"),
-                    'thresh_z_map_31': os.path.join(self.subject_path, f"fsl_stats/sub-{self.subject}_task-lang_contrasts.feat/thresh_zstat1.nii.gz"),
-                    'roi_paths': {
-                        "Whole-brain STG": os.path.join(self.subj_roi_path, "STG_sub.nii.gz"),
-                        'Left STG': os.path.join(self.subj_roi_path, "STG_sub_left.nii.gz"),
-                        'Right STG': os.path.join(self.subj_roi_path, "STG_sub_right.nii.gz"),
-                        "Whole-brain Heschl": os.path.join(self.subj_roi_path, "Heschl_sub.nii.gz"),
-                        'Left Heschl': os.path.join(self.subj_roi_path, "Heschl_sub_left.nii.gz"),
-                        'Right Heschl': os.path.join(self.subj_roi_path, "Heschl_sub_right.nii.gz")
-                    },
-                    'csv_file': os.path.join(self.subject_path, f"post_stats/sub-{self.subject}_task-lang_roi_stats.csv"),
-                    'cut_coords': self.mni_stg_coords
-                }
-            }
-        }
+        """Inputs of each report task, with FEAT folders and T1s resolved through the layout index."""
+        mapping = {}
+        for task_name, task in self.pipeline['tasks'].items():
+            feat_dir = self.layout.feat_dir(self.subject, task) or os.path.join(
+                self.subject_path, f"fsl_stats/sub-{self.subject}_task-{task}_contrasts.feat")
+            mapping[task_name] = {}
+            for space, maps in self.pipeline['feat_maps'].items():
+                native = '_t1w_native' if space == 'Native' else ''
+                info = {key: os.path.join(feat_dir, rel_path) for key, rel_path in maps.items()}
+                info['roi_paths'] = {label: os.path.join(self.subj_roi_path, f"{base}{native}{side}.nii.gz")
+                                     for label, base, side in self.pipeline['task_rois'][task_name]}
+                info['csv_file'] = os.path.join(self.subject_path, f"post_stats/sub-{self.subject}_task-{task}_roi_stats.csv")
+                info['cut_coords'] = self.cut_coords[space]['Language' if task_name == 'Language' else 'Motor']
+                mapping[task_name][space] = info
+        return mapping
 
-    def plot_roi(self, space, threshold=None):
+    def _task_inputs(self, task_name, space, map_keys):
+        """NIfTI files a panel of task_name reads: the given maps and the outlined ROIs."""
+        info = self.task_roi_mapping[task_name][space]
+        return [info[key] for key in map_keys] + [info['roi_paths'][roi_name] for roi_name, _ in self.roi_outlines[task_name]]
+
+    def _iterate_tasks(self, space, map_keys, roi_outlines=True):
+        """(task_name, task_info) pairs, prefetching the inputs of the tasks that follow."""
+        def inputs(item):
+            paths = self._task_inputs(item[0], space, map_keys)
+            return paths if roi_outlines else paths[:len(map_keys)]
+        return self.prefetcher.iterate(self.task_roi_mapping.items(), inputs)
+
+    def plot_roi(self, space, threshold=None, renderer=None):
+        import matplotlib.pyplot as plt
         logging.info(f"Plotting ROI for {space} space with threshold {threshold}")
         png_path = os.path.join(self.subject_path, f"post_stats/sub-{self.subject}_roi_zmap_plot_{space}_{threshold}.png")
-        bg_img = self.t1_native if space == 'Native' else self.t1_mni
-        task_roi_mapping = self.task_roi_mapping
+        if threshold not in (3.1, 2.35):
+            raise ValueError("Threshold must be 3.1 or 2.35")
+        if (renderer or self.renderer) == 'mosaic':
+            return self._plot_roi_mosaic(space, threshold, png_path)
+        from nilearn import plotting  # Only the nilearn renderer needs it (slow to import)
+        thresh_key = 'thresh_z_map_31' if threshold == 3.1 else 'thresh_z_map_235'
+        tasks = self._iterate_tasks(space, ['z_map', thresh_key])  # Prefetches the next task's maps
+        bg_img = load_img(self.t1_native if space == 'Native' else self.t1_mni)
 
         fig, axes = plt.subplots(6, 1, figsize=(10, 18))  # Increased height slightly for clarity
-        for i, (task_name, task_info) in enumerate(task_roi_mapping.items()):
-            thresh_235_path = task_info[space]['thresh_z_map_235']
-            thresh_31_path = task_info[space]['thresh_z_map_31']
-            roi_paths = task_info[space]['roi_paths']  # All ROIs for the task
-            cut_coords = task_info[space]['cut_coords']
-            z_map_path = task_info[space]['z_map']
-            if threshold == 3.1:
-                img_path = thresh_31_path
-                thresh_value = 3.1
-            elif threshold == 2.35:
-                img_path = thresh_235_path
-                thresh_value = 2.35
-            else:
-                raise ValueError("Threshold must be 3.1 or 2.35")
-
-            # Plot unthresholded z-map
-            display1 = plotting.plot_stat_map(
-                z_map_path,
-                cut_coords=cut_coords,
-                display_mode='z',
-                vmax=13,
-                colorbar=True,
-                bg_img=bg_img,
-                draw_cross=False,
-                radiological=True,
-                axes=axes[2*i])
+        for i, (task_name, task_info) in enumerate(tasks):
+            with profiler.section(f"plot_roi/{space}_{threshold}/{task_name}"):
+                thresh_235_path = task_info[space]['thresh_z_map_235']
+                thresh_31_path = task_info[space]['thresh_z_map_31']
+                roi_paths = task_info[space]['roi_paths']  # All ROIs for the task
+                cut_coords = task_info[space]['cut_coords']
+                z_map_path = task_info[space]['z_map']
+                if threshold == 3.1:
+                    img_path = thresh_31_path
+                    thresh_value = 3.1
+                elif threshold == 2.35:
+                    img_path = thresh_235_path
+                    thresh_value = 2.35
+                else:
+                    raise ValueError("Threshold must be 3.1 or 2.35")
+
+                # Plot unthresholded z-map (resampled once onto the T1 grid and shared by both thresholds)
+                display1 = plotting.plot_stat_map(
+                    resample_cache.resampled(z_map_path, bg_img),
+                    cut_coords=cut_coords,
+                    display_mode='z',
+                    vmax=13,
+                    colorbar=True,
+                    bg_img=bg_img,
+                    draw_cross=False,
+                    radiological=True,
+                    axes=axes[2*i])
             
-            # Plot thresholded z-map
-            display2 = plotting.plot_stat_map(
-                img_path,
-                cut_coords=cut_coords,
-                display_mode='z',
-                threshold=thresh_value,
-                vmax=13,
-                colorbar=True,
-                bg_img=bg_img,
-                draw_cross=False,
-                radiological=True,
-                axes=axes[2*i+1])
-
-            # Add contours for all ROIs with distinct colors
-            if task_name in ['Motor 1', 'Motor 2']:
-                display1.add_contours(roi_paths['Whole-brain SMA + PMC'], filled=True, alpha=0.3, colors='#38cb82', linewidths=0.28)  # Green
-                display2.add_contours(roi_paths['Whole-brain SMA + PMC'], filled=True, alpha=0.3, colors='#38cb82', linewidths=0.28)  # Green
-
-            elif task_name == 'Language':
-                display1.add_contours(roi_paths['Whole-brain STG'], filled=True, alpha=0.3, colors='#38cb82', linewidths=0.28)  # Green
-                display1.add_contours(roi_paths['Whole-brain Heschl'], filled=True, alpha=0.3, colors='#b404f8', linewidths=0.28)  # Blue
-                display2.add_contours(roi_paths['Whole-brain STG'], filled=True, alpha=0.3, colors='#38cb82', linewidths=0.28)  # Green
-                display2.add_contours(roi_paths['Whole-brain Heschl'], filled=True, alpha=0.3, colors='#b404f8', linewidths=0.28)  # Blue
+                # Plot thresholded z-map
+                display2 = plotting.plot_stat_map(
+                    resample_cache.resampled(img_path, bg_img),
+                    cut_coords=cut_coords,
+                    display_mode='z',
+                    threshold=thresh_value,
+                    vmax=13,
+                    colorbar=True,
+                    bg_img=bg_img,
+                    draw_cross=False,
+                    radiological=True,
+                    axes=axes[2*i+1])
+
+                # Add filled contours of the task's outlined ROIs with distinct colors
+                for roi_name, colour in self.roi_outlines[task_name]:
+                    display1.add_contours(load_img(roi_paths[roi_name]), filled=True, alpha=0.3, colors=colour, linewidths=0.28)
+                    display2.add_contours(load_img(roi_paths[roi_name]), filled=True, alpha=0.3, colors=colour, linewidths=0.28)
             
-            axes[2*i].set_title(f"{self.subject}: {task_name} (Unthresholded)", fontdict={'fontweight': 'bold', 'fontsize': 10})
-            axes[2*i+1].set_title(f"{self.subject}: {task_name} (Thresholded)", fontdict={'fontweight': 'bold', 'fontsize': 10})
+                axes[2*i].set_title(f"{self.subject}: {task_name} (Unthresholded)", fontdict={'fontweight': 'bold', 'fontsize': 10})
+                axes[2*i+1].set_title(f"{self.subject}: {task_name} (Thresholded)", fontdict={'fontweight': 'bold', 'fontsize': 10})
         
-        plt.savefig(png_path, dpi=150, bbox_inches='tight')
+        with profiler.section(f"plot_roi/{space}_{threshold}/savefig"):
+            plt.savefig(png_path, dpi=self.dpi, bbox_inches='tight')
+        plt.close(fig)
+        logging.info(f"Z-map plot saved as PNG: {png_path}")
+        return png_path
+
+    def _plot_roi_mosaic(self, space, threshold, png_path):
+        """plot_roi drawn with mosaic.py: each row is one RGBA image blended in NumPy."""
+        import matplotlib.pyplot as plt
+        from matplotlib.cm import ScalarMappable
+        from matplotlib.colors import Normalize
+        import mosaic
+
+        mosaic_dir = os.path.join(self.subject_path, "post_stats/mosaic")
+        os.makedirs(mosaic_dir, exist_ok=True)
+        thresh_key = 'thresh_z_map_31' if threshold == 3.1 else 'thresh_z_map_235'
+        tasks = self._iterate_tasks(space, ['z_map', thresh_key])  # Prefetches the next task's maps
+        background = mosaic.MosaicBackground(load_img(self.t1_native if space == 'Native' else self.t1_mni))
+
+        fig, axes = plt.subplots(6, 1, figsize=(10, 18))
+        for i, (task_name, task_info) in enumerate(tasks):
+            with profiler.section(f"plot_roi/{space}_{threshold}/{task_name}"):
+                info = task_info[space]
+                ks = background.slice_indices(info['cut_coords'])
+                rois = [mosaic.roi_planes(background, info['roi_paths'][roi_name], ks, self.roi_contour_cache) + (colour,)
+                        for roi_name, colour in self.roi_outlines[task_name]]
+                rows = [
+                    ('unthresh', info['z_map'], None, "Unthresholded"),
+                    ('thresh', info[thresh_key], threshold, "Thresholded"),
+                ]
+                for r, (label, map_path, row_threshold, title) in enumerate(rows):
+                    symmetric = resample_cache.has_negatives(map_path)  # plot_stat_map drops the negative half otherwise
+                    stat_planes = resample_cache.sampled_planes(background, map_path, ks, mosaic.STAT_ORDER)
+                    row = mosaic.render_row(background, stat_planes, ks, rois, threshold=row_threshold, symmetric=symmetric)
+                    task_slug = task_name.lower().replace(' ', '_')
+                    mosaic.save_row(row, os.path.join(mosaic_dir, f"sub-{self.subject}_{space}_{threshold}_{task_slug}_{label}.png"))
+
+                    ax = axes[2*i + r]
+                    ax.imshow(row, interpolation='nearest')
+                    ax.set_facecolor('black')
+                    ax.set_xticks([])
+                    ax.set_yticks([])
+                    for x, k in zip(mosaic.tile_centers(row, len(ks)), ks):
+                        ax.text(x, row.shape[0] - 4, f"z={int(round(background.slice_z(k)))}", color='white', fontsize=7, ha='center', va='bottom',
+                                bbox=dict(facecolor='black', edgecolor='none', pad=1))
+                    ax.text(4, 4, "R", color='white', fontsize=7, ha='left', va='top')
+                    ax.text(row.shape[1] - 4, 4, "L", color='white', fontsize=7, ha='right', va='top')
+                    norm = Normalize(-mosaic.VMAX if symmetric else 0, mosaic.VMAX)
+                    fig.colorbar(ScalarMappable(norm=norm, cmap=mosaic.stat_cmap()), cax=ax.inset_axes([1.01, 0.0, 0.012, 1.0]))
+                    ax.set_title(f"{self.subject}: {task_name} ({title})", fontdict={'fontweight': 'bold', 'fontsize': 10})
+
+        with profiler.section(f"plot_roi/{space}_{threshold}/savefig"):
+            plt.savefig(png_path, dpi=self.dpi, bbox_inches='tight')
+        plt.close(fig)
         logging.info(f"Z-map plot saved as PNG: {png_path}")
-        return fig
+        return png_path
 
     def plot_table(self, space, threshold):
+        import matplotlib.pyplot as plt
+        import pandas as pd
         logging.info(f"Generating tables for {space} space with threshold {threshold}")
         df_all = pd.DataFrame()
         for task_name, task_info in self.task_roi_mapping.items():
@@ -196,30 +289,32 @@ class DataProcessor:
                 logging.warning(f"CSV file missing: {csv_file}")
                 continue
             try:
-                df_task = pd.read_csv(csv_file)
+                df_task = pd.read_csv(csv_file).rename(columns=lambda c: CSV_COLUMN_ALIASES.get(c.strip(), c.strip()))
                 logging.info(f"Loaded {csv_file} with {len(df_task)} rows")
                 df_all = pd.concat([df_all, df_task], ignore_index=True)
             except Exception as e:
                 logging.error(f"Error reading {csv_file}: {str(e)}")
                 continue
 
+        if 'Stat Type' not in df_all:
+            df_all['Stat Type'] = 'Z-stat'  # Older CSVs have Z-stat rows only
         # Filter for Z-stats and TFCE separately
         df_zstat = df_all[(df_all['Space'] == space) & (df_all['Threshold'] == f"Z={threshold}") & (df_all['Stat Type'] == 'Z-stat')]
         df_tfce = df_all[(df_all['Space'] == space) & (df_all['Threshold'] == 'TFCE') & (df_all['Stat Type'] == 'TFCE')]
         
         logging.info(f"Z-stat df has {len(df_zstat)} rows, TFCE df has {len(df_tfce)} rows for {space} and threshold {threshold}")
 
-        # Define table structure
-        tasks = ['Motor 1', '', '', 'Motor 2', '', '', 'Language', '', '', '', '', '']
-        rois = ['Whole-brain SMA + PMC', 'Left SMA + PMC', 'Right SMA + PMC',
-                'Whole-brain SMA + PMC', 'Left SMA + PMC', 'Right SMA + PMC',
-                'Whole-brain STG', 'Left STG', 'Right STG',
-                'Whole-brain Heschl', 'Left Heschl', 'Right Heschl']
+        # Define table structure (one row per task ROI, task named on its first row)
+        tasks, rois = [], []
+        for task_name, task_rois in self.pipeline['task_rois'].items():
+            for j, (roi_label, _, _) in enumerate(task_rois):
+                tasks.append(task_name if j == 0 else '')
+                rois.append(roi_label)
 
         # Function to format table data
         def format_table_data(df):
             if df.empty:
-                return [['N/A' for _ in range(6)] for _ in range(12)], 0, [0] * 12
+                return [['N/A' for _ in range(6)] for _ in range(len(rois))], [], [0] * len(rois)
             
             table_data = []
             roi_voxel_counts = df['Voxels in ROI (counts)'].tolist()
@@ -231,115 +326,150 @@ class DataProcessor:
                 perc_wb = df['Activated Voxels across Whole Brain (%)'].iloc[i]
                 perc_roi = df['Activated Voxels within ROI (%)'].iloc[i]
                 perc_roi_wb = df['Activated ROI/WB (%)'].iloc[i]
-                ratio_roi_act_wb = df['%Activated ROI/%Activated WB (ratio)'].iloc[i]
+                ratio_roi_act_wb = df['%Activated ROI/%Activated WB (ratio)'].iloc[i] if '%Activated ROI/%Activated WB (ratio)' in df else None
 
                 table_data.append([
                     tasks[i],
                     rois[i],
                     f"{act_wb} ({perc_wb:.1f}%)",
                     f"{act_roi} ({perc_roi:.1f}%)",
-                    f"{ratio_roi_act_wb:.1f}",
+                    'N/A' if ratio_roi_act_wb is None else f"{ratio_roi_act_wb:.1f}",
                     f"{perc_roi_wb:.1f}"
                 ])
                 wb_voxel_counts.append(wb_voxel_count)
             return table_data, wb_voxel_counts, roi_voxel_counts
 
-        # Z-stat table
-        zstat_data, zstat_wb_voxels, zstat_roi_voxels = format_table_data(df_zstat)
-        fig_zstat, ax_zstat = plt.subplots(figsize=(10, 6))  # Increased height for more rows
-        column_labels = ['Task', 'ROI', 'Activated Voxels\nacross Whole Brain', 
-                         'Activated Voxels\nwithin ROI', '%Activated ROI\n/%Activated WB (ratio)*',
-                         'Activated Voxels in\nROI across WB (%)*']
+        with profiler.section(f"plot_table/{space}_{threshold}/zstat"):
+            # Z-stat table
+            zstat_data, zstat_wb_voxels, zstat_roi_voxels = format_table_data(df_zstat)
+            fig_zstat, ax_zstat = plt.subplots(figsize=(10, 6))  # Increased height for more rows
+            column_labels = ['Task', 'ROI', 'Activated Voxels\nacross Whole Brain', 
+                             'Activated Voxels\nwithin ROI', '%Activated ROI\n/%Activated WB (ratio)*',
+                             'Activated Voxels in\nROI across WB (%)*']
         
-        if not df_zstat.empty:
-            table = ax_zstat.table(cellText=zstat_data, colLabels=column_labels, loc='center', cellLoc='center', bbox=[0, 0, 1, 1])
-            table.auto_set_font_size(False)
-            table.set_fontsize(8)
-            table.auto_set_column_width(col=list(range(len(column_labels))))
-            for (row, col), cell in table.get_celld().items():
-                if row == 0:
-                    cell.set_text_props(weight='bold', color='white')
-                    cell.set_facecolor('#4CAF50')
-                    cell.set_height(0.1)
-                elif row % 3 == 1:
-                    cell.set_facecolor('#f2f2f2')
-                cell.set_height(0.07)
-        else:
-            ax_zstat.text(0.5, 0.5, f"No Z-stat data available for {space} space (Z={threshold})", 
-                          ha='center', va='center', fontsize=10, color='red')
+            if not df_zstat.empty:
+                table = ax_zstat.table(cellText=zstat_data, colLabels=column_labels, loc='center', cellLoc='center', bbox=[0, 0, 1, 1])
+                table.auto_set_font_size(False)
+                table.set_fontsize(8)
+                table.auto_set_column_width(col=list(range(len(column_labels))))
+                for (row, col), cell in table.get_celld().items():
+                    if row == 0:
+                        cell.set_text_props(weight='bold', color='white')
+                        cell.set_facecolor('#4CAF50')
+                        cell.set_height(0.1)
+                    elif row % 3 == 1:
+                        cell.set_facecolor('#f2f2f2')
+                    cell.set_height(0.07)
+            else:
+                ax_zstat.text(0.5, 0.5, f"No Z-stat data available for {space} space (Z={threshold})", 
+                              ha='center', va='center', fontsize=10, color='red')
         
-        ax_zstat.axis('off')
-        plt.suptitle(f"Supra-thresholded Voxels in {space} Space (Z={threshold})", fontweight='bold', fontsize=12)
-        annotation_text = (
-            f"Whole-brain voxel counts: {', '.join(map(str, zstat_wb_voxels))}\n"
-            f"ROI voxel counts (order follows table): {', '.join(map(str, zstat_roi_voxels))}\n"
-            "*%Activated ROI/%Activated WB (ratio): Percent act. voxels in ROI (Column 4) divided by Percent act. voxels in Whole Brain (Column 3)\n"
-            "*Activated Voxels in ROI across WB (%): Activated voxels in ROI (Column 4) divided by Whole-brain voxel counts"
-        )
-        plt.annotate(annotation_text, xy=(0, 0), xytext=(0, -50), xycoords='axes fraction', textcoords='offset points', fontsize=8)
-        png_path_zstat = os.path.join(self.subject_path, f"post_stats/sub-{self.subject}_roi_stats_table_{space}_zstat_{threshold}.png")
-        plt.savefig(png_path_zstat, bbox_inches='tight', dpi=150)
-        logging.info(f"Z-stat table saved as PNG: {png_path_zstat}")
-
-        # TFCE table
-        tfce_data, tfce_wb_voxels, tfce_roi_voxels = format_table_data(df_tfce)
-        fig_tfce, ax_tfce = plt.subplots(figsize=(10, 6))  # Increased height for more rows
+            ax_zstat.axis('off')
+            plt.suptitle(f"Supra-thresholded Voxels in {space} Space (Z={threshold})", fontweight='bold', fontsize=12)
+            annotation_text = (
+                f"Whole-brain voxel counts: {', '.join(map(str, zstat_wb_voxels))}\n"
+                f"ROI voxel counts (order follows table): {', '.join(map(str, zstat_roi_voxels))}\n"
+                "*%Activated ROI/%Activated WB (ratio): Percent act. voxels in ROI (Column 4) divided by Percent act. voxels in Whole Brain (Column 3)\n"
+                "*Activated Voxels in ROI across WB (%): Activated voxels in ROI (Column 4) divided by Whole-brain voxel counts"
+            )
+            plt.annotate(annotation_text, xy=(0, 0), xytext=(0, -50), xycoords='axes fraction', textcoords='offset points', fontsize=8)
+            png_path_zstat = os.path.join(self.subject_path, f"post_stats/sub-{self.subject}_roi_stats_table_{space}_zstat_{threshold}.png")
+            plt.savefig(png_path_zstat, bbox_inches='tight', dpi=self.dpi)
+            plt.close(fig_zstat)
+            logging.info(f"Z-stat table saved as PNG: {png_path_zstat}")
+
+        with profiler.section(f"plot_table/{space}_{threshold}/tfce"):
+            # TFCE table
+            tfce_data, tfce_wb_voxels, tfce_roi_voxels = format_table_data(df_tfce)
+            fig_tfce, ax_tfce = plt.subplots(figsize=(10, 6))  # Increased height for more rows
         
-        if not df_tfce.empty:
-            table = ax_tfce.table(cellText=tfce_data, colLabels=column_labels, loc='center', cellLoc='center', bbox=[0, 0, 1, 1])
-            table.auto_set_font_size(False)
-            table.set_fontsize(8)
-            table.auto_set_column_width(col=list(range(len(column_labels))))
-            for (row, col), cell in table.get_celld().items():
-                if row == 0:
-                    cell.set_text_props(weight='bold', color='white')
-                    cell.set_facecolor('#4CAF50')
-                    cell.set_height(0.1)
-                elif row % 3 == 1:
-                    cell.set_facecolor('#f2f2f2')
-                cell.set_height(0.07)  # Adjusted height for more rows
-        else:
-            ax_tfce.text(0.5, 0.5, f"No TFCE data available for {space} space (TFCE)", 
-                         ha='center', va='center', fontsize=10, color='red')
+            if not df_tfce.empty:
+                table = ax_tfce.table(cellText=tfce_data, colLabels=column_labels, loc='center', cellLoc='center', bbox=[0, 0, 1, 1])
+                table.auto_set_font_size(False)
+                table.set_fontsize(8)
+                table.auto_set_column_width(col=list(range(len(column_labels))))
+                for (row, col), cell in table.get_celld().items():
+                    if row == 0:
+                        cell.set_text_props(weight='bold', color='white')
+                        cell.set_facecolor('#4CAF50')
+                        cell.set_height(0.1)
+                    elif row % 3 == 1:
+                        cell.set_facecolor('#f2f2f2')
+                    cell.set_height(0.07)  # Adjusted height for more rows
+            else:
+                ax_tfce.text(0.5, 0.5, f"No TFCE data available for {space} space (TFCE)", 
+                             ha='center', va='center', fontsize=10, color='red')
         
-        ax_tfce.axis('off')
-        plt.suptitle(f"Supra-thresholded Voxels in {space} Space (p-corrected t-map)", fontweight='bold', fontsize=12)
-        annotation_text = (
-            f"Whole-brain voxel counts: {', '.join(map(str, tfce_wb_voxels))}\n"
-            f"ROI voxel counts (order follows table): {', '.join(map(str, tfce_roi_voxels))}\n"
-           "*%Activated ROI/%Activated WB (ratio): Percent act. voxels in ROI (Column 4) divided by Percent act. voxels in Whole Brain (Column 3)\n"
-            "*Activated Voxels in ROI across WB (%): Activated voxels in ROI (Column 4) divided by Whole-brain voxel counts"
-        )
-        plt.annotate(annotation_text, xy=(0, 0), xytext=(0, -50), xycoords='axes fraction', textcoords='offset points', fontsize=8)
-        png_path_tfce = os.path.join(self.subject_path, f"post_stats/sub-{self.subject}_roi_stats_table_{space}_tfce_p005.png")
-        plt.savefig(png_path_tfce, bbox_inches='tight', dpi=150)
-        logging.info(f"TFCE table saved as PNG: {png_path_tfce}")
-
-        return fig_zstat, df_zstat, fig_tfce, df_tfce
+            ax_tfce.axis('off')
+            plt.suptitle(f"Supra-thresholded Voxels in {space} Space (p-corrected t-map)", fontweight='bold', fontsize=12)
+            annotation_text = (
+                f"Whole-brain voxel counts: {', '.join(map(str, tfce_wb_voxels))}\n"
+                f"ROI voxel counts (order follows table): {', '.join(map(str, tfce_roi_voxels))}\n"
+               "*%Activated ROI/%Activated WB (ratio): Percent act. voxels in ROI (Column 4) divided by Percent act. voxels in Whole Brain (Column 3)\n"
+                "*Activated Voxels in ROI across WB (%): Activated voxels in ROI (Column 4) divided by Whole-brain voxel counts"
+            )
+            plt.annotate(annotation_text, xy=(0, 0), xytext=(0, -50), xycoords='axes fraction', textcoords='offset points', fontsize=8)
+            png_path_tfce = os.path.join(self.subject_path, f"post_stats/sub-{self.subject}_roi_stats_table_{space}_tfce_p005.png")
+            plt.savefig(png_path_tfce, bbox_inches='tight', dpi=self.dpi)
+            plt.close(fig_tfce)
+            logging.info(f"TFCE table saved as PNG: {png_path_tfce}")
+
+        return png_path_zstat, df_zstat, png_path_tfce, df_tfce
 
     def process_data(self):
+        from nilearn import plotting
         logging.info(f"Processing data for subject {self.subject}")
+        self.prefetcher.schedule([self.t1_mni])  # Decoded while the native tables are drawn
         # native_roi_fig_31 = self.plot_roi('Native', threshold=3.1)
         # native_roi_fig_235 = self.plot_roi('Native', threshold=2.35)
         native_table_fig_zstat_31, native_df_zstat_31, native_table_fig_tfce_31, native_df_tfce_31 = self.plot_table('Native', threshold=3.1)
         native_table_fig_zstat_235, native_df_zstat_235, native_table_fig_tfce_235, native_df_tfce_235 = self.plot_table('Native', threshold=2.35)
         mni_roi_fig_31 = self.plot_roi('MNI', threshold=3.1)
         mni_roi_fig_235 = self.plot_roi('MNI', threshold=2.35)
+        self.prefetcher.release([self.t1_mni])
         mni_table_fig_zstat_31, mni_df_zstat_31, mni_table_fig_tfce_31, mni_df_tfce_31 = self.plot_table('MNI', threshold=3.1)
         mni_table_fig_zstat_235, mni_df_zstat_235, mni_table_fig_tfce_235, mni_df_tfce_235 = self.plot_table('MNI', threshold=2.35)
 
-        native_viewers_31 = {task: plotting.view_img(task_info['Native']['thresh_z_map_31'], 
-                                                     bg_img=self.t1_native, threshold=3.1, title=f"{task} Z=3.1")
-                             for task, task_info in self.task_roi_mapping.items()}
-        native_viewers_unthresh_31 = {task: plotting.view_img(task_info['Native']['z_map'],
-                                                              bg_img=self.t1_native, threshold=0, title=f"{task} Unthresholded")
-                                      for task, task_info in self.task_roi_mapping.items()}
-        native_viewers_235 = {task: plotting.view_img(task_info['Native']['thresh_z_map_235'], 
-                                                      bg_img=self.t1_native, threshold=2.35, title=f"{task} Z=2.35")
-                              for task, task_info in self.task_roi_mapping.items()}
-        native_viewers_unthresh_235 = {task: plotting.view_img(task_info['Native']['z_map'],
-                                                              bg_img=self.t1_native, threshold=0, title=f"{task} Unthresholded")
-                                      for task, task_info in self.task_roi_mapping.items()}
+        # Viewers are written as soon as they are built so their HTML is not held in memory.
+        # The 2.35 viewers were built here before but never saved, so they are no longer generated.
+        viewer_dir = os.path.join(self.subject_path, "post_stats/viewers")
+        os.makedirs(viewer_dir, exist_ok=True)
+        viewer_keys = ['z_map'] if self.quicklook else ['z_map', 'thresh_z_map_31']
+        tasks = self._iterate_tasks('Native', viewer_keys, roi_outlines=False)  # Prefetches the next task's maps
+        self.prefetcher.schedule([self.t1_native])
+        t1_native_img = load_img(self.t1_native)
+        self.prefetcher.release([self.t1_native])
+        # Preview viewers: T1 and maps resampled to VIEWER_PREVIEW_MM, small enough to open quickly over the
+        # network share; the report loads the full-resolution viewer only on request.
+        preview_mm = float(os.environ.get('VIEWER_PREVIEW_MM', VIEWER_PREVIEW_MM))
+        if self.quicklook and preview_mm <= 0:
+            preview_mm = VIEWER_PREVIEW_MM
+        t1_preview_img = None
+        if preview_mm > 0:
+            t1_preview_img = resample_cache.resampled(self.t1_native, resample_cache.preview_grid(t1_native_img, preview_mm))
+
+        def save_viewer(task, map_key, threshold, title, suffix, bg_img):
+            viewer_path = os.path.join(viewer_dir, f"native_{task.lower().replace(' ', '_')}_{suffix}_viewer.html")
+            with profiler.section(f"viewer/{suffix}/{task}"):
+                viewer = plotting.view_img(resample_cache.resampled(self.task_roi_mapping[task]['Native'][map_key], bg_img),
+                                           bg_img=bg_img, threshold=threshold, title=f"{task} {title}")
+                viewer.save_as_html(viewer_path)
+            return viewer_path
+
+        # All viewers of a task are written together, so the next task's maps decode meanwhile
+        native_viewers_unthresh_31_preview, native_viewers_31, native_viewers_unthresh_31 = {}, {}, {}
+        for task, _ in tasks:
+            if t1_preview_img is not None:
+                native_viewers_unthresh_31_preview[task] = save_viewer(
+                    task, 'z_map', 0, f"Unthresholded ({preview_mm:g} mm preview)", "unthresh_z31_preview", t1_preview_img)
+            if not self.quicklook:
+                native_viewers_31[task] = save_viewer(task, 'thresh_z_map_31', 3.1, "Z=3.1", "z31", t1_native_img)
+                native_viewers_unthresh_31[task] = save_viewer(task, 'z_map', 0, "Unthresholded", "unthresh_z31", t1_native_img)
+        if self.quicklook:
+            # Full-resolution viewers are left to the full-quality run; the report links the previews
+            native_viewers_unthresh_31 = dict(native_viewers_unthresh_31_preview)
+
+        # Figure entries hold the written PNG paths and viewer entries the written HTML paths
         return {
             # 'native_roi_fig_31': native_roi_fig_31,
             # 'native_roi_fig_235': native_roi_fig_235,
@@ -355,4 +485,5 @@ class DataProcessor:
             'mni_table_fig_tfce_235': mni_table_fig_tfce_235,
             'native_viewers_31': native_viewers_31,
             'native_viewers_unthresh_31': native_viewers_unthresh_31,
+            'native_viewers_unthresh_31_preview': native_viewers_unthresh_31_preview,
         }
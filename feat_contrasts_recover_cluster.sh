@@ -1,6 +1,9 @@
 #!/bin/bash
 # This script runs the FEAT stats (1st level GLM model) for functional scans
 # Code adapted for RECOVER project based on the protocol from MGH by K. Nguyen at A. Wu Jan 2025
+# Updated to wait for each FEAT job and exit non-zero if any failed, Oct 2026
+# Updated to look up the T1w and BOLD run in the derivatives layout index (layout_index.py), Oct 2026
+# Updated to skip a run when confounds.py fails instead of running FEAT without confounds, Oct 2026
 
 # Check if at least one subject ID was provided
 if [ $# -eq 0 ]; then
@@ -17,6 +20,12 @@ fi
 # Set the number of parallel jobs to run. change based on available cores in the cluster
 export OMP_NUM_THREADS=4
 
+# Python confound stage (reads fMRIPrep confounds TSV, or streams DVARS from the BOLD run)
+PYTHON=${PYTHON:-python3}
+CONFOUNDS=${CONFOUNDS:-$(dirname "$0")/confounds.py}
+# Entity-based lookups in the persistent derivatives index instead of globbing the share on every run
+LAYOUT_INDEX_PY=${LAYOUT_INDEX_PY:-$(dirname "$0")/layout_index.py}
+
 process_subject_task() {
     subject=$1
     task=$2
@@ -24,17 +33,25 @@ process_subject_task() {
     SUBDIR=${DATADIR}/sub-${subject}/ses-01
     mkdir -p ${SUBDIR}/fsl_stats
 
-    T1=${SUBDIR}/anat/*MNI152NLin6Asym_desc-preproc_T1w.nii.gz
-    input=${SUBDIR}/func/*${task}_space-MNI152NLin6Asym_desc-preproc_bold.nii.gz
+    T1=$("$PYTHON" "$LAYOUT_INDEX_PY" --root "$DATADIR" get --subject "$subject" --datatype anat \
+        --space MNI152NLin6Asym --desc preproc --suffix T1w --ext .nii.gz) \
+        || T1=${SUBDIR}/anat/*MNI152NLin6Asym_desc-preproc_T1w.nii.gz
+    input=$("$PYTHON" "$LAYOUT_INDEX_PY" --root "$DATADIR" get --subject "$subject" --datatype func --task "$task" \
+        --space MNI152NLin6Asym --desc preproc --suffix bold --ext .nii.gz) \
+        || input=${SUBDIR}/func/*${task}_space-MNI152NLin6Asym_desc-preproc_bold.nii.gz
     FUNC_MASK=${SUBDIR}/func/sub-${subject}_ses-01_task-${task}_space-MNI152NLin6Asym_desc-brain_mask.nii.gz
 
-	if [ ! -f ${SUBDIR}/sub-${subject}_ses-01_task-${task}_confounds_motion.txt ]; then
-        echo "Confounds motion.txt not found, using fsl_motion_outlier"
-        fsl_motion_outliers -i $input -o ${SUBDIR}/sub-${subject}_ses-01_task-${task}_confounds_motion.txt --dummy=0
-    fi
-
-	echo "Motion outlier confounds.txt found, skip fsl_motion_outlier"
     confinput=${SUBDIR}/sub-${subject}_ses-01_task-${task}_confounds_motion.txt
+	if [ ! -f "$confinput" ]; then
+        echo "Confounds motion.txt not found, building spike regressors with confounds.py"
+        if ! "$PYTHON" "$CONFOUNDS" --subdir "$SUBDIR" --subject "$subject" --task "$task" --bold $input \
+            || [ ! -f "$confinput" ]; then
+            echo "confounds.py failed for sub-${subject} ${task}, skipping this run."
+            return 1
+        fi
+    else
+        echo "Motion outlier confounds.txt found, skip fsl_motion_outlier"
+    fi
     output=${SUBDIR}/fsl_stats/sub-${subject}_task-${task}_contrasts
 
 	for i in $TEMPLATE; do
@@ -56,12 +73,27 @@ process_subject_task() {
 export -f process_subject_task
 
 # Process all subjects for the tasks specified in TASKS
+pids=()
+labels=()
 for subject in "$@"; do
     for task in $TASKS; do
         echo "Processing ${task} for sub-${subject} in parallel"
         process_subject_task "$subject" "$task" &
+        pids+=($!)
+        labels+=("sub-${subject} ${task}")
     done
 done
 
-wait  # Wait for all parallel jobs to finish
-echo "All tasks completed for subjects: $@"
\ No newline at end of file
+# Wait for every job and report the ones that failed instead of ignoring their status
+FAILED=0
+for i in "${!pids[@]}"; do
+    if ! wait "${pids[$i]}"; then
+        echo "Error: FEAT failed for ${labels[$i]}"
+        FAILED=1
+    fi
+done
+if [ $FAILED -ne 0 ]; then
+    echo "FEAT completed with failures for subjects: $@"
+    exit 1
+fi
+echo "All tasks completed for subjects: $@"
@@ -0,0 +1,182 @@
+#!/opt/anaconda3/bin/python
+# Python 3.8.20
+# group_maps.py: Streaming group-level maps (mean, SD, activation frequency) across subjects in MNI space
+# Created for RECOVER project, Oct 2026
+# Updated to count activations from the sparse sidecars of the thresholded maps (sparse_maps.py), Oct 2026
+#
+# For each task, running accumulators are kept in <group_dir>/<task>_accumulators.npz:
+#   n, mean, m2     Welford running mean and sum of squared deviations of remasked_zstat1
+#   count_z31       subjects with the voxel in thresh_zstat1 (cluster-corrected Z=3.1)
+#   count_z235      subjects with the voxel in thresh_zstat1_235
+#   count_tfce      subjects with TFCE 1-p >= 0.95
+#   subjects        subjects already included
+# Maps are read one at a time through memory-mapped working copies, so memory use does not
+# depend on cohort size, and adding a subject only reads that subject's maps. After each update
+# <task>_zstat_mean, <task>_zstat_sd and <task>_freq_{z31,z235,tfce} (fraction of subjects)
+# are written as NIfTI to the group folder.
+# Usage: python group_maps.py [--group_dir DIR] [--tasks "..."] [--rebuild] <subject_id1> ...
+
+import os
+import sys
+import time
+import logging
+import argparse
+import numpy as np
+import nibabel as nib
+import sparse_maps
+from nifti_cache import load_img
+
+# Set up logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+DEFAULT_TASKS = "motor_run-01 motor_run-02 lang"
+TFCE_THRESHOLD = 0.95  # 1-p, as in calc_post_stats_thresh.sh
+FREQ_MAPS = ('z31', 'z235', 'tfce')
+LOCK_TIMEOUT = 600  # Seconds to wait for another process updating the same task
+
+
+def subject_maps(datadir, subject, task):
+    """MNI-space maps of one subject and task, as written by FEAT, randomise and calc_post_stats_thresh.sh."""
+    feat_dir = os.path.join(datadir, f"sub-{subject}", "ses-01", "fsl_stats", f"sub-{subject}_task-{task}_contrasts.feat")
+    return {
+        'zstat': os.path.join(feat_dir, "stats/remasked_zstat1.nii.gz"),
+        'z31': os.path.join(feat_dir, "thresh_zstat1.nii.gz"),
+        'z235': os.path.join(feat_dir, "stats/thresh_zstat1_235.nii.gz"),
+        'tfce': os.path.join(feat_dir, "randomise_time_series_tfce_corrp_tstat1.nii.gz"),
+    }
+
+
+class GroupAccumulator:
+    """Welford mean/variance and activation counts for one task, saved as an .npz file."""
+
+    def __init__(self, path):
+        self.path = path
+        self.n = 0
+        self.mean = self.m2 = self.affine = None
+        self.counts = {}
+        self.subjects = []
+        if os.path.exists(path):
+            with np.load(path) as state:
+                self.n = int(state['n'])
+                self.mean = state['mean']
+                self.m2 = state['m2']
+                self.affine = state['affine']
+                self.counts = {name: state[f"count_{name}"] for name in FREQ_MAPS}
+                self.subjects = [str(s) for s in state['subjects']]
+
+    def _start(self, img):
+        shape = img.shape[:3]
+        self.affine = img.affine
+        self.mean = np.zeros(shape, dtype=np.float64)
+        self.m2 = np.zeros(shape, dtype=np.float64)
+        self.counts = {name: np.zeros(shape, dtype=np.int32) for name in FREQ_MAPS}
+
+    def add(self, subject, maps):
+        """Fold one subject's maps into the accumulators."""
+        zstat_img = load_img(maps['zstat'])
+        if self.mean is None:
+            self._start(zstat_img)
+        if zstat_img.shape[:3] != self.mean.shape or not np.allclose(zstat_img.affine, self.affine):
+            raise ValueError(f"{maps['zstat']} is not on the group grid {self.mean.shape}")
+        z = np.nan_to_num(np.asarray(zstat_img.dataobj, dtype=np.float64).reshape(self.mean.shape))
+        self.n += 1
+        delta = z - self.mean
+        self.mean += delta / self.n
+        self.m2 += delta * (z - self.mean)
+
+        for name in FREQ_MAPS:
+            if not os.path.exists(maps[name]):
+                logging.warning(f"Missing {name} map for sub-{subject}: {maps[name]} (counted as inactive)")
+                continue
+            sparse_map = sparse_maps.load(maps[name])
+            if sparse_map.shape != self.mean.shape:
+                raise ValueError(f"{maps[name]} is not on the group grid {self.mean.shape}")
+            active = sparse_map.at_least(TFCE_THRESHOLD) if name == 'tfce' else sparse_map.above(0)
+            self.counts[name].reshape(-1)[active] += 1
+        self.subjects.append(subject)
+
+    def save(self):
+        tmp_path = f"{self.path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'wb') as f:
+            np.savez(f, n=self.n, mean=self.mean, m2=self.m2, affine=self.affine,
+                     subjects=np.array(self.subjects), **{f"count_{name}": self.counts[name] for name in FREQ_MAPS})
+        os.replace(tmp_path, self.path)
+
+    def write_maps(self, group_dir, task):
+        """Write the group mean, SD and frequency maps; returns their paths."""
+        sd = np.sqrt(self.m2 / (self.n - 1)) if self.n > 1 else np.zeros_like(self.m2)
+        outputs = {'zstat_mean': self.mean, 'zstat_sd': sd}
+        for name in FREQ_MAPS:
+            outputs[f"freq_{name}"] = self.counts[name] / float(self.n)
+        paths = {}
+        for label, data in outputs.items():
+            paths[label] = os.path.join(group_dir, f"{task}_{label}.nii.gz")
+            img = nib.Nifti1Image(data.astype(np.float32), self.affine)
+            img.header['descrip'] = f"n={self.n}".encode()
+            nib.save(img, paths[label])
+        return paths
+
+
+def _lock(path):
+    """Exclusive lock file so concurrent runs do not update the same accumulators."""
+    start = time.time()
+    while True:
+        try:
+            return os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+        except FileExistsError:
+            if time.time() - start > LOCK_TIMEOUT:
+                raise TimeoutError(f"Lock {path} held for more than {LOCK_TIMEOUT}s; remove it if no update is running")
+            time.sleep(1)
+
+
+def update_task(group_dir, datadir, task, subjects, rebuild=False):
+    """Add subjects not yet in the task's accumulators and rewrite its group maps."""
+    os.makedirs(group_dir, exist_ok=True)
+    state_path = os.path.join(group_dir, f"{task}_accumulators.npz")
+    lock_path = f"{state_path}.lock"
+    fd = _lock(lock_path)
+    try:
+        if rebuild and os.path.exists(state_path):
+            os.remove(state_path)
+        acc = GroupAccumulator(state_path)
+        added = 0
+        for subject in subjects:
+            if subject in acc.subjects:
+                logging.info(f"sub-{subject} already in {task} group maps; skipping")
+                continue
+            maps = subject_maps(datadir, subject, task)
+            if not os.path.exists(maps['zstat']):
+                logging.error(f"Missing zstat for sub-{subject} {task}: {maps['zstat']}")
+                continue
+            acc.add(subject, maps)
+            added += 1
+            logging.info(f"Added sub-{subject} to {task} group maps (n={acc.n})")
+        if added:
+            acc.save()
+        if acc.n:
+            acc.write_maps(group_dir, task)
+        return acc
+    finally:
+        os.close(fd)
+        os.remove(lock_path)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Accumulate group mean, SD and activation frequency maps in MNI space")
+    parser.add_argument("--group_dir", default=None, help="Output folder (default: $ARCHIVEDIR/group)")
+    parser.add_argument("--tasks", default=os.environ.get('TASKS', DEFAULT_TASKS), help="Space-separated tasks")
+    parser.add_argument("--rebuild", action="store_true", help="Discard the accumulators and start from these subjects")
+    parser.add_argument("subjects", nargs="+", help="List of subject IDs")
+    args = parser.parse_args(argv)
+
+    archivedir = os.environ.get('ARCHIVEDIR', '')
+    datadir = os.environ.get('DATADIR', os.path.join(archivedir, "derivatives"))
+    group_dir = args.group_dir or os.path.join(archivedir, "group")
+    for task in args.tasks.split():
+        acc = update_task(group_dir, datadir, task, args.subjects, args.rebuild)
+        logging.info(f"{task}: {acc.n} subjects in {group_dir}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
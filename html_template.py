@@ -2,6 +2,9 @@
 # Updated to add unthresholded viewers with iframes and links, Apr 2025
 # Updated to make figures, tables, and viewers the same width, May 2025
 # Updated to fix Native Space Z=2.35 tab, remove Z=2.35 viewers, reduce viewer spacing, and left-align elements, May 2025
+# Updated to add the cohort dashboard index (DASHBOARD_TEMPLATE) used by cohort_dashboard.py, Oct 2026
+# Updated to show the preview viewers first with a link that loads the full-resolution viewer, Oct 2026
+# Updated to add a Signal QC tab with the tSNR summary of each run (tsnr_qc.py), Oct 2026
 
 HTML_TEMPLATE = """
 <!DOCTYPE html>
@@ -69,6 +72,22 @@ HTML_TEMPLATE = """
         img.report-element {{
             /* Ensure images scale properly */
         }}
+        .qc-table {{
+            border-collapse: collapse;
+            font-size: 13px;
+            margin-bottom: 12px;
+        }}
+        .qc-table th, .qc-table td {{
+            border: 1px solid #ccc;
+            padding: 4px 8px;
+            text-align: right;
+        }}
+        .qc-table th {{
+            background-color: #e9ecef;
+        }}
+        .qc-table tr.qc-flagged td {{
+            background-color: #fde2e2;
+        }}
         .viewer {{
             aspect-ratio: 4/3;
             margin-bottom: 5px; /* Reduced from 20px for smaller spacing */
@@ -81,6 +100,7 @@ HTML_TEMPLATE = """
     <div class="space-tab">
         <button class="space-tablinks" onclick="openSpaceTab(event, 'Native')" id="defaultSpaceOpen">Native Space</button>
         <button class="space-tablinks" onclick="openSpaceTab(event, 'MNI')">MNI Space</button>
+        <button class="space-tablinks" onclick="openSpaceTab(event, 'QC')">Signal QC</button>
     </div>
 
     <!-- Native Space Content -->
@@ -98,14 +118,17 @@ HTML_TEMPLATE = """
             <img src="data:image/png;base64,{native_table_img_tfce_31}" alt="Native TFCE Table Plot Z=3.1" class="report-element">
             <h2>Interactive Brain Viewer (Native Space, Z=3.1)</h2>
             <h3>Motor 1</h3>
-            <iframe src="{native_viewer_unthresh_31_motor1}" class="viewer report-element"></iframe>
-            <p><a href="{native_viewer_unthresh_31_motor1}" target="_blank">Open Motor 1 Z=3.1 Viewer in New Tab</a></p>
+            <iframe src="{native_viewer_unthresh_31_preview_motor1}" id="viewer_motor1" class="viewer report-element"></iframe>
+            <p><a href="{native_viewer_unthresh_31_motor1}" onclick="return loadFullViewer('viewer_motor1', this.href)">Load Full Resolution</a> |
+               <a href="{native_viewer_unthresh_31_motor1}" target="_blank">Open Motor 1 Z=3.1 Viewer in New Tab</a></p>
             <h3>Motor 2</h3>
-            <iframe src="{native_viewer_unthresh_31_motor2}" class="viewer report-element"></iframe>
-            <p><a href="{native_viewer_unthresh_31_motor2}" target="_blank">Open Motor 2 Z=3.1 Viewer in New Tab</a></p>
+            <iframe src="{native_viewer_unthresh_31_preview_motor2}" id="viewer_motor2" class="viewer report-element"></iframe>
+            <p><a href="{native_viewer_unthresh_31_motor2}" onclick="return loadFullViewer('viewer_motor2', this.href)">Load Full Resolution</a> |
+               <a href="{native_viewer_unthresh_31_motor2}" target="_blank">Open Motor 2 Z=3.1 Viewer in New Tab</a></p>
             <h3>Language</h3>
-            <iframe src="{native_viewer_unthresh_31_language}" class="viewer report-element"></iframe>
-            <p><a href="{native_viewer_unthresh_31_language}" target="_blank">Open Language Z=3.1 Viewer in New Tab</a></p>
+            <iframe src="{native_viewer_unthresh_31_preview_language}" id="viewer_language" class="viewer report-element"></iframe>
+            <p><a href="{native_viewer_unthresh_31_language}" onclick="return loadFullViewer('viewer_language', this.href)">Load Full Resolution</a> |
+               <a href="{native_viewer_unthresh_31_language}" target="_blank">Open Language Z=3.1 Viewer in New Tab</a></p>
         </div>
         <div id="Native_235" class="thresh-tabcontent">
             <h2>Z-Maps with ROI Outlines (Native Space, Z=2.35)</h2>
@@ -141,6 +164,11 @@ HTML_TEMPLATE = """
         </div>
     </div>
 
+    <!-- Signal QC Content (tsnr_qc.py, carpet.py) -->
+    <div id="QC" class="space-tabcontent">
+        {signal_qc}
+    </div>
+
     <script>
         function openSpaceTab(evt, spaceName) {{
             var i, spaceTabcontent, spaceTablinks;
@@ -154,7 +182,10 @@ HTML_TEMPLATE = """
             }}
             document.getElementById(spaceName).style.display = "block";
             evt.currentTarget.className += " active";
-            document.getElementById("defaultThresh" + spaceName).click();
+            var defaultThresh = document.getElementById("defaultThresh" + spaceName);
+            if (defaultThresh) {{
+                defaultThresh.click();
+            }}
         }}
 
         function openThreshTab(evt, threshName, spaceName) {{
@@ -175,8 +206,157 @@ HTML_TEMPLATE = """
             evt.currentTarget.className += " active";
         }}
 
+        // Swap a preview viewer for its full-resolution version (loaded only now)
+        function loadFullViewer(viewerId, href) {{
+            document.getElementById(viewerId).src = href;
+            return false;
+        }}
+
         document.getElementById("defaultSpaceOpen").click();
     </script>
 </body>
 </html>
-"""
\ No newline at end of file
+"""
+# Cohort index page for cohort_dashboard.py: the summary rows are embedded as JSON and each
+# subject's detail tab loads subjects/sub-<id>.js (a JSON payload wrapped in a callback, so
+# it also works from file://) only when the subject is first opened.
+DASHBOARD_TEMPLATE = """
+<!DOCTYPE html>
+<html>
+<head>
+    <meta charset="utf-8">
+    <title>RECOVER Cohort Dashboard</title>
+    <style>
+        body {{ font-family: Arial, sans-serif; margin: 20px; }}
+        #summary {{ border-collapse: collapse; font-size: 13px; }}
+        #summary th, #summary td {{ border: 1px solid #ccc; padding: 4px 8px; text-align: right; }}
+        #summary th {{ background-color: #e9ecef; cursor: pointer; position: sticky; top: 0; }}
+        #summary th.sorted-asc::after {{ content: " \\25B2"; }}
+        #summary th.sorted-desc::after {{ content: " \\25BC"; }}
+        #summary td.text {{ text-align: left; }}
+        #summary tr.outlier td {{ background-color: #fde2e2; }}
+        #summary td.subject {{ color: #0645ad; cursor: pointer; text-decoration: underline; }}
+        .table-wrap {{ max-height: 55vh; overflow: auto; display: inline-block; }}
+        .subject-tab {{ overflow: hidden; border: 1px solid #ccc; background-color: #f1f1f1; margin-top: 16px; }}
+        .subject-tab button {{ background-color: inherit; float: left; border: none; cursor: pointer; padding: 10px 14px; }}
+        .subject-tab button:hover {{ background-color: #ddd; }}
+        .subject-tab button.active {{ background-color: #ccc; }}
+        .subject-panel {{ display: none; padding: 6px 12px; border: 1px solid #ccc; border-top: none; }}
+        .subject-panel table {{ border-collapse: collapse; font-size: 12px; margin-bottom: 12px; }}
+        .subject-panel th, .subject-panel td {{ border: 1px solid #ddd; padding: 3px 6px; }}
+        .subject-panel th {{ background-color: #f1f3f5; }}
+    </style>
+</head>
+<body>
+    <h1>RECOVER Cohort Dashboard</h1>
+    <p>{n_subjects} subjects, generated {generated}. Click a column to sort and a subject to open its details (MNI space, main ROI per task).</p>
+    <p>Filter subjects: <input id="filter" type="text" oninput="renderSummary()"></p>
+    <div class="table-wrap"><table id="summary"><thead><tr id="summary-head"></tr></thead><tbody id="summary-body"></tbody></table></div>
+    <div class="subject-tab" id="subject-tabs"></div>
+    <div id="subject-panels"></div>
+
+    <script>
+        var COLUMNS = {columns};
+        var SUMMARY = {summary};
+        var sortColumn = 0, sortAscending = true, loaded = {{}};
+
+        function sortKey(value) {{
+            var number = parseFloat(value);
+            return isNaN(number) ? null : number;
+        }}
+
+        function renderSummary() {{
+            var filter = document.getElementById("filter").value.toLowerCase();
+            var rows = SUMMARY.filter(function (row) {{ return String(row[0]).toLowerCase().indexOf(filter) !== -1; }});
+            rows.sort(function (a, b) {{
+                var x = sortKey(a[sortColumn]), y = sortKey(b[sortColumn]), result;
+                if (x !== null && y !== null) {{ result = x - y; }}
+                else if (x !== null) {{ result = -1; }}
+                else if (y !== null) {{ result = 1; }}
+                else {{ result = String(a[sortColumn]).localeCompare(String(b[sortColumn])); }}
+                return sortAscending ? result : -result;
+            }});
+            var head = document.getElementById("summary-head");
+            head.innerHTML = "";
+            COLUMNS.forEach(function (name, i) {{
+                var th = document.createElement("th");
+                th.textContent = name;
+                if (i === sortColumn) {{ th.className = sortAscending ? "sorted-asc" : "sorted-desc"; }}
+                th.onclick = function () {{
+                    sortAscending = (i === sortColumn) ? !sortAscending : true;
+                    sortColumn = i;
+                    renderSummary();
+                }};
+                head.appendChild(th);
+            }});
+            var body = document.getElementById("summary-body");
+            var html = [];
+            rows.forEach(function (row) {{
+                var outlier = row[COLUMNS.length] ? ' class="outlier"' : '';
+                html.push("<tr" + outlier + ">");
+                row.slice(0, COLUMNS.length).forEach(function (value, i) {{
+                    var cls = i === 0 ? "text subject" : (sortKey(value) === null ? "text" : "");
+                    var click = i === 0 ? ' onclick="openSubject(\\'' + value + '\\')"' : '';
+                    html.push('<td class="' + cls + '"' + click + '>' + value + '</td>');
+                }});
+                html.push("</tr>");
+            }});
+            body.innerHTML = html.join("");
+        }}
+
+        function showSubject(subject) {{
+            var panels = document.getElementsByClassName("subject-panel");
+            for (var i = 0; i < panels.length; i++) {{ panels[i].style.display = "none"; }}
+            var buttons = document.getElementsByClassName("subject-button");
+            for (var j = 0; j < buttons.length; j++) {{ buttons[j].className = "subject-button"; }}
+            document.getElementById("panel-" + subject).style.display = "block";
+            document.getElementById("button-" + subject).className = "subject-button active";
+        }}
+
+        function openSubject(subject) {{
+            if (!document.getElementById("panel-" + subject)) {{
+                var button = document.createElement("button");
+                button.id = "button-" + subject;
+                button.className = "subject-button";
+                button.textContent = subject;
+                button.onclick = function () {{ showSubject(subject); }};
+                document.getElementById("subject-tabs").appendChild(button);
+                var panel = document.createElement("div");
+                panel.id = "panel-" + subject;
+                panel.className = "subject-panel";
+                panel.textContent = "Loading...";
+                document.getElementById("subject-panels").appendChild(panel);
+                var script = document.createElement("script");
+                script.src = "subjects/sub-" + subject + ".js";
+                script.onerror = function () {{ panel.textContent = "No details found for " + subject; }};
+                document.body.appendChild(script);
+            }}
+            showSubject(subject);
+        }}
+
+        function subjectLoaded(subject, data) {{
+            loaded[subject] = data;
+            var html = ["<p>"];
+            data.reports.forEach(function (report) {{
+                html.push('<a href="' + report[1] + '" target="_blank">' + report[0] + '</a> &nbsp; ');
+            }});
+            html.push("</p>");
+            data.tasks.forEach(function (task) {{
+                html.push("<h3>" + task.task + "</h3><table><tr>");
+                data.columns.forEach(function (name) {{ html.push("<th>" + name + "</th>"); }});
+                html.push("</tr>");
+                task.rows.forEach(function (row) {{
+                    html.push("<tr>");
+                    row.forEach(function (value) {{ html.push("<td>" + value + "</td>"); }});
+                    html.push("</tr>");
+                }});
+                html.push("</table>");
+            }});
+            document.getElementById("panel-" + subject).innerHTML = html.join("");
+        }}
+
+        renderSummary();
+    </script>
+</body>
+</html>
+"""
@@ -1,13 +1,14 @@
 #!/usr/bin/env python
 # coding: utf-8
 import os
+import functools
 import numpy as np
 import pandas as pd
 import matplotlib.pyplot as plt
 from scipy.stats import pearsonr
 from nilearn import image, plotting
 from nilearn.maskers import NiftiMasker
-from nilearn.input_data import NiftiMapsMasker
+from nilearn.maskers import NiftiMapsMasker
 from nilearn.glm.first_level import FirstLevelModel
 from nilearn.datasets import load_mni152_template
 from nilearn.image import threshold_img
@@ -18,16 +19,8 @@ import base64
 from io import BytesIO
 from scipy.ndimage import label
 import nibabel as nib
-
-# Parse command-line arguments
-parser = argparse.ArgumentParser(description="Generate ICA reports for subjects")
-parser.add_argument("--sub_dir", required=True, help="Directory containing input data")
-parser.add_argument("--tasks", required=True, help="Space-separated list of tasks (e.g., 'motor_run-01 motor_run-02 lang')")
-parser.add_argument("subjects", nargs="+", help="List of subject IDs")
-args = parser.parse_args()
-
-sub_dir = args.sub_dir
-tasks = args.tasks.split()  # Convert space-separated string to list
+from nifti_cache import load_img
+from profiling import profiler
 
 # Set up task timing to convert to volumes
 tr = 0.8  # Repetition time in seconds
@@ -38,119 +31,159 @@ num_blocks = 10  # Number of on-off cycles
 task_regressor = np.tile([1] * block_duration + [0] * block_duration, num_blocks)
 
 
-for subj in args.subjects:
-    report_sections = []
-    report_dir = os.path.join(sub_dir, f"post_stats")
-    os.makedirs(report_dir, exist_ok=True)
-    for task in tasks:
-        print(f"\nProcessing Subject {subj}, Task {task}")
-        
-        base = os.path.join(sub_dir, f"fsl_stats/sub-{subj}_task-{task}_contrasts.feat")
-        ica_path = os.path.join(base, "filtered_func_data.ica")
-        
-        func_file = os.path.join(base, "filtered_func_data.nii.gz")
-        melodic_ic_file = os.path.join(ica_path, "melodic_IC.nii.gz")
-        melodic_mix_file = os.path.join(ica_path, "melodic_mix")
-        zstat_file = os.path.join(base, "stats/zstat1.nii.gz")
-        
-        # Check if required files exist
-        for f in [func_file, melodic_ic_file, melodic_mix_file, zstat_file]:
-            if not os.path.exists(f):
-                print(f"Warning: File {f} not found for subject {subj}, task {task}. Skipping.")
-                continue
-        
-        melodic_ic_img = image.load_img(melodic_ic_file)
-        melodic_mix = np.loadtxt(melodic_mix_file)
-        melodic_df = pd.DataFrame(melodic_mix)
-        
-        # Find best-matching component
-        correlations = [pearsonr(melodic_df.iloc[:, i], task_regressor)[0] for i in range(melodic_df.shape[1])]
-        best_component = np.argmax(np.abs(correlations))
-        best_corr = correlations[best_component]
-        
-        # Spatial correlation with GLM zstat map
-        glm_map = image.load_img(zstat_file)
-        best_ic_map = image.index_img(melodic_ic_img, best_component)
-        
-        ic_data = image.get_data(best_ic_map).flatten()
-        glm_data = image.get_data(glm_map).flatten()
-        
-        valid_mask = ~np.isnan(ic_data) & ~np.isnan(glm_data)
-        spatial_corr = np.corrcoef(ic_data[valid_mask], glm_data[valid_mask])[0, 1]
-        
-        # Extract and threshold best component
-        best_ic_map = image.index_img(melodic_ic_img, best_component)
-        threshold = np.percentile(image.get_data(best_ic_map), 90)
-        binary_mask_img = image.math_img(f"img > {threshold}", img=best_ic_map)
-        
-        # Time series from top voxels
-        masker = NiftiMasker(mask_img=binary_mask_img, standardize=True)
-        voxel_timeseries = masker.fit_transform(func_file)
-        avg_timeseries = np.mean(voxel_timeseries, axis=1)
-        
-        # Dual regression
-        ica_masker = NiftiMapsMasker(maps_img=melodic_ic_img, standardize=True)
-        ica_timeseries = ica_masker.fit_transform(func_file)
-        ica_df = pd.DataFrame(ica_timeseries, columns=[f"Comp_{i}" for i in range(ica_timeseries.shape[1])])
-        
-        glm = FirstLevelModel(t_r=tr)
-        glm.fit(func_file, design_matrices=[ica_df])
-        subject_maps = glm.compute_contrast(np.eye(ica_timeseries.shape[1]))
-        subject_maps.to_filename(os.path.join(base, f"sub-{subj}_{task}_dual_regression_maps.nii.gz"))
-        
-        best_map = image.index_img(melodic_ic_img, best_component)
+def find_best_component(melodic_mix, regressor=task_regressor):
+    """Return the ICA component whose time course best matches the task regressor, and its correlation."""
+    melodic_df = pd.DataFrame(melodic_mix)
+    if len(regressor) != melodic_df.shape[0]:
+        raise ValueError(f"Task regressor has {len(regressor)} volumes but melodic_mix has {melodic_df.shape[0]}")
+    correlations = [pearsonr(melodic_df.iloc[:, i], regressor)[0] for i in range(melodic_df.shape[1])]
+    best_component = np.argmax(np.abs(correlations))
+    return best_component, correlations[best_component]
+
+
+def spatial_correlation(ic_map, glm_map):
+    """Spatial correlation between an ICA component map and the GLM zstat map."""
+    ic_data = image.get_data(ic_map).flatten()
+    glm_data = image.get_data(glm_map).flatten()
+
+    valid_mask = ~np.isnan(ic_data) & ~np.isnan(glm_data)
+    return np.corrcoef(ic_data[valid_mask], glm_data[valid_mask])[0, 1]
+
+
+def top_voxel_timeseries(func_img, ic_map, percentile=90):
+    """Mean standardized time series of the voxels in the top (100 - percentile)% of the component map."""
+    threshold = np.percentile(image.get_data(ic_map), percentile)
+    binary_mask_img = image.math_img(f"img > {threshold}", img=ic_map)
+
+    masker = NiftiMasker(mask_img=binary_mask_img, standardize=True)
+    voxel_timeseries = masker.fit_transform(func_img)
+    return np.mean(voxel_timeseries, axis=1)
+
+
+def dual_regression(func_img, melodic_ic_img):
+    """Dual regression of the run onto all ICA maps; returns the subject-level map image."""
+    ica_masker = NiftiMapsMasker(maps_img=melodic_ic_img, standardize=True)
+    ica_timeseries = ica_masker.fit_transform(func_img)
+    ica_df = pd.DataFrame(ica_timeseries, columns=[f"Comp_{i}" for i in range(ica_timeseries.shape[1])])
+
+    glm = FirstLevelModel(t_r=tr)
+    glm.fit(func_img, design_matrices=[ica_df])
+    return glm.compute_contrast(np.eye(ica_timeseries.shape[1]))
+
+
+def threshold_ica_map(best_map, z_threshold=3.1, min_cluster_size=20):
+    """Voxel threshold the component map and remove clusters smaller than min_cluster_size."""
+    voxel_thresh_map = threshold_img(best_map, threshold=z_threshold)
+
+    # Convert to binary image and label clusters
+    data = voxel_thresh_map.get_fdata()
+    labels, n_clusters = label(data > 0)
+
+    # Remove clusters smaller than min size (min_cluster_size=20 is a typical FSL choice)
+    cleaned_data = np.zeros(data.shape)
+    for i in range(1, n_clusters + 1):
+        cluster = (labels == i)
+        if cluster.sum() >= min_cluster_size:
+            cleaned_data[cluster] = data[cluster]
+
+    return nib.Nifti1Image(cleaned_data, affine=voxel_thresh_map.affine)
+
+
+@functools.lru_cache(maxsize=1)
+def mni_template():
+    """MNI152 background image, loaded once per process."""
+    return load_mni152_template()
+
 
-        # Apply voxel threshold Z > 3.1
-        voxel_thresh_map = threshold_img(best_map, threshold=3.1)
-        # Cluster cleanup (optional — post-process for contiguous blobs)
+def plot_timeseries(avg_timeseries, best_component):
+    """Plot the mean voxel time series and return it as a base64-encoded PNG."""
+    buf_ts = BytesIO()
+    plt.figure()
+    plt.plot(avg_timeseries)
+    plt.title(f"Mean Voxel Time Series - Component {best_component}")
+    plt.xlabel("Time (TR)")
+    plt.ylabel("Signal")
+    plt.tight_layout()
+    plt.savefig(buf_ts, format='png', dpi=100)
+    plt.close()
+    buf_ts.seek(0)
+    return base64.b64encode(buf_ts.read()).decode('utf-8')
 
-        # Convert to binary image and label clusters
-        data = voxel_thresh_map.get_fdata()
-        labels, n_clusters = label(data > 0)
 
-        # Remove clusters smaller than min size
-        min_cluster_size = 20  # typical FSL choice
-        cleaned_data = np.zeros(data.shape)
+def plot_ica_map(thresholded_ica_map, best_component):
+    """Plot the thresholded component map on the MNI template and return it as a base64-encoded PNG."""
+    buf_dr = BytesIO()
+    display = plotting.plot_stat_map(
+        thresholded_ica_map,
+        bg_img=mni_template(),
+        title=f"Thresholded Component {best_component}",
+        display_mode="ortho",
+        colorbar=True
+    )
+    display.frame_axes.figure.savefig(buf_dr, format='png', dpi=100)
+    display.close()
+    buf_dr.seek(0)
+    return base64.b64encode(buf_dr.read()).decode('utf-8')
 
-        for i in range(1, n_clusters + 1):
-            cluster = (labels == i)
-            if cluster.sum() >= min_cluster_size:
-                cleaned_data[cluster] = data[cluster]
 
-        # Save final map
-        thresholded_ica_map = nib.Nifti1Image(cleaned_data, affine=voxel_thresh_map.affine)
+def process_task(sub_dir, subj, task):
+    """Run the ICA analysis for one subject and task; returns the report section HTML, or None if inputs are missing."""
+    print(f"\nProcessing Subject {subj}, Task {task}")
+
+    base = os.path.join(sub_dir, f"fsl_stats/sub-{subj}_task-{task}_contrasts.feat")
+    ica_path = os.path.join(base, "filtered_func_data.ica")
+
+    func_file = os.path.join(base, "filtered_func_data.nii.gz")
+    melodic_ic_file = os.path.join(ica_path, "melodic_IC.nii.gz")
+    melodic_mix_file = os.path.join(ica_path, "melodic_mix")
+    zstat_file = os.path.join(base, "stats/zstat1.nii.gz")
+
+    # Check if required files exist
+    for f in [func_file, melodic_ic_file, melodic_mix_file, zstat_file]:
+        if not os.path.exists(f):
+            print(f"Warning: File {f} not found for subject {subj}, task {task}. Skipping.")
+            return None
+
+    melodic_ic_img = load_img(melodic_ic_file)  # Memory-mapped working copies skip repeated gzip decoding
+    func_img = load_img(func_file)
+    melodic_mix = np.loadtxt(melodic_mix_file)
+
+    # Find best-matching component
+    with profiler.section(f"ica/{task}/find_best_component"):
+        try:
+            best_component, best_corr = find_best_component(melodic_mix)
+        except ValueError as e:
+            print(f"Error: {e} for subject {subj}, task {task}. Skipping.")
+            return None
+
+    # Spatial correlation with GLM zstat map
+    with profiler.section(f"ica/{task}/spatial_correlation"):
+        glm_map = load_img(zstat_file)
+        best_ic_map = image.index_img(melodic_ic_img, best_component)
+        spatial_corr = spatial_correlation(best_ic_map, glm_map)
+
+    # Time series from top voxels
+    with profiler.section(f"ica/{task}/top_voxel_timeseries"):
+        avg_timeseries = top_voxel_timeseries(func_img, best_ic_map)
+
+    # Dual regression
+    with profiler.section(f"ica/{task}/dual_regression"):
+        subject_maps = dual_regression(func_img, melodic_ic_img)
+        subject_maps.to_filename(os.path.join(base, f"sub-{subj}_{task}_dual_regression_maps.nii.gz"))
+
+    # Apply voxel threshold Z > 3.1 and cluster cleanup, then save final map
+    with profiler.section(f"ica/{task}/threshold_ica_map"):
+        thresholded_ica_map = threshold_ica_map(best_ic_map)
         thresholded_ica_path = os.path.join(base, f"sub-{subj}_{task}_ica_thresholded.nii.gz")
         nib.save(thresholded_ica_map, thresholded_ica_path)
-        
-        # --- Plot time series and encode to base64 ---
-        buf_ts = BytesIO()
-        plt.figure()
-        plt.plot(avg_timeseries)
-        plt.title(f"Mean Voxel Time Series - Component {best_component}")
-        plt.xlabel("Time (TR)")
-        plt.ylabel("Signal")
-        plt.tight_layout()
-        plt.savefig(buf_ts, format='png', dpi=100)
-        plt.close()
-        buf_ts.seek(0)
-        ts_b64 = base64.b64encode(buf_ts.read()).decode('utf-8')
-
-        # --- Plot dual regression map and encode to base64 ---
-        buf_dr = BytesIO()
-        display = plotting.plot_stat_map(
-            thresholded_ica_map,
-            bg_img=load_mni152_template(),
-            title=f"Thresholded Component {best_component}",
-            display_mode="ortho",
-            colorbar=True
-        )
-        display.savefig(buf_dr, dpi=100)
-        display.close()
-        buf_dr.seek(0)
-        dr_b64 = base64.b64encode(buf_dr.read()).decode('utf-8')
-
-        ...
-        section_html = f"""
+
+    # --- Plot time series and thresholded map, encoded to base64 ---
+    with profiler.section(f"ica/{task}/plot_timeseries"):
+        ts_b64 = plot_timeseries(avg_timeseries, best_component)
+    with profiler.section(f"ica/{task}/plot_ica_map"):
+        dr_b64 = plot_ica_map(thresholded_ica_map, best_component)
+
+    return f"""
         <h2>Task: {task}</h2>
         <p><strong>Best-matching ICA component:</strong> {best_component}</p>
         <p><strong>Temporal correlation with task regressor:</strong> {best_corr:.3f}</p>
@@ -160,10 +193,48 @@ for subj in args.subjects:
         <h3>Thresholded ICA Map</h3>
         <img src="data:image/png;base64,{dr_b64}" width="600"><br>
         """
-        report_sections.append(section_html)
-        
+
+
+def generate_report(sub_dir, tasks, subj):
+    """Process every task for one subject and write the combined ICA report."""
+    report_sections = []
+    report_dir = os.path.join(sub_dir, f"post_stats")
+    os.makedirs(report_dir, exist_ok=True)
+    for task in tasks:
+        section_html = process_task(sub_dir, subj, task)
+        if section_html is not None:
+            report_sections.append(section_html)
+
     html_file = os.path.join(report_dir, f"sub-{subj}_ica_report_alltasks.html")
     with open(html_file, "w") as f:
         f.write(f"<h1>ICA Report for Subject {subj}</h1>")
         f.writelines(report_sections)
     print(f"Report for subject {subj} saved to {html_file}")
+    return html_file
+
+
+def main(argv=None):
+    # Parse command-line arguments
+    parser = argparse.ArgumentParser(description="Generate ICA reports for subjects")
+    parser.add_argument("--sub_dir", required=True, help="Directory containing input data")
+    parser.add_argument("--tasks", required=True, help="Space-separated list of tasks (e.g., 'motor_run-01 motor_run-02 lang')")
+    parser.add_argument("subjects", nargs="+", help="List of subject IDs")
+    parser.add_argument("--profile", action="store_true",
+                        help="Record per-step timings, memory peaks and cProfile/flamegraph stacks in post_stats/profile/")
+    args = parser.parse_args(argv)
+
+    sub_dir = args.sub_dir
+    tasks = args.tasks.split()  # Convert space-separated string to list
+
+    for subj in args.subjects:
+        if args.profile:
+            profiler.start()
+        try:
+            generate_report(sub_dir, tasks, subj)
+        finally:
+            if args.profile:
+                profiler.stop(os.path.join(sub_dir, "post_stats", "profile"), f"sub-{subj}_ica_corr")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,272 @@
+#!/opt/anaconda3/bin/python
+# Python 3.8.20
+# layout_index.py: Persistent SQLite index of the derivatives tree, queried by BIDS entities
+# Created for RECOVER project, Oct 2026
+#
+# Every file and folder under the derivatives root is stored once in <root>/.layout_index.sqlite
+# (LAYOUT_INDEX overrides the location) with the entities parsed from its name (sub, ses, task,
+# run, space, desc, suffix, extension). Files inside a folder inherit the folder's entities, so
+# zstat1.nii.gz in sub-<id>_task-motor_run-01_contrasts.feat/stats knows its subject, task and run.
+# Runs are stored as integers, so run-1 (old task pipeline) and run-01 match the same query.
+# refresh() walks a subtree and re-lists only the folders whose mtime changed since the last
+# scan (adding, removing or renaming an entry updates its folder's mtime); unchanged folders cost
+# one stat. Queries are indexed SELECTs, e.g.
+#   layout.get(subject='001', datatype='anat', space='MNI152*', desc='preproc', suffix='T1w', ext='.nii.gz')
+# Values containing * or ? are glob patterns; '' matches files without that entity.
+# Usage: python layout_index.py [--root DIR] refresh [<subject_id> ...]
+#        python layout_index.py [--root DIR] get|query --subject ID [--task T] [--space S] ...   (prints paths)
+
+import os
+import sys
+import json
+import sqlite3
+import logging
+import argparse
+
+# Set up logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+INDEX_NAME = ".layout_index.sqlite"
+SCHEMA_VERSION = 1
+# Entity keys in file names -> indexed columns; other entities are kept in the 'entities' JSON column
+ENTITY_COLUMNS = {'sub': 'subject', 'ses': 'session', 'task': 'task', 'run': 'run', 'space': 'space', 'desc': 'desc'}
+QUERY_COLUMNS = ('subject', 'session', 'task', 'run', 'space', 'desc', 'suffix', 'ext', 'datatype', 'name', 'is_dir')
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS files (
+    path TEXT PRIMARY KEY, dir TEXT NOT NULL, name TEXT NOT NULL, is_dir INTEGER NOT NULL,
+    subject TEXT, session TEXT, task TEXT, run INTEGER, space TEXT, desc TEXT,
+    suffix TEXT, ext TEXT, datatype TEXT, entities TEXT
+);
+CREATE INDEX IF NOT EXISTS files_subject ON files (subject, suffix);
+CREATE INDEX IF NOT EXISTS files_dir ON files (dir);
+CREATE TABLE IF NOT EXISTS dirs (path TEXT PRIMARY KEY, parent TEXT, mtime_ns INTEGER);
+CREATE INDEX IF NOT EXISTS dirs_parent ON dirs (parent);
+"""
+
+
+def parse_name(name):
+    """(entities, suffix, ext) of a BIDS-style file or folder name.
+
+    'sub-01_task-motor_run-01_contrasts.feat' -> ({'sub': '01', 'task': 'motor', 'run': '01'}, 'contrasts', '.feat');
+    names without entities keep their whole stem as suffix ('thresh_zstat1_native.nii.gz' -> 'thresh_zstat1_native').
+    """
+    stem, dot, ext = name.partition('.')
+    entities, words = {}, []
+    for token in stem.split('_'):
+        key, dash, value = token.partition('-')
+        if dash and key.isalnum() and value:
+            entities[key] = value
+        else:
+            words.append(token)
+    return entities, '_'.join(words) or None, dot + ext if dot else ''
+
+
+def task_entities(task):
+    """Entities of a pipeline task label: 'motor_run-01' -> {'task': 'motor', 'run': 1}."""
+    name, _, rest = task.partition('_')
+    entities = {'task': name}
+    for token in rest.split('_') if rest else []:
+        key, _, value = token.partition('-')
+        if key == 'run':
+            entities['run'] = int(value)
+    return entities
+
+
+def _run_number(value):
+    return int(value) if value is not None and value.isdigit() else None
+
+
+class LayoutIndex:
+    def __init__(self, root, db_path=None):
+        self.root = os.path.abspath(root)
+        if db_path is None:
+            db_path = os.environ.get('LAYOUT_INDEX', os.path.join(self.root, INDEX_NAME))
+        try:
+            self.db = sqlite3.connect(db_path, timeout=60)
+            self._init_schema()
+        except sqlite3.Error as e:  # Read-only share: index this process's view in memory instead
+            logging.warning(f"Layout index {db_path} not usable ({e}); using an in-memory index")
+            self.db = sqlite3.connect(":memory:")
+            self._init_schema()
+        self._refreshed = set()
+
+    def _init_schema(self):
+        version = self.db.execute("PRAGMA user_version").fetchone()[0]
+        if version != SCHEMA_VERSION:
+            self.db.executescript("DROP TABLE IF EXISTS files; DROP TABLE IF EXISTS dirs;")
+        self.db.executescript(SCHEMA)
+        self.db.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+        self.db.commit()
+
+    def _dir_context(self, path):
+        """Entities and datatype inherited by entries of the folder at path (parsed from root down)."""
+        entities, datatype = {}, None
+        rel = os.path.relpath(path, self.root)
+        for part in ([] if rel == '.' else rel.split(os.sep)):
+            part_entities, _, _ = parse_name(part)
+            if part_entities:
+                entities.update(part_entities)
+                if set(part_entities) <= {'sub', 'ses'}:
+                    datatype = None  # The next folder below sub-<id>/ses-<id> names the datatype
+            elif datatype is None and 'sub' in entities:
+                datatype = part
+        return entities, datatype
+
+    def _rows(self, path, names, entities, datatype):
+        rows = []
+        for name, is_dir in names:
+            own, suffix, ext = parse_name(name)
+            merged = dict(entities, **own)
+            if is_dir and datatype is None and 'sub' in merged and not own:
+                entry_datatype = name  # anat, func, fsl_stats, ROI, post_stats ...
+            else:
+                entry_datatype = datatype
+            extra = {k: v for k, v in merged.items() if k not in ENTITY_COLUMNS}
+            rows.append((os.path.join(path, name), path, name, int(is_dir), merged.get('sub'), merged.get('ses'),
+                         merged.get('task'), _run_number(merged.get('run')), merged.get('space'), merged.get('desc'),
+                         suffix, ext, entry_datatype, json.dumps(extra) if extra else None))
+        return rows
+
+    def refresh(self, path=None):
+        """Bring the index of the subtree at path (default: the whole root) up to date; returns folders re-listed."""
+        path = os.path.abspath(path or self.root)
+        relisted = 0
+        stack = [path]
+        with self.db:
+            while stack:
+                current = stack.pop()
+                try:
+                    mtime_ns = os.stat(current).st_mtime_ns
+                except FileNotFoundError:
+                    self._forget(current)
+                    continue
+                known = self.db.execute("SELECT mtime_ns FROM dirs WHERE path = ?", (current,)).fetchone()
+                if known and known[0] == mtime_ns:
+                    stack.extend(r[0] for r in self.db.execute("SELECT path FROM dirs WHERE parent = ?", (current,)))
+                    continue
+                relisted += 1
+                with os.scandir(current) as it:
+                    names = [(e.name, e.is_dir()) for e in it if not e.name.startswith(INDEX_NAME)]  # Index and its journal
+                subdirs = {os.path.join(current, n) for n, is_dir in names if is_dir}
+                for (old,) in self.db.execute("SELECT path FROM dirs WHERE parent = ?", (current,)).fetchall():
+                    if old not in subdirs:
+                        self._forget(old)
+                entities, datatype = self._dir_context(current)
+                self.db.execute("DELETE FROM files WHERE dir = ?", (current,))
+                self.db.executemany("INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                                    self._rows(current, names, entities, datatype))
+                self.db.execute("INSERT OR REPLACE INTO dirs VALUES (?, ?, ?)", (current, os.path.dirname(current), mtime_ns))
+                stack.extend(subdirs)
+        if relisted:
+            logging.info(f"Layout index: re-listed {relisted} folder(s) under {path}")
+        return relisted
+
+    def _forget(self, path):
+        """Drop a folder that no longer exists and everything below it."""
+        pattern = path.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_') + os.sep + '%'
+        self.db.execute("DELETE FROM files WHERE path = ? OR path LIKE ? ESCAPE '\\'", (path, pattern))
+        self.db.execute("DELETE FROM dirs WHERE path = ? OR path LIKE ? ESCAPE '\\'", (path, pattern))
+
+    def refresh_subject(self, subject):
+        """Refresh sub-<subject> once per process (until reset)."""
+        if subject not in self._refreshed:
+            self.refresh(os.path.join(self.root, f"sub-{subject}"))
+            self._refreshed.add(subject)
+
+    def query(self, within=None, **entities):
+        """Sorted paths matching the entities (see QUERY_COLUMNS); within limits results to a folder subtree."""
+        clauses, params = [], []
+        for key, value in entities.items():
+            if key not in QUERY_COLUMNS:
+                raise ValueError(f"Unknown layout entity: {key}")
+            if value is None:
+                continue
+            if value == '':
+                clauses.append(f"{key} IS NULL")
+            elif isinstance(value, str) and ('*' in value or '?' in value):
+                clauses.append(f"{key} GLOB ?")
+                params.append(value)
+            else:
+                clauses.append(f"{key} = ?")
+                params.append(int(value) if key == 'run' else value)
+        if within:
+            clauses.append("path GLOB ?")
+            params.append(os.path.join(os.path.abspath(within), '*'))
+        sql = "SELECT path FROM files" + (" WHERE " + " AND ".join(clauses) if clauses else "") + " ORDER BY path"
+        return [r[0] for r in self.db.execute(sql, params)]
+
+    def get(self, **entities):
+        """First path matching the entities, or None."""
+        paths = self.query(**entities)
+        if len(paths) > 1:
+            logging.debug(f"Layout index: {len(paths)} matches for {entities}, using {paths[0]}")
+        return paths[0] if paths else None
+
+    def t1w(self, subject, space=None):
+        """Skull-stripped native T1w (space=None) or the preprocessed T1w in a template space ('MNI152*')."""
+        self.refresh_subject(subject)
+        if space is None:
+            return self.get(subject=subject, datatype='anat', space='', desc='brain', suffix='T1w', ext='.nii.gz')
+        return self.get(subject=subject, datatype='anat', space=space, desc='preproc', suffix='T1w', ext='.nii.gz')
+
+    def feat_dir(self, subject, task):
+        """FEAT folder of a pipeline task label ('motor_run-01', 'motor_run-1', 'lang')."""
+        self.refresh_subject(subject)
+        return self.get(subject=subject, datatype='fsl_stats', suffix='contrasts', ext='.feat', is_dir=1,
+                        **task_entities(task))
+
+    def close(self):
+        self.db.close()
+
+
+_indexes = {}
+
+
+def get_index(root=None):
+    """Process-wide index of root (default: $DATADIR, or $ARCHIVEDIR/derivatives)."""
+    if root is None:
+        root = os.environ.get('DATADIR', os.path.join(os.environ.get('ARCHIVEDIR', ''), "derivatives"))
+    root = os.path.abspath(root)
+    if root not in _indexes:
+        _indexes[root] = LayoutIndex(root)
+    return _indexes[root]
+
+
+def reset():
+    """Close every index of this process, so the next get_index() re-reads $DATADIR and refreshes subjects again."""
+    while _indexes:
+        _indexes.popitem()[1].close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Index the derivatives tree and query it by BIDS entities")
+    parser.add_argument("--root", default=None, help="Derivatives folder (default: $DATADIR or $ARCHIVEDIR/derivatives)")
+    sub = parser.add_subparsers(dest="command", required=True)
+    refresh = sub.add_parser("refresh", help="Update the index (whole tree, or the given subjects)")
+    refresh.add_argument("subjects", nargs="*", help="Subject IDs")
+    for name in ("get", "query"):
+        p = sub.add_parser(name, help="Print the first (get) or every (query) matching path")
+        p.add_argument("--subject", required=True)
+        for key in ('session', 'task', 'space', 'desc', 'suffix', 'ext', 'datatype', 'name'):
+            p.add_argument(f"--{key}", default=None)
+        p.add_argument("--run", type=int, default=None)
+    args = parser.parse_args(argv)
+
+    layout = get_index(args.root)
+    if args.command == "refresh":
+        for path in [os.path.join(layout.root, f"sub-{s}") for s in args.subjects] or [layout.root]:
+            layout.refresh(path)
+        return 0
+    layout.refresh_subject(args.subject)
+    entities = {key: getattr(args, key) for key in ('session', 'space', 'desc', 'suffix', 'ext', 'datatype', 'name', 'run')}
+    if args.task:
+        entities.update(task_entities(args.task))  # Pipeline labels such as motor_run-01 carry the run
+    paths = layout.query(subject=args.subject, **{k: v for k, v in entities.items() if v is not None})
+    for path in paths[:1] if args.command == "get" else paths:
+        print(path)
+    return 0 if paths else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
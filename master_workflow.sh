@@ -3,10 +3,17 @@
 # cal_post_stats_thresh.sh, output_generator.py, and randomise permutation testing.
 # Accepts subject IDs as command-line arguments with options to run specific steps or all.
 # Options: -f (FEAT stats), -p (randomise permutation testing), -c (calculate post-stats), 
-#          -o (generate output pdf+html), -a (all steps)
+#          -o (generate output pdf+html), -g (add subjects to the group maps), -a (all steps)
 # Created for RECOVER project by K. Nguyen and A. Wu, Mar 2025
+# Updated to run each (subject, task, stage) unit in isolation with retries and write a batch status report (unit_status.sh), Oct 2026
+# Updated to extract all ROI time series per task after post-stats (roi_timeseries.py), Oct 2026
+# Updated to rank cohort outliers by pairwise map similarity after the group maps (cohort_similarity.py), Oct 2026
+# Updated to rebuild the cohort dashboard index after the group maps (cohort_dashboard.py), Oct 2026
+# Updated to add REPORT_QUICKLOOK for first-pass QC reports, Oct 2026
+# Updated to run tSNR QC on each BOLD run before FEAT and optionally skip flagged runs (tsnr_qc.py), Oct 2026
+# Updated to draw a carpet plot of each run after post-stats (carpet.py), Oct 2026
 
-# Exit on any error
+# Exit on setup errors; pipeline units run through run_unit (unit_status.sh) and never stop the batch
 set -e
 
 # Default flags
@@ -15,31 +22,35 @@ RUN_RANDOMISE=0
 RUN_ICA=0
 RUN_CALC=0
 RUN_OUTPUT=0
-TASKS="motor_run-01 motor_run-02 lang"  # Default to all tasks
+RUN_GROUP=0
+TASKS="${TASKS:-motor_run-01 motor_run-02 lang}"  # Default to all tasks (work_queue.py workers pass TASKS)
 
 # Usage message
 usage() {
-    echo "Usage: $0 [-f] [-p] [-i] [-c] [-o] [-a] [-t task1,task2,...] <subject_id1> <subject_id2> ... <subject_idN>"
+    echo "Usage: $0 [-f] [-p] [-i] [-c] [-o] [-g] [-a] [-t task1,task2,...] <subject_id1> <subject_id2> ... <subject_idN>"
     echo "Options:"
     echo "  -f    Run only feat_contrasts_recover_cluster.sh (FEAT stats)"
     echo "  -p    Run only randomise permutation testing"
     echo "  -i    Run only ICA"
     echo "  -c    Run only calc_post_stats_thresh.sh (calculate post-stats)"
     echo "  -o    Run only output_generator.py (generate output pdf+html)"
+    echo "  -g    Run only the group stage: group_maps.py (add subjects to the group mean/SD/frequency maps),"
+    echo "        then cohort_similarity.py (outlier ranking) and cohort_dashboard.py (cohort index page)"
     echo "  -a    Run all steps (default if no options specified)"
     echo "  -t    Specify tasks to process (comma-separated, e.g., motor_run-01,lang; default: all tasks)"
     exit 1
 }
 
 # Parse options
-while getopts "fpicot" opt; do
+while getopts "fpicogat:" opt; do
     case $opt in
         f) RUN_FEAT=1 ;;
         p) RUN_RANDOMISE=1 ;;
         i) RUN_ICA=1 ;;
         c) RUN_CALC=1 ;;
         o) RUN_OUTPUT=1 ;;
-        a) RUN_FEAT=1 RUN_RANDOMISE=1 RUN_ICA=1 RUN_CALC=1 RUN_OUTPUT=1 ;;
+        g) RUN_GROUP=1 ;;
+        a) RUN_FEAT=1 RUN_RANDOMISE=1 RUN_ICA=1 RUN_CALC=1 RUN_OUTPUT=1 RUN_GROUP=1 ;;
         t) TASKS=$(echo "$OPTARG" | tr ',' ' ') ;;  # Convert comma-separated tasks to space-separated
         ?) usage ;;
     esac
@@ -55,12 +66,13 @@ if [ $# -eq 0 ]; then
 fi
 
 # If no options specified, default to running all steps
-if [ $RUN_FEAT -eq 0 ] && [ $RUN_CALC -eq 0 ] && [ $RUN_OUTPUT -eq 0 ] && [ $RUN_RANDOMISE -eq 0 ] && [ $RUN_ICA -eq 0 ]; then
+if [ $RUN_FEAT -eq 0 ] && [ $RUN_CALC -eq 0 ] && [ $RUN_OUTPUT -eq 0 ] && [ $RUN_RANDOMISE -eq 0 ] && [ $RUN_ICA -eq 0 ] && [ $RUN_GROUP -eq 0 ]; then
     RUN_FEAT=1
     RUN_RANDOMISE=1
     RUN_ICA=1 
     RUN_CALC=1
     RUN_OUTPUT=1
+    RUN_GROUP=1
 fi
 
 # Set ANTs path
@@ -84,8 +96,27 @@ ICA_CORRELATION=${SCRIPTSDIR}/ica_corr.py
 CAL_POST_STATS=${SCRIPTSDIR}/calc_post_stats_thresh.sh
 PYTHON=/opt/anaconda3/bin/python3
 OUTPUT_GENERATOR=${SCRIPTSDIR}/output_generator.py
+CONFOUNDS=${SCRIPTSDIR}/confounds.py
+GROUP_MAPS=${SCRIPTSDIR}/group_maps.py
+ROI_TIMESERIES=${SCRIPTSDIR}/roi_timeseries.py
+CARPET=${SCRIPTSDIR}/carpet.py
+COHORT_SIMILARITY=${SCRIPTSDIR}/cohort_similarity.py
+COHORT_DASHBOARD=${SCRIPTSDIR}/cohort_dashboard.py
+TSNR_QC=${SCRIPTSDIR}/tsnr_qc.py
+# Set QC_SKIP_LOW_TSNR=1 to skip FEAT (and the stages after it) for runs whose brain median tSNR is below QC_MIN_TSNR
+QC_SKIP_LOW_TSNR=${QC_SKIP_LOW_TSNR:-}
+REPORT_WORKER=${SCRIPTSDIR}/report_worker.py
+# Set REPORT_WORKER_SPOOL to send ICA and report jobs to a running "report_worker.py serve" daemon
+REPORT_WORKER_SPOOL=${REPORT_WORKER_SPOOL:-}
+# Set REPORT_QUICKLOOK=1 for first-pass QC reports (output_generator.py --quicklook: small figures, no PDF)
+REPORT_QUICKLOOK=${REPORT_QUICKLOOK:-}
+export PYTHON
+export CONFOUNDS
 TEMPLATE=${ARCHIVEDIR}/code/templates/design_test_script.fsf
 
+# Per-unit isolation, retries (UNIT_RETRIES, UNIT_RETRY_DELAY) and the batch status report
+source "${SCRIPTSDIR}/unit_status.sh"
+
 # Check if required tools are available
 for cmd in feat fslmaths randomise antsApplyTransforms; do
     if ! command -v "$cmd" &> /dev/null; then
@@ -102,70 +133,160 @@ if [ ! -f "$TEMPLATE" ]; then
     exit 1
 fi
 
-# Function to run feat_contrasts_recover_cluster.sh
+# Function to run feat_contrasts_recover_cluster.sh: one unit per subject and task, all in parallel as before.
+# Each run's tSNR QC comes first; with QC_SKIP_LOW_TSNR a flagged run is not sent to FEAT.
 run_feat_stats() {
     echo "Running feat_contrasts_recover_cluster.sh to generate initial FEAT stats for subjects: $@..."
-    export TASKS  # Pass tasks to feat_contrasts_recover_cluster.sh
     export TEMPLATE
-    bash "$FEAT_STATS" "$@"
-    if [ $? -ne 0 ]; then
-        echo "Error: feat_contrasts_recover_cluster.sh failed. Aborting workflow."
-        exit 1
-    fi
-    echo "feat_contrasts_recover_cluster.sh completed successfully."
+    local subject task
+    local pids=()
+    for subject in "$@"; do
+        for task in $TASKS; do
+            {
+                local qc_rc=0
+                run_unit qc "$subject" "$task" "$PYTHON" "$TSNR_QC" --sub_dir "${DATADIR}/sub-${subject}/ses-01" --tasks "$task" "$subject" || true
+                if [ -n "$QC_SKIP_LOW_TSNR" ]; then
+                    "$PYTHON" "$TSNR_QC" --sub_dir "${DATADIR}/sub-${subject}/ses-01" --tasks "$task" --check "$subject" > /dev/null 2>&1 || qc_rc=$?
+                fi
+                if [ $qc_rc -eq 3 ]; then
+                    skip_unit feat "$subject" "$task" "brain median tSNR below ${QC_MIN_TSNR:-30}"
+                    false
+                else
+                    run_unit feat "$subject" "$task" env TASKS="$task" bash "$FEAT_STATS" "$subject"
+                fi
+            } &
+            pids+=($!)
+        done
+    done
+    for pid in "${pids[@]}"; do
+        wait "$pid" || true  # Failures are recorded per unit
+    done
+    echo "feat_contrasts_recover_cluster.sh finished."
 }
 
-# Function to run run_permutation_test.sh
+# Function to run run_permutation_test.sh for each subject and task whose FEAT stats succeeded
 run_permutation_test() {
     echo "Running run_permutation_test.sh for subjects: $@..."
-    export TASKS
-    bash "$RANDOMISE_STATS" "$@"
-    if [ $? -ne 0 ]; then
-        echo "Error: run_permutation_test.sh failed. Check logs for details."
-        exit 1
-    fi
-    echo "run_permutation_test.sh jobs submitted successfully. Monitor with 'bjobs'."
+    local subject task
+    for subject in "$@"; do
+        for task in $TASKS; do
+            if ! unit_ok feat "$subject" "$task"; then
+                skip_unit randomise "$subject" "$task" "FEAT failed"
+                continue
+            fi
+            run_unit randomise "$subject" "$task" env TASKS="$task" bash "$RANDOMISE_STATS" "$subject" || true
+        done
+    done
+    echo "run_permutation_test.sh finished."
 }
 
 # Function to run ICA (if needed)
 run_ica() {
     echo "Running ICA for subjects: $@..."
-    python "$ICA_CORRELATION" --data_dir "$DATADIR" --tasks "$TASKS" "$@"
-    if [ $? -ne 0 ]; then
-        echo "Error: ica_corr.py failed. Check logs for details."
-        exit 1
-    fi
-    echo "ICA completed successfully."
+    local subject task
+    for subject in "$@"; do
+        if [ -n "$REPORT_WORKER_SPOOL" ]; then
+            run_unit ica "$subject" all "$PYTHON" "$REPORT_WORKER" --spool "$REPORT_WORKER_SPOOL" submit --stage ica --tasks "$TASKS" --wait "$subject" || true
+            continue
+        fi
+        for task in $TASKS; do
+            if ! unit_ok feat "$subject" "$task"; then
+                skip_unit ica "$subject" "$task" "FEAT failed"
+                continue
+            fi
+            run_unit ica "$subject" "$task" "$PYTHON" "$ICA_CORRELATION" --sub_dir "${DATADIR}/sub-${subject}/ses-01" --tasks "$task" "$subject" || true
+        done
+    done
+    echo "ICA finished."
 }
 
-# Function to run cal_post_stats_thresh.sh
+# Function to run cal_post_stats_thresh.sh: ROI preparation once per subject, then one unit per task in parallel
 run_cal_post_stats() {
     echo "Running cal_post_stats_thresh.sh to process z-maps and generate CSV files for subjects: $@..."
-    export TASKS
-    bash "$CAL_POST_STATS" "$@"
-    if [ $? -ne 0 ]; then
-        echo "Error: cal_post_stats_thresh.sh failed. Aborting workflow."
-        exit 1
-    fi
-    echo "cal_post_stats_thresh.sh completed successfully."
+    local subject task
+    for subject in "$@"; do
+        if ! run_unit calc_rois "$subject" all env POST_STATS_STEP=rois bash "$CAL_POST_STATS" "$subject"; then
+            for task in $TASKS; do
+                skip_unit calc "$subject" "$task" "ROI preparation failed"
+            done
+            continue
+        fi
+        local pids=()
+        for task in $TASKS; do
+            if ! unit_ok feat "$subject" "$task" || ! unit_ok randomise "$subject" "$task"; then
+                skip_unit calc "$subject" "$task" "FEAT or randomise failed"
+                continue
+            fi
+            # ROI time series and the carpet plot follow the task's post-stats; both read filtered_func_data
+            # while its working copy is still cached (a failure does not block the report)
+            { run_unit calc "$subject" "$task" env POST_STATS_STEP=tasks TASKS="$task" bash "$CAL_POST_STATS" "$subject" &&
+                { run_unit roi_timeseries "$subject" "$task" "$PYTHON" "$ROI_TIMESERIES" \
+                    --sub_dir "${DATADIR}/sub-${subject}/ses-01" --tasks "$task" "$subject" || true
+                  run_unit carpet "$subject" "$task" "$PYTHON" "$CARPET" \
+                    --sub_dir "${DATADIR}/sub-${subject}/ses-01" --tasks "$task" "$subject" || true; }; } &
+            pids+=($!)
+        done
+        for pid in "${pids[@]}"; do
+            wait "$pid" || true
+        done
+    done
+    echo "cal_post_stats_thresh.sh finished."
 }
 
-# Function to run output_generator.py
+# Function to run output_generator.py for each subject whose post-stats succeeded
 run_output_generator() {
     echo "Running output_generator.py to generate PDF and HTML reports for subjects: $@..."
-    export TASKS
-    "$PYTHON" "$OUTPUT_GENERATOR" "$@"
-    if [ $? -ne 0 ]; then
-        echo "Error: output_generator.py failed. Check logs for details."
-        exit 1
+    local subject task ready
+    local report_args=()
+    if [ -n "$REPORT_QUICKLOOK" ]; then
+        report_args=(--quicklook)
     fi
-    echo "output_generator.py completed successfully. Reports generated."
+    for subject in "$@"; do
+        ready=1
+        for task in $TASKS; do
+            unit_ok calc "$subject" "$task" || ready=0
+        done
+        if [ $ready -eq 0 ]; then
+            skip_unit output "$subject" all "post-stats failed"
+            continue
+        fi
+        if [ -n "$REPORT_WORKER_SPOOL" ]; then
+            run_unit output "$subject" all "$PYTHON" "$REPORT_WORKER" --spool "$REPORT_WORKER_SPOOL" submit --stage output "${report_args[@]}" --wait "$subject" || true
+        else
+            run_unit output "$subject" all "$PYTHON" "$OUTPUT_GENERATOR" "${report_args[@]}" "$subject" || true
+        fi
+    done
+    echo "output_generator.py finished."
+}
+
+# Function to run group_maps.py: adds each subject whose post-stats succeeded to the group accumulators
+run_group_maps() {
+    echo "Adding subjects to the group maps in ${ARCHIVEDIR}/group: $@..."
+    local subject task ready
+    for subject in "$@"; do
+        ready=1
+        for task in $TASKS; do
+            unit_ok calc "$subject" "$task" || ready=0
+        done
+        if [ $ready -eq 0 ]; then
+            skip_unit group "$subject" all "post-stats failed"
+            continue
+        fi
+        run_unit group "$subject" all "$PYTHON" "$GROUP_MAPS" --tasks "$TASKS" "$subject" || true
+    done
+    # Pairwise similarity and outlier ranking over every subject now in the group maps
+    run_unit similarity cohort all "$PYTHON" "$COHORT_SIMILARITY" --tasks "$TASKS" || true
+    # Cohort index page over every subject with post-stats CSVs
+    run_unit dashboard cohort all "$PYTHON" "$COHORT_DASHBOARD" --tasks "$TASKS" || true
+    echo "Group stage finished."
 }
 
 # Main execution
 echo "Starting RECOVER fMRI pipeline workflow on $(date) for subjects: $@"
+export TASKS
+status_init
 
-# Execute selected steps
+# Execute selected steps; a failed unit only skips the units that depend on it
 if [ $RUN_FEAT -eq 1 ]; then
     run_feat_stats "$@"
 fi
@@ -186,6 +307,13 @@ if [ $RUN_OUTPUT -eq 1 ]; then
     run_output_generator "$@"
 fi
 
+if [ $RUN_GROUP -eq 1 ]; then
+    run_group_maps "$@"
+fi
+
 rm -f ${DATADIR}/sub-${subject}/ses-01/ROI
 
-echo "RECOVER fMRI task-based pipeline workflow completed on $(date)"
\ No newline at end of file
+BATCH_STATUS=0
+status_report || BATCH_STATUS=1
+echo "RECOVER fMRI task-based pipeline workflow completed on $(date)"
+exit $BATCH_STATUS
@@ -0,0 +1,174 @@
+#!/opt/anaconda3/bin/python
+# Python 3.8.20
+# mosaic.py: NumPy renderer for the axial z-map mosaics in DataProcessor.plot_roi
+# Created for RECOVER project, Oct 2026
+#
+# Replaces one plot_stat_map + add_contours axes per cut with plain array work: the T1 is
+# put in canonical (RAS) orientation once, each stat map and ROI is sampled only on the
+# requested axial planes of the T1 grid, and every row is colour-mapped and alpha-blended
+# into a single RGBA image. Conventions follow plot_stat_map: its default colour map over
+# [-vmax, vmax] (vmax=13), or [0, vmax] for maps without negative values, values below the
+# threshold transparent, the T1 dimmed as on a black background, filled ROIs at alpha 0.3
+# with a solid outline, radiological orientation.
+# ROI masks and outlines on the cut planes are cached in memory and on disk (roi_planes),
+# so each (ROI file, background grid, cut set) is computed once per subject.
+
+import os
+import hashlib
+import numpy as np
+import nibabel as nib
+from scipy import ndimage
+from matplotlib import colormaps
+from matplotlib.colors import to_rgb
+
+VMAX = 13
+ROI_ALPHA = 0.3
+SLICE_GAP = 2  # Black pixels between cuts
+STAT_ORDER = 3  # Cubic spline, as nilearn's "continuous" interpolation
+BG_DIM = 0.8  # nilearn's automatic dimming of the anatomical image on a black background
+STAT_CMAP = "RdBu_r"  # plot_stat_map's default colour map since nilearn 0.11 (cold_hot before)
+_stat_cmap = colormaps[STAT_CMAP]
+
+
+def stat_cmap():
+    """plot_stat_map's default colour map, resolved once from matplotlib."""
+    return _stat_cmap
+
+
+class MosaicBackground:
+    """Background T1 in canonical orientation with the grey levels and crop box shared by all rows."""
+
+    def __init__(self, bg_img):
+        self.img = nib.as_closest_canonical(bg_img)
+        data = np.nan_to_num(np.asarray(self.img.dataobj, dtype=np.float32))
+        brain = data > 0
+        low, high = float(data.min()), float(data.max())
+        span = (2 + BG_DIM) * 0.5 * (high - low)  # Dimmed upper limit, as nilearn
+        self.grey = np.clip((data - low) / (span or 1.0), 0, 1)
+        xs = np.where(brain.any(axis=(1, 2)))[0]
+        ys = np.where(brain.any(axis=(0, 2)))[0]
+        self.crop = (slice(xs[0], xs[-1] + 1), slice(ys[0], ys[-1] + 1)) if xs.size else (slice(None), slice(None))
+
+    @property
+    def shape(self):
+        return self.img.shape[:3]
+
+    def slice_z(self, k):
+        """World z coordinate of axial plane k."""
+        return float((self.img.affine @ np.array([0, 0, k, 1]))[2])
+
+    def slice_indices(self, cut_coords):
+        """Voxel indices of the axial planes closest to the world z coordinates."""
+        inv = np.linalg.inv(self.img.affine)
+        center = self.img.affine @ np.array([self.shape[0] / 2, self.shape[1] / 2, 0, 1])
+        ks = [int(round((inv @ np.array([center[0], center[1], z, 1]))[2])) for z in cut_coords]
+        return [min(max(k, 0), self.shape[2] - 1) for k in ks]
+
+    def sample_planes(self, img, ks, order=STAT_ORDER):
+        """Sample img on the axial planes ks of the background grid; returns an (x, y, len(ks)) array."""
+        data = np.nan_to_num(np.asarray(img.dataobj, dtype=np.float32))
+        if data.ndim > 3:
+            data = data.reshape(data.shape[:3])
+        vox_to_src = np.linalg.inv(img.affine) @ self.img.affine
+        i, j, k = np.meshgrid(np.arange(self.shape[0]), np.arange(self.shape[1]), np.asarray(ks), indexing='ij')
+        coords = np.stack([i.ravel(), j.ravel(), k.ravel(), np.ones(i.size)])
+        src = (vox_to_src @ coords)[:3]
+        # One call for all planes so the spline prefilter runs over the source volume only once
+        planes = ndimage.map_coordinates(data, src, order=order, mode='constant', cval=0.0, prefilter=order > 1)
+        return planes.reshape(self.shape[:2] + (len(ks),))
+
+
+_roi_memo = {}
+
+
+def roi_planes(background, roi_path, ks, cache_dir=None):
+    """Mask and outline planes of an ROI on cuts ks; cached per (ROI file, background grid, cuts).
+
+    Returns boolean (x, y, len(ks)) arrays. With cache_dir the planes are also kept on disk as
+    packed bits and reused by later runs until the ROI file changes.
+    """
+    st = os.stat(roi_path)
+    key_src = f"{os.path.realpath(roi_path)}:{st.st_size}:{st.st_mtime_ns}:" \
+              f"{background.img.affine.tobytes().hex()}:{background.shape}:{list(ks)}"
+    key = hashlib.sha1(key_src.encode()).hexdigest()[:16]
+    if key in _roi_memo:
+        return _roi_memo[key]
+
+    shape = background.shape[:2] + (len(ks),)
+    stem = os.path.basename(roi_path).split('.')[0]
+    cache_path = os.path.join(cache_dir, f"{stem}_{key}.npz") if cache_dir else None
+    if cache_path and os.path.exists(cache_path):
+        with np.load(cache_path) as cached:
+            count = int(np.prod(shape))
+            mask = np.unpackbits(cached['mask'])[:count].reshape(shape).astype(bool)
+            outline = np.unpackbits(cached['outline'])[:count].reshape(shape).astype(bool)
+    else:
+        from nifti_cache import load_img
+        mask = background.sample_planes(load_img(roi_path), ks, order=0) > 0.5
+        outline = np.zeros_like(mask)
+        for n in range(len(ks)):
+            outline[..., n] = mask[..., n] & ~ndimage.binary_erosion(mask[..., n])
+        if cache_path:
+            os.makedirs(cache_dir, exist_ok=True)
+            tmp_path = f"{cache_path}.{os.getpid()}.tmp"
+            with open(tmp_path, 'wb') as f:
+                np.savez(f, mask=np.packbits(mask), outline=np.packbits(outline))
+            os.replace(tmp_path, cache_path)
+    _roi_memo[key] = (mask, outline)
+    return mask, outline
+
+
+def _orient(plane, radiological=True):
+    """Array indexed (x, y[, c]) to image rows (anterior at top) and columns (subject's left on the right if radiological)."""
+    image = np.swapaxes(plane, 0, 1)[::-1]
+    return image[:, ::-1] if radiological else image
+
+
+def render_row(background, stat_planes, ks, rois=(), threshold=None, vmax=VMAX, symmetric=True, radiological=True):
+    """Blend one row of axial cuts into an RGBA uint8 image.
+
+    rois is a list of (mask_planes, outline_planes, colour) as returned by roi_planes.
+    symmetric maps the colours over [-vmax, vmax]; otherwise over [0, vmax] (maps without negatives).
+    """
+    cmap = stat_cmap()
+    vmin = -vmax if symmetric else 0.0
+    cutoff = threshold if threshold else 1e-6  # nilearn hides exact zeros when no threshold is given
+    tiles = []
+    for n, k in enumerate(ks):
+        grey = background.grey[..., k][background.crop]
+        stat = stat_planes[..., n][background.crop]
+        rgb = np.repeat(grey[..., None], 3, axis=2)
+        alpha = grey > 0
+
+        visible = np.abs(stat) >= cutoff
+        colours = cmap(np.clip((stat - vmin) / (vmax - vmin), 0, 1))[..., :3]
+        rgb[visible] = colours[visible]
+        alpha |= visible
+
+        for mask_planes, outline_planes, colour in rois:
+            mask = mask_planes[..., n][background.crop]
+            if not mask.any():
+                continue
+            colour = np.array(to_rgb(colour), dtype=np.float32)
+            rgb[mask] = (1 - ROI_ALPHA) * rgb[mask] + ROI_ALPHA * colour
+            rgb[outline_planes[..., n][background.crop]] = colour
+            alpha |= mask
+
+        tiles.append(_orient(np.dstack([rgb, alpha.astype(np.float32)]), radiological))
+
+    gap = np.zeros((tiles[0].shape[0], SLICE_GAP, 4), dtype=np.float32)
+    row = np.concatenate([part for tile in tiles for part in (tile, gap)][:-1], axis=1)
+    return (row * 255).astype(np.uint8)
+
+
+def tile_centers(row, n_tiles):
+    """Horizontal pixel centres of the cuts in a row, for labelling."""
+    width = (row.shape[1] - SLICE_GAP * (n_tiles - 1)) / n_tiles
+    return [n * (width + SLICE_GAP) + width / 2 for n in range(n_tiles)]
+
+
+def save_row(row, path):
+    """Write an RGBA row image to PNG."""
+    import matplotlib.image as mpimg
+    mpimg.imsave(path, row)
+    return path
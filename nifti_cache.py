@@ -0,0 +1,167 @@
+#!/opt/anaconda3/bin/python
+# Python 3.8.20
+# nifti_cache.py: Uncompressed, memory-mapped working copies of .nii.gz inputs with a disk-budget LRU
+# Created for RECOVER project, Oct 2026
+# Updated to let readers wait for a copy another thread is already decompressing, Oct 2026
+# Updated to make copy_path, uncompressed_size and evict public for prefetch.py and resample_cache.py, Oct 2026
+# Updated to never evict a copy while an image this process loaded from it is alive, Oct 2026
+#
+# Each compressed NIfTI is decompressed once into a scratch directory and reopened with
+# mmap, so later readers (and other processes) skip gzip entirely. Copies are keyed by
+# source path, size and mtime; the copy's mtime is bumped on every access and the
+# least-recently-used copies are evicted when the scratch directory exceeds its budget.
+# Configure with NIFTI_SCRATCH_DIR and NIFTI_SCRATCH_BUDGET_GB. Decompression of one source is
+# serialised per process, so a reader waits for a prefetch thread (prefetch.py) already decoding it.
+# load() returns a lazy proxy that opens its copy only when the data is read, so a copy is pinned
+# while any image this process loaded from it is alive and eviction skips it; the budget can then
+# be exceeded rather than breaking a reader. Size the budget for the copies open at once in all
+# processes sharing the folder: a report holds both T1s plus one task's maps and ROIs (a few hundred
+# MB), carpet.py and ica_corr.py a whole filtered_func_data run (1-2 GB); 4 GB per process is safe.
+
+import os
+import gzip
+import shutil
+import hashlib
+import logging
+import tempfile
+import threading
+import weakref
+import nibabel as nib
+import numpy as np
+
+# Set up logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+DEFAULT_BUDGET_GB = 20
+
+
+class WorkingCopyCache:
+    def __init__(self, scratch_dir=None, budget_bytes=None):
+        if scratch_dir is None:
+            scratch_dir = os.environ.get('NIFTI_SCRATCH_DIR',
+                                         os.path.join(tempfile.gettempdir(), "recover_nifti_cache"))
+        if budget_bytes is None:
+            budget_bytes = int(float(os.environ.get('NIFTI_SCRATCH_BUDGET_GB', DEFAULT_BUDGET_GB)) * 1024 ** 3)
+        self.scratch_dir = scratch_dir
+        self.budget_bytes = budget_bytes
+        self._locks_guard = threading.Lock()
+        self._locks = {}  # Copy path -> lock held while it is being decompressed
+        self._pins = {}  # Copy path -> live images loaded from it in this process (never evicted)
+        os.makedirs(self.scratch_dir, exist_ok=True)
+
+    def copy_path(self, path):
+        """Scratch location for the working copy of path (changes when the source changes)."""
+        st = os.stat(path)
+        key = hashlib.sha1(f"{os.path.realpath(path)}:{st.st_size}:{st.st_mtime_ns}".encode()).hexdigest()[:16]
+        name = os.path.basename(path).replace('.nii.gz', '')
+        return os.path.join(self.scratch_dir, f"{name}_{key}.nii")
+
+    def uncompressed_size(self, path):
+        """Size of the decompressed file, read from the gzip trailer (modulo 4 GiB)."""
+        with open(path, 'rb') as f:
+            f.seek(-4, os.SEEK_END)
+            return int.from_bytes(f.read(4), 'little')
+
+    def evict(self, incoming_bytes):
+        """Remove least-recently-used copies until incoming_bytes fits within the budget."""
+        copies = []
+        with self._locks_guard:
+            pinned = set(self._pins)
+        for name in os.listdir(self.scratch_dir):
+            full = os.path.join(self.scratch_dir, name)
+            if name.endswith('.nii'):
+                try:
+                    st = os.stat(full)
+                except FileNotFoundError:
+                    continue  # Evicted by another process
+                copies.append((st.st_mtime, st.st_size, full))
+        used = sum(size for _, size, _ in copies)
+        for _, size, full in sorted(copies):
+            if used + incoming_bytes <= self.budget_bytes:
+                break
+            if full in pinned:
+                continue  # Still read through a lazy image proxy
+            try:
+                os.remove(full)
+                used -= size
+                logging.info(f"Evicted working copy: {full}")
+            except FileNotFoundError:
+                pass
+
+    def working_copy(self, path):
+        """Return the path of an uncompressed copy of path, decompressing it on first use."""
+        if not path.endswith('.gz'):
+            return path  # Already memory-mappable
+        copy_path = self.copy_path(path)
+        if os.path.exists(copy_path):
+            os.utime(copy_path)  # Mark as most recently used
+            return copy_path
+        with self._locks_guard:
+            lock = self._locks.setdefault(copy_path, threading.Lock())
+        with lock:
+            if os.path.exists(copy_path):  # Decompressed by another thread while we waited
+                return copy_path
+            return self._decompress(path, copy_path)
+
+    def _decompress(self, path, copy_path):
+        self.evict(self.uncompressed_size(path))
+        fd, tmp_path = tempfile.mkstemp(dir=self.scratch_dir, suffix='.tmp')
+        try:
+            with gzip.open(path, 'rb') as src, os.fdopen(fd, 'wb') as dst:
+                shutil.copyfileobj(src, dst, 16 * 1024 * 1024)
+            os.replace(tmp_path, copy_path)  # Atomic, so concurrent readers never see a partial copy
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        logging.info(f"Working copy created: {path} -> {copy_path}")
+        return copy_path
+
+    def load(self, path):
+        """Load path as a nibabel image backed by a memory-mapped working copy (pinned while the image lives)."""
+        copy_path = self.working_copy(path)
+        img = nib.load(copy_path, mmap=True)
+        if os.path.dirname(os.path.abspath(copy_path)) == os.path.abspath(self.scratch_dir):  # Evictable copy
+            with self._locks_guard:
+                self._pins[copy_path] = self._pins.get(copy_path, 0) + 1
+            weakref.finalize(img, self._unpin, copy_path)
+        return img
+
+    def _unpin(self, copy_path):
+        with self._locks_guard:
+            count = self._pins.pop(copy_path, 0) - 1
+            if count > 0:
+                self._pins[copy_path] = count
+
+    def get_data(self, path):
+        """Return the voxel array of path (a np.memmap unless the image is scaled)."""
+        return np.asanyarray(self.load(path).dataobj)
+
+    def clear(self):
+        """Remove every working copy in the scratch directory."""
+        shutil.rmtree(self.scratch_dir, ignore_errors=True)
+        os.makedirs(self.scratch_dir, exist_ok=True)
+
+
+_cache = None
+_cache_env = None  # (NIFTI_SCRATCH_DIR, NIFTI_SCRATCH_BUDGET_GB) the cache was built from
+
+
+def get_cache():
+    """Process-wide cache configured from the environment (rebuilt when NIFTI_SCRATCH_* change)."""
+    global _cache, _cache_env
+    env = (os.environ.get('NIFTI_SCRATCH_DIR'), os.environ.get('NIFTI_SCRATCH_BUDGET_GB'))
+    if _cache is None or env != _cache_env:
+        _cache = WorkingCopyCache()
+        _cache_env = env
+    return _cache
+
+
+def load_img(path):
+    """Shortcut for get_cache().load(path)."""
+    return get_cache().load(path)
+
+
+def get_data(path):
+    """Shortcut for get_cache().get_data(path)."""
+    return get_cache().get_data(path)
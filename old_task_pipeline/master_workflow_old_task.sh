@@ -4,6 +4,7 @@
 # Accepts subject IDs as command-line arguments with options to run specific steps or all.
 # Options: -f (FEAT stats), -c (calculate post-stats), -o (generate output pdf+html), -a (all steps)
 # Created for RECOVER project by K. Nguyen and A. Wu, Mar 2025
+# Updated to write the reports with the shared output_generator.py --pipeline old_task, Oct 2026
 
 # Exit on any error
 set -e
@@ -67,7 +68,7 @@ SCRIPTSDIR=${ARCHIVEDIR}/code/scripts/docker_cluster
 FEAT_STATS=${SCRIPTSDIR}/feat_contrasts_recover_cluster_old_task.sh
 CAL_POST_STATS=${SCRIPTSDIR}/calc_post_stats_thresh_old_task.sh
 PYTHON=/opt/anaconda3/bin/python3
-OUTPUT_GENERATOR=${SCRIPTSDIR}/output_generator_old_task.py
+OUTPUT_GENERATOR=${SCRIPTSDIR}/output_generator.py  # Shared with the current pipeline (--pipeline old_task)
 TEMPLATE=${ARCHIVEDIR}/code/templates/design_test_script_old_task.fsf
 
 # Check if required tools are available
@@ -114,15 +115,15 @@ run_cal_post_stats() {
     echo "cal_post_stats_thresh_old_task.sh completed successfully."
 }
 
-# Function to run output_generator_old_task.py
+# Function to run output_generator.py with the old task paradigm's names and ROIs
 run_output_generator() {
-    echo "Running output_generator_old_task.py to generate PDF and HTML reports for subjects: $@..."
-    "$PYTHON" "$OUTPUT_GENERATOR" "$@"
+    echo "Running output_generator.py --pipeline old_task to generate PDF and HTML reports for subjects: $@..."
+    "$PYTHON" "$OUTPUT_GENERATOR" --pipeline old_task "$@"
     if [ $? -ne 0 ]; then
-        echo "Error: output_generator_old_task.py failed. Check logs for details."
+        echo "Error: output_generator.py --pipeline old_task failed. Check logs for details."
         exit 1
     fi
-    echo "output_generator_old_task.py completed successfully. Reports generated."
+    echo "output_generator.py --pipeline old_task completed successfully. Reports generated."
 }
 
 # Main execution
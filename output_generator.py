@@ -4,267 +4,284 @@
 # Updated to include separate Z-stat and TFCE tables, and to match HTML layout for native and MNI spaces, Oct 2025
 # Updated to add unthresholded viewers, generate HTML directly if plots/tables exist, and adjust sizes, Apr 2025
 # Updated to restore iframe-based viewers with links and always regenerate viewers, Apr 2025
+# Updated to add --profile for per-artifact timings and memory peaks (profiling.py), Oct 2026
+# Updated to embed the written PNGs and viewer files directly and release each subject before the next, Oct 2026
+# Updated to import matplotlib lazily and add --html-only to rebuild HTML from existing artifacts, Oct 2026
+# Updated to drop each subject's in-memory resampled maps (resample_cache.py) once the report is written, Oct 2026
+# Updated to open the coarse preview viewers first and load the full-resolution viewers on request, Oct 2026
+# Updated to add --quicklook previews, a per-subject artifact manifest and --flag-review/--flagged-only, Oct 2026
+# Updated to show the tSNR QC summary of each run in a Signal QC tab (tsnr_qc.py), Oct 2026
+# Updated to add the carpet plot of each run to the Signal QC tab (carpet.py), Oct 2026
+# Updated to add --pipeline old_task, replacing the old task pipeline's copies of this module and data_processor.py, Oct 2026
 
 import os
-import sys
+import gc
+import json
+import time
 import logging
-import matplotlib.pyplot as plt
-from matplotlib.backends.backend_pdf import PdfPages
+import argparse
 import base64
-from io import BytesIO
+import html
 from html_template import HTML_TEMPLATE
+from profiling import profiler
 
 # Set up logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
+# HTML template key, DataProcessor figure key and PNG name (after "sub-<subject>_") for each report image
+REPORT_IMAGES = [
+    ('native_roi_img_31', 'native_roi_fig_31', "roi_zmap_plot_Native_3.1.png"),
+    ('native_roi_img_235', 'native_roi_fig_235', "roi_zmap_plot_Native_2.35.png"),
+    ('native_table_img_zstat_31', 'native_table_fig_zstat_31', "roi_stats_table_Native_zstat_3.1.png"),
+    ('native_table_img_tfce_31', 'native_table_fig_tfce_31', "roi_stats_table_Native_tfce_p005.png"),
+    ('native_table_img_zstat_235', 'native_table_fig_zstat_235', "roi_stats_table_Native_zstat_2.35.png"),
+    ('native_table_img_tfce_235', 'native_table_fig_tfce_235', "roi_stats_table_Native_tfce_p005.png"),
+    ('mni_roi_img_31', 'mni_roi_fig_31', "roi_zmap_plot_MNI_3.1.png"),
+    ('mni_roi_img_235', 'mni_roi_fig_235', "roi_zmap_plot_MNI_2.35.png"),
+    ('mni_table_img_zstat_31', 'mni_table_fig_zstat_31', "roi_stats_table_MNI_zstat_3.1.png"),
+    ('mni_table_img_tfce_31', 'mni_table_fig_tfce_31', "roi_stats_table_MNI_tfce_p005.png"),
+    ('mni_table_img_zstat_235', 'mni_table_fig_zstat_235', "roi_stats_table_MNI_zstat_2.35.png"),
+    ('mni_table_img_tfce_235', 'mni_table_fig_tfce_235', "roi_stats_table_MNI_tfce_p005.png"),
+]
+
+# Report task label and pipeline task of each run in the Signal QC tab
+QC_TASKS = [('Motor 1', 'motor_run-01'), ('Motor 2', 'motor_run-02'), ('Language', 'lang')]
+
+# PDF pages: suptitle and (figure key, PNG name, panel title) for the ROI plot, Z-stat table and TFCE table
+PDF_PAGES = [
+    ("Native Space Results (Z=3.1)", [
+        ('native_roi_fig_31', "roi_zmap_plot_Native_3.1.png", "Z-Maps with ROI Outlines (Native, Z=3.1)"),
+        ('native_table_fig_zstat_31', "roi_stats_table_Native_zstat_3.1.png", "GLM Test Z-map ROI Statistics (Native, Z=3.1)"),
+        ('native_table_fig_tfce_31', "roi_stats_table_Native_tfce_p005.png", "Permutation Test T-map ROI Statistics (Native, p<0.05)"),
+    ]),
+    ("MNI Space Results (Z=3.1)", [
+        ('mni_roi_fig_31', "roi_zmap_plot_MNI_3.1.png", "Z-Maps with ROI Outlines (MNI, Z=3.1)"),
+        ('mni_table_fig_zstat_31', "roi_stats_table_MNI_zstat_3.1.png", "GLM Test Z-map ROI Statistics (MNI, Z=3.1)"),
+        ('mni_table_fig_tfce_31', "roi_stats_table_MNI_tfce_p005.png", "Permutation Test ROI Statistics (MNI, p<0.05)"),
+    ]),
+    ("Native Space Results (Z=2.35)", [
+        ('native_roi_fig_235', "roi_zmap_plot_Native_2.35.png", "Z-Maps with ROI Outlines (Native, Z=2.35)"),
+        ('native_table_fig_zstat_235', "roi_stats_table_Native_zstat_2.35.png", "GLM Test Z-map ROI Statistics (Native, Z=2.35)"),
+        ('native_table_fig_tfce_235', "roi_stats_table_Native_tfce_p005.png", "Permutation Test T-map ROI Statistics (Native, p<0.05)"),
+    ]),
+    ("MNI Space Results (Z=2.35)", [
+        ('mni_roi_fig_235', "roi_zmap_plot_MNI_2.35.png", "Z-Maps with ROI Outlines (MNI, Z=2.35)"),
+        ('mni_table_fig_zstat_235', "roi_stats_table_MNI_zstat_2.35.png", "GLM Test Z-map ROI Statistics (MNI, Z=2.35)"),
+        ('mni_table_fig_tfce_235', "roi_stats_table_MNI_tfce_p005.png", "Permutation Test T-map Statistics (MNI, p<0.05)"),
+    ]),
+]
+
 class OutputGenerator:
-    def __init__(self, subject, path_img):
+    def __init__(self, subject, path_img, quicklook=False):
         self.subject = subject
         self.path_img = path_img
+        self.quicklook = quicklook
         self.subject_path = os.path.join(path_img, f"derivatives/sub-{subject}/ses-01")
         self.output_dir = os.path.join(self.subject_path, "post_stats")
+        # Quality of each written artifact ('quicklook' or 'full') and the review flag
+        self.manifest_path = os.path.join(self.output_dir, f"sub-{subject}_report_manifest.json")
         os.makedirs(self.output_dir, exist_ok=True)  # Ensure directory exists once here
         logging.info(f"Initializing OutputGenerator for subject {subject}")
 
-    def _fig_to_base64(self, fig):
-        """Convert a matplotlib figure to base64-encoded PNG string efficiently."""
-        if not fig:
+    def read_manifest(self):
+        if not os.path.exists(self.manifest_path):
+            return {}
+        with open(self.manifest_path) as f:
+            return json.load(f)
+
+    def _write_manifest(self, manifest):
+        manifest['updated'] = time.strftime('%Y-%m-%dT%H:%M:%S')
+        tmp_path = f"{self.manifest_path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump(manifest, f, indent=2)
+        os.replace(tmp_path, self.manifest_path)
+
+    def set_review(self, review=True):
+        """Flag (or unflag) the subject for a full-quality render."""
+        manifest = self.read_manifest()
+        manifest['review'] = review
+        self._write_manifest(manifest)
+
+    def _record_artifacts(self, data):
+        """Record the artifacts written by this run and their quality."""
+        quality = 'quicklook' if self.quicklook else 'full'
+        manifest = self.read_manifest()
+        artifacts = manifest.get('artifacts', {})
+        paths = [value for value in data.values() if isinstance(value, str)]
+        paths += [path for value in data.values() if isinstance(value, dict) for path in value.values()]
+        if not self.quicklook:
+            paths.append(os.path.join(self.output_dir, f"sub-{self.subject}_task_pipeline_report.pdf"))
+        for path in paths:
+            artifacts[os.path.relpath(path, self.output_dir)] = quality
+        manifest.update({'subject': self.subject, 'quality': quality, 'artifacts': artifacts})
+        if not self.quicklook:
+            manifest['review'] = False  # Reviewed subjects now have their full-quality report
+        manifest.setdefault('review', False)
+        self._write_manifest(manifest)
+
+    def _png_to_base64(self, png_path):
+        """Read a written PNG file as a base64-encoded string."""
+        if not png_path or not os.path.exists(png_path):
             return ""
-        with BytesIO() as buf:
-            fig.savefig(buf, format='png', dpi=150, bbox_inches='tight')
-            buf.seek(0)
-            img_str = base64.b64encode(buf.getvalue()).decode('utf-8')
-        plt.close(fig)  # Close figure immediately after saving
-        return img_str
-
-    def _check_existing_files(self):
-        """Check if all required plots and tables exist in the output directory."""
-        required_files = [
-            f"sub-{self.subject}_roi_zmap_plot_Native_3.1.png",
-            f"sub-{self.subject}_roi_zmap_plot_Native_2.35.png",
-            f"sub-{self.subject}_roi_stats_table_Native_zstat_3.1.png",
-            f"sub-{self.subject}_roi_stats_table_Native_tfce_p005.png",
-            f"sub-{self.subject}_roi_stats_table_Native_zstat_2.35.png",
-            f"sub-{self.subject}_roi_stats_table_Native_tfce_p005.png",
-            f"sub-{self.subject}_roi_zmap_plot_MNI_3.1.png",
-            f"sub-{self.subject}_roi_zmap_plot_MNI_2.35.png",
-            f"sub-{self.subject}_roi_stats_table_MNI_zstat_3.1.png",
-            f"sub-{self.subject}_roi_stats_table_MNI_tfce_p005.png",
-            f"sub-{self.subject}_roi_stats_table_MNI_zstat_2.35.png",
-            f"sub-{self.subject}_roi_stats_table_MNI_tfce_p005.png",
-        ]
-        all_exist = all(os.path.exists(os.path.join(self.output_dir, f)) for f in required_files)
-        logging.info(f"All required plot and table files exist: {all_exist}")
-        return all_exist
-
-    def _load_existing_fig(self, filename):
-        """Load an existing PNG file as a matplotlib figure with size matching generated figures."""
-        filepath = os.path.join(self.output_dir, filename)
-        if not os.path.exists(filepath):
-            return None
-        
-        # Determine figure size based on file type (match data_processor.py)
-        if 'roi_zmap_plot' in filename:
-            figsize = (10, 18)  # Size for ROI plots from plot_roi
-        elif 'roi_stats_table' in filename:
-            figsize = (16, 6)   # Size for tables from plot_table
-        else:
-            figsize = (10, 10)  # Default fallback size
-        
-        fig, ax = plt.subplots(figsize=figsize)
-        ax.imshow(plt.imread(filepath))
-        ax.axis('off')
-        return fig
+        with open(png_path, 'rb') as f:
+            return base64.b64encode(f.read()).decode('utf-8')
+
+    def _missing_files(self):
+        """Report PNGs that are not in the output directory."""
+        required_files = [f"sub-{self.subject}_{png_name}" for _, _, png_name in REPORT_IMAGES]
+        return [f for f in required_files if not os.path.exists(os.path.join(self.output_dir, f))]
+
+    def _recorded_at_quality(self, data):
+        """Check if the manifest already records this run's plots and tables (and the PDF for a full run) at the requested quality.
+
+        Existing files alone are not enough: stale PNGs that this run does not render, or quick-look
+        previews, would otherwise stop a full run from writing the PDF and clearing the review flag.
+        """
+        accepted = ('quicklook', 'full') if self.quicklook else ('full',)
+        artifacts = self.read_manifest().get('artifacts', {})
+        required = [os.path.relpath(data[fig_key], self.output_dir) for _, fig_key, _ in REPORT_IMAGES if data.get(fig_key)]
+        if not self.quicklook:
+            required.append(f"sub-{self.subject}_task_pipeline_report.pdf")
+        recorded = bool(required) and all(artifacts.get(name) in accepted and os.path.exists(os.path.join(self.output_dir, name))
+                                          for name in required)
+        logging.info(f"Plots and tables recorded at {'quick-look' if self.quicklook else 'full'} quality: {recorded}")
+        return recorded
 
     def _save_pdf(self, data):
         """Generate and save PDF report with native and MNI space figures, mimicking HTML layout."""
+        import matplotlib.pyplot as plt
+        from matplotlib.backends.backend_pdf import PdfPages
         pdf_path = os.path.join(self.output_dir, f"sub-{self.subject}_task_pipeline_report.pdf")
 
         with PdfPages(pdf_path) as pdf:
             # Cover page
-            fig, ax = plt.subplots(figsize=(10, 2))
-            ax.text(0.5, 0.5, f"Task-Based fMRI Report for {self.subject}", ha='center', va='center', fontsize=14)
-            ax.axis('off')
-            pdf.savefig(fig, dpi=300, bbox_inches='tight')
-            plt.close(fig)
-
-            # Z=3.1 Section (Native Space)
-            fig_native_31, (ax_roi_native_31, ax_zstat_native_31, ax_tfce_native_31) = plt.subplots(3, 1, figsize=(10, 12))
-            plt.tight_layout(h_pad=4)
-
-            # ROI Plot (Native, Z=3.1)
-            if data.get('native_roi_fig_31'):
-                ax_roi_native_31.imshow(plt.imread(os.path.join(self.subject_path, f"post_stats/sub-{self.subject}_roi_zmap_plot_Native_3.1.png")))
-                ax_roi_native_31.axis('off')
-                ax_roi_native_31.set_title("Z-Maps with ROI Outlines (Native, Z=3.1)", fontdict={'fontweight': 'bold', 'fontsize': 10})
-
-            # Z-Stat Table (Native, Z=3.1)
-            if data.get('native_table_fig_zstat_31'):
-                ax_zstat_native_31.imshow(plt.imread(os.path.join(self.subject_path, f"post_stats/sub-{self.subject}_roi_stats_table_Native_zstat_3.1.png")))
-                ax_zstat_native_31.axis('off')
-                ax_zstat_native_31.set_title("GLM Test Z-map ROI Statistics (Native, Z=3.1)", fontdict={'fontweight': 'bold', 'fontsize': 10})
-
-            # TFCE Table (Native, Z=3.1)
-            if data.get('native_table_fig_tfce_31'):
-                ax_tfce_native_31.imshow(plt.imread(os.path.join(self.subject_path, f"post_stats/sub-{self.subject}_roi_stats_table_Native_tfce_p005.png")))
-                ax_tfce_native_31.axis('off')
-                ax_tfce_native_31.set_title("Permutation Test T-map ROI Statistics (Native, p<0.05)", fontdict={'fontweight': 'bold', 'fontsize': 10})
-
-            plt.suptitle("Native Space Results (Z=3.1)", fontweight='bold', fontsize=12, y=0.98)
-            pdf.savefig(fig_native_31, dpi=300, bbox_inches='tight')
-            plt.close(fig_native_31)
-
-            # Z=3.1 Section (MNI Space)
-            fig_mni_31, (ax_roi_mni_31, ax_zstat_mni_31, ax_tfce_mni_31) = plt.subplots(3, 1, figsize=(10, 12))
-            plt.tight_layout(h_pad=4)
-
-            # ROI Plot (MNI, Z=3.1)
-            if data.get('mni_roi_fig_31'):
-                ax_roi_mni_31.imshow(plt.imread(os.path.join(self.subject_path, f"post_stats/sub-{self.subject}_roi_zmap_plot_MNI_3.1.png")))
-                ax_roi_mni_31.axis('off')
-                ax_roi_mni_31.set_title("Z-Maps with ROI Outlines (MNI, Z=3.1)", fontdict={'fontweight': 'bold', 'fontsize': 10})
-
-            # Z-Stat Table (MNI, Z=3.1)
-            if data.get('mni_table_fig_zstat_31'):
-                ax_zstat_mni_31.imshow(plt.imread(os.path.join(self.subject_path, f"post_stats/sub-{self.subject}_roi_stats_table_MNI_zstat_3.1.png")))
-                ax_zstat_mni_31.axis('off')
-                ax_zstat_mni_31.set_title("GLM Test Z-map ROI Statistics (MNI, Z=3.1)", fontdict={'fontweight': 'bold', 'fontsize': 10})
-
-            # TFCE Table (MNI, Z=3.1)
-            if data.get('mni_table_fig_tfce_31'):
-                ax_tfce_mni_31.imshow(plt.imread(os.path.join(self.subject_path, f"post_stats/sub-{self.subject}_roi_stats_table_MNI_tfce_p005.png")))
-                ax_tfce_mni_31.axis('off')
-                ax_tfce_mni_31.set_title("Permutation Test ROI Statistics (MNI, p<0.05)", fontdict={'fontweight': 'bold', 'fontsize': 10})
-
-            plt.suptitle("MNI Space Results (Z=3.1)", fontweight='bold', fontsize=12, y=0.98)
-            pdf.savefig(fig_mni_31, dpi=300, bbox_inches='tight')
-            plt.close(fig_mni_31)
-
-            # Z=2.35 Section (Native Space)
-            fig_native_235, (ax_roi_native_235, ax_zstat_native_235, ax_tfce_native_235) = plt.subplots(3, 1, figsize=(10, 12))
-            plt.tight_layout(h_pad=4)
-
-            # ROI Plot (Native, Z=2.35)
-            if data.get('native_roi_fig_235'):
-                ax_roi_native_235.imshow(plt.imread(os.path.join(self.subject_path, f"post_stats/sub-{self.subject}_roi_zmap_plot_Native_2.35.png")))
-                ax_roi_native_235.axis('off')
-                ax_roi_native_235.set_title("Z-Maps with ROI Outlines (Native, Z=2.35)", fontdict={'fontweight': 'bold', 'fontsize': 10})
-
-            # Z-Stat Table (Native, Z=2.35)
-            if data.get('native_table_fig_zstat_235'):
-                ax_zstat_native_235.imshow(plt.imread(os.path.join(self.subject_path, f"post_stats/sub-{self.subject}_roi_stats_table_Native_zstat_2.35.png")))
-                ax_zstat_native_235.axis('off')
-                ax_zstat_native_235.set_title("GLM Test Z-map ROI Statistics (Native, Z=2.35)", fontdict={'fontweight': 'bold', 'fontsize': 10})
-
-            # TFCE Table (Native, Z=2.35)
-            if data.get('native_table_fig_tfce_235'):
-                ax_tfce_native_235.imshow(plt.imread(os.path.join(self.subject_path, f"post_stats/sub-{self.subject}_roi_stats_table_Native_tfce_p005.png")))
-                ax_tfce_native_235.axis('off')
-                ax_tfce_native_235.set_title("Permutation Test T-map ROI Statistics (Native, p<0.05)", fontdict={'fontweight': 'bold', 'fontsize': 10})
-
-            plt.suptitle("Native Space Results (Z=2.35)", fontweight='bold', fontsize=12, y=0.98)
-            pdf.savefig(fig_native_235, dpi=300, bbox_inches='tight')
-            plt.close(fig_native_235)
-
-            # Z=2.35 Section (MNI Space)
-            fig_mni_235, (ax_roi_mni_235, ax_zstat_mni_235, ax_tfce_mni_235) = plt.subplots(3, 1, figsize=(10, 12))
-            plt.tight_layout(h_pad=4)
-
-            # ROI Plot (MNI, Z=2.35)
-            if data.get('mni_roi_fig_235'):
-                ax_roi_mni_235.imshow(plt.imread(os.path.join(self.subject_path, f"post_stats/sub-{self.subject}_roi_zmap_plot_MNI_2.35.png")))
-                ax_roi_mni_235.axis('off')
-                ax_roi_mni_235.set_title("Z-Maps with ROI Outlines (MNI, Z=2.35)", fontdict={'fontweight': 'bold', 'fontsize': 10})
-
-            # Z-Stat Table (MNI, Z=2.35)
-            if data.get('mni_table_fig_zstat_235'):
-                ax_zstat_mni_235.imshow(plt.imread(os.path.join(self.subject_path, f"post_stats/sub-{self.subject}_roi_stats_table_MNI_zstat_2.35.png")))
-                ax_zstat_mni_235.axis('off')
-                ax_zstat_mni_235.set_title("GLM Test Z-map ROI Statistics (MNI, Z=2.35)", fontdict={'fontweight': 'bold', 'fontsize': 10})
-
-            # TFCE Table (MNI, Z=2.35)
-            if data.get('mni_table_fig_tfce_235'):
-                ax_tfce_mni_235.imshow(plt.imread(os.path.join(self.subject_path, f"post_stats/sub-{self.subject}_roi_stats_table_MNI_tfce_p005.png")))
-                ax_tfce_mni_235.axis('off')
-                ax_tfce_mni_235.set_title("Permutation Test T-map Statistics (MNI, p<0.05)", fontdict={'fontweight': 'bold', 'fontsize': 10})
-
-            plt.suptitle("MNI Space Results (Z=2.35)", fontweight='bold', fontsize=12, y=0.98)
-            pdf.savefig(fig_mni_235, dpi=300, bbox_inches='tight')
-            plt.close(fig_mni_235)
+            with profiler.section("pdf/cover"):
+                fig, ax = plt.subplots(figsize=(10, 2))
+                ax.text(0.5, 0.5, f"Task-Based fMRI Report for {self.subject}", ha='center', va='center', fontsize=14)
+                ax.axis('off')
+                pdf.savefig(fig, dpi=300, bbox_inches='tight')
+                plt.close(fig)
+
+            for page_title, panels in PDF_PAGES:
+                with profiler.section(f"pdf/{page_title}"):
+                    fig, axes = plt.subplots(3, 1, figsize=(10, 12))
+                    plt.tight_layout(h_pad=4)
+                    for ax, (fig_key, png_name, panel_title) in zip(axes, panels):
+                        if data.get(fig_key):
+                            ax.imshow(plt.imread(os.path.join(self.output_dir, f"sub-{self.subject}_{png_name}")))
+                            ax.axis('off')
+                            ax.set_title(panel_title, fontdict={'fontweight': 'bold', 'fontsize': 10})
+                    plt.suptitle(page_title, fontweight='bold', fontsize=12, y=0.98)
+                    pdf.savefig(fig, dpi=300, bbox_inches='tight')
+                    plt.close(fig)
 
         logging.info(f"Combined PDF saved at: {pdf_path}")
         return pdf_path
 
+    def _signal_qc_html(self):
+        """HTML table of the tSNR QC summaries written by tsnr_qc.py (a note if there are none)."""
+        import tsnr_qc
+        min_tsnr = float(os.environ.get('QC_MIN_TSNR', tsnr_qc.MIN_TSNR))
+        summaries = {s['task']: s for s in tsnr_qc.load_summaries(self.subject_path, self.subject, [t for _, t in QC_TASKS])}
+        if not summaries:
+            return "<p>No tSNR QC found for this subject (run tsnr_qc.py).</p>"
+        roi_labels = list(tsnr_qc.ROI_TEMPLATES)
+        header = ['Task', 'Volumes', 'Brain Median tSNR', 'Brain Mean tSNR'] + [f"{label} Median tSNR" for label in roi_labels] + ['Status']
+        rows = []
+        for label, task in QC_TASKS:
+            summary = summaries.get(task)
+            if summary is None:
+                continue
+            flagged = tsnr_qc.is_flagged(summary, min_tsnr)
+            values = [label, summary['volumes'], summary['brain']['median'], summary['brain']['mean']]
+            values += [summary['rois'].get(roi, {}).get('median') for roi in roi_labels]
+            values.append(f"Low tSNR (< {min_tsnr:g})" if flagged else "Pass")
+            cells = ''.join(f"<td>{html.escape(str('N/A' if v is None else v))}</td>" for v in values)
+            rows.append(f"<tr class=\"qc-flagged\">{cells}</tr>" if flagged else f"<tr>{cells}</tr>")
+        return ("<h2>Temporal SNR of the Preprocessed BOLD Runs (MNI Space)</h2>\n"
+                "        <table class=\"qc-table\"><tr>" + ''.join(f"<th>{html.escape(h)}</th>" for h in header) + "</tr>"
+                + ''.join(rows) + "</table>")
+
+    def _carpet_html(self):
+        """Embedded carpet plots written by carpet.py (a note if there are none)."""
+        import carpet
+        blocks = []
+        for label, task in QC_TASKS:
+            png_path = carpet.carpet_path(self.subject_path, self.subject, task)
+            if os.path.exists(png_path):
+                blocks.append(f"<h3>{html.escape(label)}</h3>\n"
+                              f"        <img src=\"data:image/png;base64,{self._png_to_base64(png_path)}\" alt=\"{html.escape(label)} carpet plot\" class=\"report-element\">")
+        if not blocks:
+            return "<p>No carpet plots found for this subject (run carpet.py).</p>"
+        return ("<h2>Carpet Plots of the Filtered Runs (Sampled Voxels by ROI and Tissue)</h2>\n        "
+                + "\n        ".join(blocks))
+
     def _save_html(self, data, skip_plot_processing=False):
-        """Generate and save HTML report with embedded images and viewer links, always regenerating viewers."""
+        """Generate and save HTML report with embedded images and links to the viewers written by DataProcessor."""
         html_path = os.path.join(self.output_dir, f"sub-{self.subject}_task_pipeline_report.html")
-        viewer_dir = os.path.join(self.output_dir, "viewers")
-        os.makedirs(viewer_dir, exist_ok=True)
-
-        # Load or convert figures to base64
-        if skip_plot_processing:
-            img_data = {
-                'native_roi_img_31': self._fig_to_base64(self._load_existing_fig(f"sub-{self.subject}_roi_zmap_plot_Native_3.1.png")),
-                'native_roi_img_235': self._fig_to_base64(self._load_existing_fig(f"sub-{self.subject}_roi_zmap_plot_Native_2.35.png")),
-                'native_table_img_zstat_31': self._fig_to_base64(self._load_existing_fig(f"sub-{self.subject}_roi_stats_table_Native_zstat_3.1.png")),
-                'native_table_img_tfce_31': self._fig_to_base64(self._load_existing_fig(f"sub-{self.subject}_roi_stats_table_Native_tfce_p005.png")),
-                'native_table_img_zstat_235': self._fig_to_base64(self._load_existing_fig(f"sub-{self.subject}_roi_stats_table_Native_zstat_2.35.png")),
-                'native_table_img_tfce_235': self._fig_to_base64(self._load_existing_fig(f"sub-{self.subject}_roi_stats_table_Native_tfce_p005.png")),
-                'mni_roi_img_31': self._fig_to_base64(self._load_existing_fig(f"sub-{self.subject}_roi_zmap_plot_MNI_3.1.png")),
-                'mni_roi_img_235': self._fig_to_base64(self._load_existing_fig(f"sub-{self.subject}_roi_zmap_plot_MNI_2.35.png")),
-                'mni_table_img_zstat_31': self._fig_to_base64(self._load_existing_fig(f"sub-{self.subject}_roi_stats_table_MNI_zstat_3.1.png")),
-                'mni_table_img_tfce_31': self._fig_to_base64(self._load_existing_fig(f"sub-{self.subject}_roi_stats_table_MNI_tfce_p005.png")),
-                'mni_table_img_zstat_235': self._fig_to_base64(self._load_existing_fig(f"sub-{self.subject}_roi_stats_table_MNI_zstat_2.35.png")),
-                'mni_table_img_tfce_235': self._fig_to_base64(self._load_existing_fig(f"sub-{self.subject}_roi_stats_table_MNI_tfce_p005.png")),
-            }
-        else:
-            img_data = {
-                'native_roi_img_31': self._fig_to_base64(data.get('native_roi_fig_31')),
-                'native_roi_img_235': self._fig_to_base64(data.get('native_roi_fig_235')),
-                'native_table_img_zstat_31': self._fig_to_base64(data.get('native_table_fig_zstat_31')),
-                'native_table_img_tfce_31': self._fig_to_base64(data.get('native_table_fig_tfce_31')),
-                'native_table_img_zstat_235': self._fig_to_base64(data.get('native_table_fig_zstat_235')),
-                'native_table_img_tfce_235': self._fig_to_base64(data.get('native_table_fig_tfce_235')),
-                'mni_roi_img_31': self._fig_to_base64(data.get('mni_roi_fig_31')),
-                'mni_roi_img_235': self._fig_to_base64(data.get('mni_roi_fig_235')),
-                'mni_table_img_zstat_31': self._fig_to_base64(data.get('mni_table_fig_zstat_31')),
-                'mni_table_img_tfce_31': self._fig_to_base64(data.get('mni_table_fig_tfce_31')),
-                'mni_table_img_zstat_235': self._fig_to_base64(data.get('mni_table_fig_zstat_235')),
-                'mni_table_img_tfce_235': self._fig_to_base64(data.get('mni_table_fig_tfce_235')),
-            }
-
-        # Always save viewers and prepare relative paths
+
+        # Embed the PNG files already written by DataProcessor (existing files when skipping plot processing)
+        img_data = {}
+        for img_key, fig_key, png_name in REPORT_IMAGES:
+            with profiler.section(f"base64/{img_key}"):
+                if skip_plot_processing:
+                    png_path = os.path.join(self.output_dir, f"sub-{self.subject}_{png_name}")
+                else:
+                    png_path = data.get(fig_key)
+                img_data[img_key] = self._png_to_base64(png_path)
+
+        # Viewer files are written by DataProcessor; link them relative to the report
         viewer_paths = {}
         tasks = ['Motor 1', 'Motor 2', 'Language']
         
-        # Save viewers for Z=3.1
+        # Viewers for Z=3.1
         native_viewers_31 = data.get('native_viewers_31', {})
         for task in tasks:
             viewer_key = f"native_viewer_31_{task.lower().replace(' ', '_')}"
             viewer_file = f"native_{task.lower().replace(' ', '_')}_z31_viewer.html"
             viewer_paths[viewer_key] = os.path.join("viewers", viewer_file)
             if task in native_viewers_31:
-                native_viewers_31[task].save_as_html(os.path.join(viewer_dir, viewer_file))
+                viewer_paths[viewer_key] = os.path.relpath(native_viewers_31[task], self.output_dir)
 
-        # Save unthresholded viewers for Z=3.1 base
+        # Unthresholded viewers for Z=3.1 base
         native_viewers_unthresh_31 = data.get('native_viewers_unthresh_31', {})
         for task in tasks:
             viewer_key = f"native_viewer_unthresh_31_{task.lower().replace(' ', '_')}"
             viewer_file = f"native_{task.lower().replace(' ', '_')}_unthresh_z31_viewer.html"
             viewer_paths[viewer_key] = os.path.join("viewers", viewer_file)
             if task in native_viewers_unthresh_31:
-                native_viewers_unthresh_31[task].save_as_html(os.path.join(viewer_dir, viewer_file))
+                viewer_paths[viewer_key] = os.path.relpath(native_viewers_unthresh_31[task], self.output_dir)
+
+        # Preview viewers are shown first; the full-resolution viewer replaces one only on request.
+        # With no preview (VIEWER_PREVIEW_MM=0) the iframe shows the full-resolution viewer as before.
+        native_viewers_unthresh_31_preview = data.get('native_viewers_unthresh_31_preview')
+        for task in tasks:
+            task_key = task.lower().replace(' ', '_')
+            full_path = viewer_paths[f"native_viewer_unthresh_31_{task_key}"]
+            if native_viewers_unthresh_31_preview is None:  # HTML only: use a preview written earlier, if any
+                preview_file = os.path.join("viewers", f"native_{task_key}_unthresh_z31_preview_viewer.html")
+                exists = os.path.exists(os.path.join(self.output_dir, preview_file))
+                viewer_paths[f"native_viewer_unthresh_31_preview_{task_key}"] = preview_file if exists else full_path
+            elif task in native_viewers_unthresh_31_preview:
+                viewer_paths[f"native_viewer_unthresh_31_preview_{task_key}"] = os.path.relpath(
+                    native_viewers_unthresh_31_preview[task], self.output_dir)
+            else:
+                viewer_paths[f"native_viewer_unthresh_31_preview_{task_key}"] = full_path
 
         # Generate HTML content
         html_content = HTML_TEMPLATE.format(
             subject=self.subject,
             **img_data,
+            signal_qc=self._signal_qc_html() + "\n        " + self._carpet_html(),
             # native_viewer_31_motor1=viewer_paths.get('native_viewer_31_motor_1', ''),
             # native_viewer_31_motor2=viewer_paths.get('native_viewer_31_motor_2', ''),
             # native_viewer_31_language=viewer_paths.get('native_viewer_31_language', ''),
             native_viewer_unthresh_31_motor1=viewer_paths.get('native_viewer_unthresh_31_motor_1', ''),
             native_viewer_unthresh_31_motor2=viewer_paths.get('native_viewer_unthresh_31_motor_2', ''),
             native_viewer_unthresh_31_language=viewer_paths.get('native_viewer_unthresh_31_language', ''),
+            native_viewer_unthresh_31_preview_motor1=viewer_paths.get('native_viewer_unthresh_31_preview_motor_1', ''),
+            native_viewer_unthresh_31_preview_motor2=viewer_paths.get('native_viewer_unthresh_31_preview_motor_2', ''),
+            native_viewer_unthresh_31_preview_language=viewer_paths.get('native_viewer_unthresh_31_preview_language', ''),
         )
 
         with open(html_path, 'w') as f:
@@ -273,36 +290,91 @@ class OutputGenerator:
         return html_path
 
     def generate_output(self, data):
-        """Generate PDF and HTML outputs for the subject, regenerating viewers always."""
+        """Generate PDF and HTML outputs for the subject from the files written by DataProcessor."""
         logging.info(f"Generating output for subject {self.subject}")
         try:
-            if self._check_existing_files():
-                logging.info("All plots and tables found, loading existing files but regenerating viewers.")
+            if self._recorded_at_quality(data):
+                logging.info("All plots and tables recorded at this quality, embedding existing files.")
                 self._save_html(data, skip_plot_processing=True)
             else:
-                logging.info("Generating all outputs from scratch.")
-                self._save_pdf(data)
+                logging.info("Generating all outputs from scratch" + (" (quick look, no PDF)." if self.quicklook else "."))
+                if not self.quicklook:
+                    self._save_pdf(data)
                 self._save_html(data, skip_plot_processing=False)
+            self._record_artifacts(data)  # Always: the images were just rendered at this run's quality
         except Exception as e:
             logging.error(f"Error generating output for subject {self.subject}: {str(e)}")
             raise
 
-def main(subjects):
+def main(subjects, profile=False, html_only=False, quicklook=False, flagged_only=False, pipeline='current'):
     logging.info("Starting main execution")
     path_img = os.environ.get('ARCHIVEDIR')
     roi_path = os.environ.get('ROI')
-    from data_processor import DataProcessor
 
+    # Each subject's figures are closed as soon as they are written and only file paths are
+    # kept, so memory does not grow with the number of subjects.
     for subject in subjects:
         logging.info(f"Processing subject: {subject}")
-        output_generator = OutputGenerator(subject, path_img)
-        data_processor = DataProcessor(subject, path_img, roi_path)
-        data = data_processor.process_data()
-        output_generator.generate_output(data)
+        output_generator = OutputGenerator(subject, path_img, quicklook=quicklook)
+        if flagged_only:
+            manifest = output_generator.read_manifest()
+            if not manifest.get('review'):
+                logging.info(f"Subject {subject} is not flagged for review; skipping.")
+                continue
+
+        # HTML-only: embed the existing PNGs and link the existing viewers without importing DataProcessor.
+        # Images that were never rendered (e.g. the disabled Native ROI plots) are left empty as usual.
+        if html_only:
+            missing = output_generator._missing_files()
+            if len(set(missing)) < len({png_name for _, _, png_name in REPORT_IMAGES}):
+                if missing:
+                    logging.info(f"Not embedded (not found): {', '.join(sorted(set(missing)))}")
+                output_generator._save_html({}, skip_plot_processing=True)
+                continue
+            logging.warning(f"No plots or tables found for subject {subject}; running the full report instead.")
+
+        from data_processor import DataProcessor
+        import matplotlib.pyplot as plt
+        import resample_cache
+        if profile:
+            profiler.start()
+        data_processor = None
+        try:
+            data_processor = DataProcessor(subject, output_generator.subject_path, roi_path, quicklook=quicklook, pipeline=pipeline)
+            with profiler.section("process_data"):
+                data = data_processor.process_data()
+            with profiler.section("generate_output"):
+                output_generator.generate_output(data)
+        finally:
+            if data_processor is not None:
+                data_processor.prefetcher.close()  # Waits for running decompressions and stops the threads
+            if profile:
+                profiler.stop(os.path.join(output_generator.output_dir, "profile"), f"sub-{subject}_output_generator")
+            plt.close('all')
+            resample_cache.clear()
+            data = data_processor = None
+            gc.collect()
 
 if __name__ == "__main__":
-    if len(sys.argv) < 2:
-        logging.error("No subject IDs provided. Usage: python output_generator.py <subject_id1> <subject_id2> ...")
-        sys.exit(1)
-    subjects = sys.argv[1:]
-    main(subjects)
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Generate PDF and HTML task reports for subjects")
+    parser.add_argument("subjects", nargs="+", help="List of subject IDs")
+    parser.add_argument("--profile", action="store_true",
+                        help="Record per-artifact timings, memory peaks and cProfile/flamegraph stacks in post_stats/profile/")
+    parser.add_argument("--html-only", action="store_true",
+                        help="Rebuild only the HTML from existing plots, tables and viewers (skips DataProcessor)")
+    parser.add_argument("--quicklook", action="store_true",
+                        help="First-pass QC: small figures, fewer cuts, preview viewers only and no PDF (recorded in the manifest)")
+    parser.add_argument("--flag-review", action="store_true",
+                        help="Only flag the subjects for review; a later --flagged-only run renders them at full quality")
+    parser.add_argument("--flagged-only", action="store_true",
+                        help="Render only the subjects flagged for review (quick-look figures are replaced)")
+    parser.add_argument("--pipeline", choices=["current", "old_task"], default=os.environ.get('TASK_PIPELINE', 'current'),
+                        help="Task names, FEAT maps and ROIs to report (data_processor.PIPELINES; default: $TASK_PIPELINE or current)")
+    args = parser.parse_args()
+    if args.flag_review:
+        for subject in args.subjects:
+            OutputGenerator(subject, os.environ.get('ARCHIVEDIR')).set_review(True)
+            logging.info(f"Subject {subject} flagged for review")
+    else:
+        main(args.subjects, profile=args.profile, html_only=args.html_only, quicklook=args.quicklook,
+             flagged_only=args.flagged_only, pipeline=args.pipeline)
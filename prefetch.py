@@ -0,0 +1,112 @@
+#!/opt/anaconda3/bin/python
+# Python 3.8.20
+# prefetch.py: Background decompression of the next tasks' NIfTI inputs while the current task renders
+# Created for RECOVER project, Oct 2026
+#
+# DataProcessor draws Motor 1, Motor 2 and Language one after the other, and each task used to
+# start by gunzipping its z-maps and ROI masks from the network share. Prefetcher.iterate() walks
+# the tasks and, before yielding one, hands the inputs of the next PREFETCH_DEPTH tasks to a small
+# thread pool that creates their working copies (nifti_cache.py). gzip and file I/O release the
+# GIL, so decompression overlaps with rendering; a reader that reaches a copy still being written
+# waits on the cache's per-copy lock instead of decoding it again.
+# Settings (environment):
+#   PREFETCH_DEPTH    tasks decoded ahead of the one being rendered (default 1; 0 disables prefetching)
+#   PREFETCH_WORKERS  decompression threads (default 2)
+#   PREFETCH_MAX_MB   cap on the uncompressed size of prefetched copies not yet used (default 2048);
+#                     also kept below half the scratch budget so prefetching never evicts its own copies
+
+import os
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from nifti_cache import get_cache
+
+# Set up logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+DEFAULT_DEPTH = 1
+DEFAULT_WORKERS = 2
+DEFAULT_MAX_MB = 2048
+
+
+class Prefetcher:
+    def __init__(self, depth=None, workers=None, max_bytes=None):
+        if depth is None:
+            depth = int(os.environ.get('PREFETCH_DEPTH', DEFAULT_DEPTH))
+        if workers is None:
+            workers = int(os.environ.get('PREFETCH_WORKERS', DEFAULT_WORKERS))
+        if max_bytes is None:
+            max_bytes = int(float(os.environ.get('PREFETCH_MAX_MB', DEFAULT_MAX_MB)) * 1024 ** 2)
+        self.cache = get_cache()
+        self.depth = max(depth, 0)
+        self.max_bytes = min(max_bytes, self.cache.budget_bytes // 2)
+        self._pool = ThreadPoolExecutor(max_workers=max(workers, 1), thread_name_prefix="prefetch") if self.depth else None
+        self._lock = threading.Lock()
+        self._pending = {}  # Source path -> uncompressed bytes, until the path is released
+        self._pending_bytes = 0
+
+    def _decode(self, path):
+        try:
+            self.cache.working_copy(path)
+        except Exception as e:  # The reader will hit (and report) the same error when it loads the file
+            logging.warning(f"Prefetch failed for {path}: {e}")
+
+    def schedule(self, paths):
+        """Start decompressing paths in the background, within the memory cap; returns the scheduled paths."""
+        if self._pool is None:
+            return []
+        scheduled = []
+        for path in paths:
+            if not path.endswith('.gz') or not os.path.exists(path) or os.path.exists(self.cache.copy_path(path)):
+                continue
+            size = self.cache.uncompressed_size(path)
+            with self._lock:
+                if path in self._pending:
+                    continue
+                if self._pending_bytes + size > self.max_bytes:
+                    logging.info(f"Prefetch cap reached ({self._pending_bytes / 1024 ** 2:.0f} MB pending); not prefetching {path}")
+                    continue
+                self._pending[path] = size
+                self._pending_bytes += size
+            self._pool.submit(self._decode, path)
+            scheduled.append(path)
+        return scheduled
+
+    def release(self, paths):
+        """Mark paths as used, freeing their share of the memory cap."""
+        with self._lock:
+            for path in paths:
+                self._pending_bytes -= self._pending.pop(path, 0)
+
+    def iterate(self, items, inputs_fn):
+        """Iterator over items that keeps the inputs (inputs_fn(item)) of the next depth items prefetched.
+
+        The first item's inputs are scheduled at once, so they decode while the caller loads anything
+        it needs before the loop (the T1 background, for example).
+        """
+        items = list(items)
+        inputs = [list(inputs_fn(item)) for item in items]
+        if self.depth:
+            for paths in inputs[:self.depth]:
+                self.schedule(paths)
+        return self._iterate(items, inputs)
+
+    def _iterate(self, items, inputs):
+        for i, item in enumerate(items):
+            if i + self.depth < len(items) and self.depth:
+                self.schedule(inputs[i + self.depth])
+            yield item
+            self.release(inputs[i])
+
+    def close(self):
+        """Wait for running decompressions and stop the threads."""
+        if self._pool is not None:
+            self._pool.shutdown(wait=True)
+            self._pool = None
+        self.release(list(self._pending))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
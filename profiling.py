@@ -0,0 +1,135 @@
+#!/opt/anaconda3/bin/python
+# Python 3.8.20
+# profiling.py: Opt-in profiling for output_generator.py and ica_corr.py (--profile)
+# Created for RECOVER project, Oct 2026
+#
+# Code marks each artifact with `with profiler.section("name"):`. When profiling is off,
+# section() returns a shared no-op context manager, so instrumented code pays only a
+# function call. When on, each section records wall time and tracemalloc peak, the whole
+# run is recorded with cProfile, and a sampling thread collects call stacks in the
+# collapsed format used by flamegraph.pl / speedscope. Results go to <output_dir>:
+#   <label>_timings.json   per-section timings and memory peaks
+#   <label>.prof           cProfile stats (open with snakeviz or pstats)
+#   <label>.folded         collapsed stacks for flamegraph tools
+
+import os
+import sys
+import json
+import time
+import logging
+import cProfile
+import threading
+import tracemalloc
+from collections import Counter
+from contextlib import nullcontext
+
+# Set up logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+_NULL_SECTION = nullcontext()
+SAMPLE_INTERVAL = 0.005  # Seconds between stack samples
+
+
+class _Section:
+    def __init__(self, profiler, name):
+        self.profiler = profiler
+        self.name = name
+
+    def __enter__(self):
+        current, _ = tracemalloc.get_traced_memory()
+        if hasattr(tracemalloc, 'reset_peak'):  # Python >= 3.9; otherwise peaks are run-wide maxima
+            tracemalloc.reset_peak()
+        self.profiler._stack.append([current, 0])
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        elapsed = time.perf_counter() - self.start
+        start_mem, child_peak = self.profiler._stack.pop()
+        peak = max(tracemalloc.get_traced_memory()[1], child_peak)
+        if self.profiler._stack:
+            self.profiler._stack[-1][1] = max(self.profiler._stack[-1][1], peak)
+        self.profiler.records.append({
+            'section': self.name,
+            'seconds': round(elapsed, 6),
+            'peak_mb': round((peak - start_mem) / 1024 ** 2, 3),
+            'depth': len(self.profiler._stack),
+        })
+        return False
+
+
+class _StackSampler(threading.Thread):
+    """Periodically records the main thread's call stack."""
+
+    def __init__(self, thread_id, interval=SAMPLE_INTERVAL):
+        super().__init__(daemon=True)
+        self.thread_id = thread_id
+        self.interval = interval
+        self.counts = Counter()
+        self._stop_event = threading.Event()
+
+    def run(self):
+        while not self._stop_event.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{os.path.basename(code.co_filename)}:{code.co_name}")
+                frame = frame.f_back
+            if stack:
+                self.counts[';'.join(reversed(stack))] += 1
+
+    def stop(self):
+        self._stop_event.set()
+        self.join()
+
+
+class Profiler:
+    def __init__(self):
+        self.enabled = False
+        self.records = []
+        self._stack = []
+        self._cprofile = None
+        self._sampler = None
+
+    def section(self, name):
+        """Context manager timing one artifact (no-op unless profiling is running)."""
+        if not self.enabled:
+            return _NULL_SECTION
+        return _Section(self, name)
+
+    def start(self):
+        """Begin recording sections, cProfile stats and stack samples."""
+        self.records = []
+        self._stack = []
+        tracemalloc.start()
+        self._sampler = _StackSampler(threading.get_ident())
+        self._sampler.start()
+        self._cprofile = cProfile.Profile()
+        self._cprofile.enable()
+        self.enabled = True
+
+    def stop(self, output_dir, label):
+        """Stop recording and write <label>_timings.json, <label>.prof and <label>.folded to output_dir."""
+        if not self.enabled:
+            return None
+        self._cprofile.disable()
+        self._sampler.stop()
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        self.enabled = False
+
+        os.makedirs(output_dir, exist_ok=True)
+        timings_path = os.path.join(output_dir, f"{label}_timings.json")
+        with open(timings_path, 'w') as f:
+            json.dump({'label': label, 'traced_peak_mb': round(peak / 1024 ** 2, 3), 'sections': self.records}, f, indent=2)
+        self._cprofile.dump_stats(os.path.join(output_dir, f"{label}.prof"))
+        with open(os.path.join(output_dir, f"{label}.folded"), 'w') as f:
+            for stack, count in self._sampler.counts.most_common():
+                f.write(f"{stack} {count}\n")
+        logging.info(f"Profile saved to {output_dir} ({len(self.records)} sections)")
+        return timings_path
+
+
+# Shared instance used by all instrumented modules
+profiler = Profiler()
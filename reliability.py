@@ -0,0 +1,211 @@
+#!/opt/anaconda3/bin/python
+# Python 3.8.20
+# reliability.py: Run-to-run reliability of the motor task (motor_run-01 vs motor_run-02)
+# Created for RECOVER project, Oct 2026
+#
+# Each subject's two MNI-space remasked_zstat1 maps and SMA_PMC ROIs are reduced once to a
+# compact cache, post_stats/sub-<id>_motor_reliability_arrays.npz (brain voxel indices, the two
+# runs' z values and an ROI bit mask), refreshed only when an input changes. Cohort metrics are
+# then computed from blocks of concatenated caches with per-subject segment sums
+# (np.add.reduceat), so every subject and threshold in a block is handled in the same array operations:
+#   per subject and threshold  Dice, overlap coefficient |A∩B|/min(|A|,|B|), suprathreshold counts
+#   per subject                voxel-wise Pearson r (brain, each ROI), mean z per ROI and run
+#   per ROI (cohort)           ICC(2,1), ICC(3,1) and Pearson r of the ROI mean z between runs
+# Results go to <out_dir>/motor_reliability_subjects.csv, motor_reliability_thresholds.csv and
+# motor_reliability_icc.csv (default $ARCHIVEDIR/group).
+# Usage: python reliability.py [--thresholds 2.35 3.1 ...] [--out_dir DIR] <subject_id1> ...
+
+import os
+import sys
+import logging
+import argparse
+import numpy as np
+from nifti_cache import load_img
+
+# Set up logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+RUNS = ('motor_run-01', 'motor_run-02')
+DEFAULT_THRESHOLDS = (2.35, 3.1, 4.0, 5.0)
+# ROI bit in the cache -> (label, subject ROI file in MNI space)
+ROIS = {
+    1: ('Whole-brain SMA + PMC', "SMA_PMC_sub.nii.gz"),
+    2: ('Left SMA + PMC', "SMA_PMC_sub_left.nii.gz"),
+    4: ('Right SMA + PMC', "SMA_PMC_sub_right.nii.gz"),
+}
+CACHE_VERSION = 1
+BLOCK_SIZE = 32  # Subjects whose arrays are processed together (bounds memory for large cohorts)
+
+
+def _inputs(datadir, subject):
+    sub_dir = os.path.join(datadir, f"sub-{subject}", "ses-01")
+    zmaps = [os.path.join(sub_dir, "fsl_stats", f"sub-{subject}_task-{run}_contrasts.feat", "stats/remasked_zstat1.nii.gz")
+             for run in RUNS]
+    rois = {bit: os.path.join(sub_dir, "ROI", name) for bit, (_, name) in ROIS.items()}
+    return sub_dir, zmaps, rois
+
+
+def subject_arrays(datadir, subject):
+    """Cached (z1, z2, roi_bits) of one subject over the voxels inside either run's brain mask."""
+    sub_dir, zmaps, rois = _inputs(datadir, subject)
+    sources = zmaps + [rois[bit] for bit in sorted(rois)]
+    stamp = np.array([os.stat(p).st_mtime_ns for p in sources] + [CACHE_VERSION], dtype=np.int64)
+    cache_path = os.path.join(sub_dir, "post_stats", f"sub-{subject}_motor_reliability_arrays.npz")
+    if os.path.exists(cache_path):
+        with np.load(cache_path) as cached:
+            if np.array_equal(cached['stamp'], stamp):
+                return cached['z1'], cached['z2'], cached['roi_bits']
+
+    z1 = np.asarray(load_img(zmaps[0]).dataobj, dtype=np.float32).ravel()
+    z2 = np.asarray(load_img(zmaps[1]).dataobj, dtype=np.float32).ravel()
+    if z1.shape != z2.shape:
+        raise ValueError(f"sub-{subject}: motor runs are on different grids")
+    index = np.flatnonzero((np.nan_to_num(z1) != 0) | (np.nan_to_num(z2) != 0)).astype(np.uint32)
+    roi_bits = np.zeros(index.size, dtype=np.uint8)
+    for bit, path in rois.items():
+        roi_bits |= (np.asarray(load_img(path).dataobj).ravel()[index] > 0).astype(np.uint8) * bit
+    z1, z2 = np.nan_to_num(z1[index]), np.nan_to_num(z2[index])
+    os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+    tmp_path = f"{cache_path}.{os.getpid()}.tmp"
+    with open(tmp_path, 'wb') as f:
+        np.savez(f, stamp=stamp, index=index, z1=z1, z2=z2, roi_bits=roi_bits)
+    os.replace(tmp_path, cache_path)
+    return z1, z2, roi_bits
+
+
+def _segment_sums(values, offsets):
+    """Sum of values (N, ...) within each subject segment starting at offsets."""
+    return np.add.reduceat(values, offsets, axis=0, dtype=np.float64)
+
+
+def _pearson(x, y, weights, offsets):
+    """Pearson r of x and y within each subject segment, using only entries with weight 1."""
+    n = _segment_sums(weights, offsets)
+    sx, sy = _segment_sums(x * weights, offsets), _segment_sums(y * weights, offsets)
+    sxx, syy = _segment_sums(x * x * weights, offsets), _segment_sums(y * y * weights, offsets)
+    sxy = _segment_sums(x * y * weights, offsets)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return (sxy - sx * sy / n) / np.sqrt((sxx - sx * sx / n) * (syy - sy * sy / n))
+
+
+def block_metrics(z1, z2, roi_bits, offsets, thresholds):
+    """Metrics for a block of subjects whose arrays are concatenated (segments start at offsets)."""
+    t = np.asarray(thresholds, dtype=np.float32)
+    above1 = z1[:, None] > t[None, :]
+    above2 = z2[:, None] > t[None, :]
+    metrics = {
+        'count1': _segment_sums(above1, offsets),  # (subjects, thresholds)
+        'count2': _segment_sums(above2, offsets),
+        'both': _segment_sums(above1 & above2, offsets),
+    }
+    del above1, above2
+    in_both = ((z1 != 0) & (z2 != 0)).astype(np.float32)
+    metrics['r_brain'] = _pearson(z1, z2, in_both, offsets)
+    for bit in ROIS:
+        in_roi = ((roi_bits & bit) > 0).astype(np.float32)
+        n_roi = _segment_sums(in_roi, offsets)
+        metrics[f"r_{bit}"] = _pearson(z1, z2, in_roi * in_both, offsets)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            metrics[f"mean1_{bit}"] = _segment_sums(z1 * in_roi, offsets) / n_roi
+            metrics[f"mean2_{bit}"] = _segment_sums(z2 * in_roi, offsets) / n_roi
+    return metrics
+
+
+def icc(x1, x2):
+    """ICC(2,1) absolute agreement and ICC(3,1) consistency of two measurements per subject."""
+    data = np.column_stack([x1, x2]).astype(np.float64)
+    n, k = data.shape
+    if n < 2:
+        return np.nan, np.nan
+    grand = data.mean()
+    ms_rows = k * ((data.mean(axis=1) - grand) ** 2).sum() / (n - 1)
+    ms_cols = n * ((data.mean(axis=0) - grand) ** 2).sum() / (k - 1)
+    resid = data - data.mean(axis=1, keepdims=True) - data.mean(axis=0, keepdims=True) + grand
+    ms_err = (resid ** 2).sum() / ((n - 1) * (k - 1))
+    with np.errstate(invalid='ignore', divide='ignore'):
+        icc21 = (ms_rows - ms_err) / (ms_rows + (k - 1) * ms_err + k * (ms_cols - ms_err) / n)
+        icc31 = (ms_rows - ms_err) / (ms_rows + (k - 1) * ms_err)
+    return icc21, icc31
+
+
+def compute(datadir, subjects, thresholds=DEFAULT_THRESHOLDS, block_size=BLOCK_SIZE):
+    """Reliability tables (subjects, thresholds, ICC) as pandas DataFrames."""
+    import pandas as pd
+    kept, blocks, pending = [], [], []
+
+    def flush():
+        sizes = [z1.size for z1, _, _ in pending]
+        offsets = np.concatenate([[0], np.cumsum(sizes)[:-1]]).astype(np.intp)
+        blocks.append(block_metrics(np.concatenate([p[0] for p in pending]), np.concatenate([p[1] for p in pending]),
+                                    np.concatenate([p[2] for p in pending]), offsets, thresholds))
+        pending.clear()
+
+    for subject in subjects:
+        try:
+            arrays = subject_arrays(datadir, subject)
+        except (FileNotFoundError, ValueError) as e:
+            logging.error(f"Skipping sub-{subject}: {e}")
+            continue
+        if arrays[0].size == 0:
+            logging.error(f"Skipping sub-{subject}: empty z-maps")
+            continue
+        kept.append(subject)
+        pending.append(arrays)
+        if len(pending) == block_size:
+            flush()
+    if pending:
+        flush()
+    if not kept:
+        raise ValueError("No subject has both motor runs")
+    m = {key: np.concatenate([block[key] for block in blocks]) for key in blocks[0]}
+
+    n_sub, n_t = len(kept), len(thresholds)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        dice = 2 * m['both'] / (m['count1'] + m['count2'])
+        overlap = m['both'] / np.minimum(m['count1'], m['count2'])
+    thresh_rows = pd.DataFrame({
+        'Subject': np.repeat(kept, n_t),
+        'Threshold': np.tile(np.round(thresholds, 3), n_sub),
+        'Voxels Run 1': m['count1'].ravel().astype(int),
+        'Voxels Run 2': m['count2'].ravel().astype(int),
+        'Voxels Both': m['both'].ravel().astype(int),
+        'Dice': dice.ravel().round(4),
+        'Overlap': overlap.ravel().round(4),
+    })
+
+    subject_rows = pd.DataFrame({'Subject': kept, 'Voxel r (brain)': m['r_brain'].round(4)})
+    icc_rows = []
+    for bit, (label, _) in ROIS.items():
+        mean1, mean2 = m[f"mean1_{bit}"], m[f"mean2_{bit}"]
+        subject_rows[f"Voxel r ({label})"] = m[f"r_{bit}"].round(4)
+        subject_rows[f"Mean z Run 1 ({label})"] = mean1.round(4)
+        subject_rows[f"Mean z Run 2 ({label})"] = mean2.round(4)
+        valid = np.isfinite(mean1) & np.isfinite(mean2)
+        icc21, icc31 = icc(mean1[valid], mean2[valid])
+        r = np.corrcoef(mean1[valid], mean2[valid])[0, 1] if valid.sum() > 2 else np.nan
+        icc_rows.append({'ROI': label, 'Subjects': int(valid.sum()), 'ICC(2,1)': round(float(icc21), 4),
+                         'ICC(3,1)': round(float(icc31), 4), 'Pearson r': round(float(r), 4)})
+    return subject_rows, thresh_rows, pd.DataFrame(icc_rows)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run-to-run reliability of motor_run-01 vs motor_run-02")
+    parser.add_argument("--thresholds", type=float, nargs="+", default=list(DEFAULT_THRESHOLDS), help="Z thresholds")
+    parser.add_argument("--out_dir", default=None, help="Output folder (default: $ARCHIVEDIR/group)")
+    parser.add_argument("subjects", nargs="+", help="List of subject IDs")
+    args = parser.parse_args(argv)
+
+    archivedir = os.environ.get('ARCHIVEDIR', '')
+    datadir = os.environ.get('DATADIR', os.path.join(archivedir, "derivatives"))
+    out_dir = args.out_dir or os.path.join(archivedir, "group")
+    os.makedirs(out_dir, exist_ok=True)
+    subject_rows, thresh_rows, icc_rows = compute(datadir, args.subjects, args.thresholds)
+    subject_rows.to_csv(os.path.join(out_dir, "motor_reliability_subjects.csv"), index=False)
+    thresh_rows.to_csv(os.path.join(out_dir, "motor_reliability_thresholds.csv"), index=False)
+    icc_rows.to_csv(os.path.join(out_dir, "motor_reliability_icc.csv"), index=False)
+    logging.info(f"Reliability for {len(subject_rows)} subjects saved to {out_dir}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,337 @@
+#!/opt/anaconda3/bin/python
+# Python 3.8.20
+# report_worker.py: Long-lived report worker that keeps nilearn, matplotlib and the MNI template loaded
+# Created for RECOVER project, Oct 2026
+# Updated to pass --quicklook through to output_generator jobs, Oct 2026
+# Updated to lease running jobs to their daemon and run each job in a clean copy of the environment, Oct 2026
+#
+# Jobs are JSON files in a spool directory shared by the daemons and their clients:
+#   <spool>/incoming/  submitted jobs, claimed by atomic rename into running/
+#   <spool>/running/   jobs being processed, each with its owner (host, pid) and a lease that the
+#                      owner renews; jobs whose lease expired (owner died) go back to incoming/
+#   <spool>/done/      finished jobs with timing
+#   <spool>/failed/    failed jobs with the error traceback
+# Usage:
+#   python report_worker.py --spool DIR serve [--workers 3]
+#   python report_worker.py --spool DIR submit --stage output|ica [--tasks "..."] [--quicklook] [--wait] <subject_id1> ...
+# The spool defaults to $REPORT_WORKER_SPOOL.
+
+import os
+import sys
+import json
+import time
+import signal
+import socket
+import logging
+import argparse
+import traceback
+from concurrent.futures import ProcessPoolExecutor
+
+# Set up logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+STAGES = ('output', 'ica')
+SPOOL_DIRS = ('incoming', 'running', 'done', 'failed')
+POLL_INTERVAL = 0.5  # Seconds between spool scans
+DEFAULT_LEASE = 300  # Seconds a running job stays claimed without renewal
+HELD_SUFFIX = ".held"  # running/<job>.<host>.<pid>.held: job moved aside by its owner while renewing or finishing
+DEFAULT_TASKS = "motor_run-01 motor_run-02 lang"
+
+
+def spool_paths(spool):
+    """Create the spool folders if needed and return their paths by name."""
+    paths = {name: os.path.join(spool, name) for name in SPOOL_DIRS}
+    for path in paths.values():
+        os.makedirs(path, exist_ok=True)
+    return paths
+
+
+def _write_json(path, record):
+    tmp_path = f"{path}.{socket.gethostname()}.{os.getpid()}.tmp"
+    with open(tmp_path, 'w') as f:
+        json.dump(record, f, indent=2)
+    os.replace(tmp_path, path)
+
+
+_base_env = None  # Worker process environment before any job, restored for every job
+
+
+def _preload():
+    """Import the report modules and load shared assets once per worker process."""
+    global _base_env
+    os.environ.setdefault('MPLBACKEND', 'Agg')
+    _base_env = dict(os.environ)
+    import matplotlib
+    matplotlib.use('Agg')
+    import matplotlib.pyplot  # noqa: F401
+    import pandas  # noqa: F401
+    from nilearn import plotting  # noqa: F401 (report modules import these lazily)
+    import output_generator  # noqa: F401
+    import data_processor  # noqa: F401
+    import ica_corr
+    ica_corr.mni_template()
+    logging.info(f"Worker {os.getpid()} preloaded report modules")
+
+
+def run_job(job):
+    """Run one (subject, stage) job inside a preloaded worker process."""
+    # Start from the worker's own environment so nothing leaks from the previous job; keys the
+    # submitter did not have set are removed
+    if _base_env is not None:
+        os.environ.clear()
+        os.environ.update(_base_env)
+    for key, value in job.get('env', {}).items():
+        if value is None:
+            os.environ.pop(key, None)
+        else:
+            os.environ[key] = value
+    # Module-level state built from the previous job's environment: the layout indexes (and their
+    # per-process refresh marks, so files written since are found) are reopened, and nifti_cache
+    # rebuilds its cache whenever NIFTI_SCRATCH_* differ
+    import layout_index
+    layout_index.reset()
+    subject = job['subject']
+    if job['stage'] == 'output':
+        import output_generator
+        output_generator.main([subject], profile=job.get('profile', False), quicklook=job.get('quicklook', False),
+                              pipeline=job.get('pipeline', 'current'))
+    elif job['stage'] == 'ica':
+        import ica_corr
+        sub_dir = os.path.join(os.environ['DATADIR'], f"sub-{subject}", "ses-01")
+        ica_corr.generate_report(sub_dir, job['tasks'].split(), subject)
+    else:
+        raise ValueError(f"Unknown stage: {job['stage']}")
+
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def requeue_orphans(paths, lease=DEFAULT_LEASE, now=None):
+    """Move running jobs whose owner is gone back to incoming/; returns their names.
+
+    A job is orphaned when its lease has expired, or when its owner ran on this host and the
+    process no longer exists. Jobs of live daemons, on any host, are left alone.
+    """
+    now = time.time() if now is None else now
+    host = socket.gethostname()
+    requeued = []
+    for name in sorted(os.listdir(paths['running'])):
+        if name.endswith(HELD_SUFFIX):
+            # Left by a daemon that died while renewing or finishing this job
+            held_path = os.path.join(paths['running'], name)
+            try:
+                if os.stat(held_path).st_mtime + lease < now:
+                    original = name.split('.json.')[0] + '.json'
+                    os.rename(held_path, os.path.join(paths['incoming'], original))
+                    logging.warning(f"Requeued {original} (held by a daemon that is gone)")
+                    requeued.append(original)
+            except FileNotFoundError:
+                pass
+            continue
+        if not name.endswith('.json'):
+            continue
+        running_path = os.path.join(paths['running'], name)
+        try:
+            with open(running_path) as f:
+                owner = json.load(f).get('owner') or {}
+        except (FileNotFoundError, ValueError):
+            continue  # Finished meanwhile, or being rewritten by its owner
+        if 'expires' not in owner:
+            # Claimed but not stamped yet; the rename into running/ set its ctime
+            try:
+                expired = os.stat(running_path).st_ctime + lease < now
+            except FileNotFoundError:
+                continue
+        else:
+            expired = owner['expires'] < now or (owner.get('host') == host and not _pid_alive(owner.get('pid', 0)))
+        if not expired:
+            continue
+        try:
+            os.rename(running_path, os.path.join(paths['incoming'], name))
+        except FileNotFoundError:
+            continue  # Finished, or requeued by another daemon
+        logging.warning(f"Requeued {name} (owner {owner.get('host', '?')}:{owner.get('pid', '?')} is gone)")
+        requeued.append(name)
+    return requeued
+
+
+def _stamp(job, lease):
+    job['owner'] = {'host': socket.gethostname(), 'pid': os.getpid(), 'expires': time.time() + lease}
+    return job
+
+
+def _take(running_path):
+    """Move a running job this daemon still owns to a private name; returns that path, or None.
+
+    The rename is atomic, so a daemon requeueing the job either finds it gone or moved it first
+    (and then it is not ours any more). A job claimed again by another daemon is put back.
+    """
+    held_path = f"{running_path}.{socket.gethostname()}.{os.getpid()}{HELD_SUFFIX}"
+    try:
+        os.rename(running_path, held_path)
+    except FileNotFoundError:
+        return None
+    try:
+        with open(held_path) as f:
+            owner = json.load(f).get('owner') or {}
+    except ValueError:
+        owner = {}
+    if owner.get('host') != socket.gethostname() or owner.get('pid') != os.getpid():
+        os.rename(held_path, running_path)
+        return None
+    return held_path
+
+
+def serve(spool, workers, lease=DEFAULT_LEASE):
+    """Claim jobs from the spool and run them concurrently until SIGINT/SIGTERM."""
+    paths = spool_paths(spool)
+    requeue_orphans(paths, lease)
+    last_check = time.time()
+
+    stopping = []
+    signal.signal(signal.SIGTERM, lambda signum, frame: stopping.append(signum))
+    signal.signal(signal.SIGINT, lambda signum, frame: stopping.append(signum))
+
+    in_flight = {}
+    logging.info(f"Report worker serving {spool} with {workers} workers")
+    with ProcessPoolExecutor(max_workers=workers, initializer=_preload) as pool:
+        while not stopping or in_flight:
+            # Record finished jobs
+            for name, (job, future, start) in list(in_flight.items()):
+                if not future.done():
+                    continue
+                del in_flight[name]
+                job['seconds'] = round(time.time() - start, 3)
+                error = future.exception()
+                if error is None:
+                    job['status'] = 'done'
+                    logging.info(f"Finished {job['stage']} for {job['subject']} in {job['seconds']}s")
+                else:
+                    job['status'] = 'failed'
+                    job['error'] = ''.join(traceback.format_exception(type(error), error, error.__traceback__))
+                    logging.error(f"Failed {job['stage']} for {job['subject']}: {error}")
+                held_path = _take(os.path.join(paths['running'], name))
+                if held_path is None:
+                    logging.warning(f"{name} was requeued while it ran (lease expired); its result is discarded")
+                    continue
+                job.pop('owner', None)
+                _write_json(os.path.join(paths[job['status']], name), job)
+                os.remove(held_path)
+
+            # Renew the leases of running jobs and requeue jobs of daemons that died
+            if time.time() - last_check > lease / 3:
+                last_check = time.time()
+                for name, (job, future, _) in list(in_flight.items()):
+                    running_path = os.path.join(paths['running'], name)
+                    held_path = _take(running_path)
+                    if held_path is None:
+                        # Requeued by another daemon: stop tracking it. A pool task cannot be killed on
+                        # its own, so it runs to the end and its result is dropped.
+                        future.cancel()
+                        del in_flight[name]
+                        logging.warning(f"Lost the lease of {name}; its result will be discarded")
+                        continue
+                    _write_json(held_path, _stamp(job, lease))
+                    os.rename(held_path, running_path)
+                requeue_orphans(paths, lease)
+
+            # Claim new jobs while workers are free; others stay in incoming/ for another daemon
+            if not stopping:
+                for name in sorted(os.listdir(paths['incoming'])):
+                    if len(in_flight) >= workers:
+                        break
+                    if not name.endswith('.json'):
+                        continue
+                    running_path = os.path.join(paths['running'], name)
+                    try:
+                        os.rename(os.path.join(paths['incoming'], name), running_path)
+                    except FileNotFoundError:
+                        continue  # Claimed by another daemon
+                    with open(running_path) as f:
+                        job = json.load(f)
+                    _write_json(running_path, _stamp(job, lease))
+                    logging.info(f"Starting {job['stage']} for {job['subject']}")
+                    in_flight[name] = (job, pool.submit(run_job, job), time.time())
+            time.sleep(POLL_INTERVAL)
+    logging.info("Report worker stopped")
+
+
+def submit(spool, stage, subjects, tasks=DEFAULT_TASKS, profile=False, quicklook=False, pipeline='current'):
+    """Write one job per subject to the spool; returns the job file names."""
+    paths = spool_paths(spool)
+    env = {key: os.environ.get(key) for key in ('ARCHIVEDIR', 'DATADIR', 'ROI', 'NIFTI_SCRATCH_DIR', 'NIFTI_SCRATCH_BUDGET_GB')}
+    names = []
+    for subject in subjects:
+        name = f"{time.time_ns()}_{os.getpid()}_{stage}_{subject}.json"
+        job = {'subject': subject, 'stage': stage, 'tasks': tasks, 'profile': profile, 'quicklook': quicklook,
+               'pipeline': pipeline, 'env': env, 'submitted': time.strftime('%Y-%m-%dT%H:%M:%S')}
+        _write_json(os.path.join(paths['incoming'], name), job)
+        names.append(name)
+        logging.info(f"Submitted {stage} job for subject {subject}")
+    return names
+
+
+def wait(spool, names, timeout=None):
+    """Block until every job has finished; returns the number of failed jobs."""
+    paths = spool_paths(spool)
+    pending = set(names)
+    failed = 0
+    start = time.time()
+    while pending:
+        for name in list(pending):
+            if os.path.exists(os.path.join(paths['done'], name)):
+                pending.discard(name)
+            elif os.path.exists(os.path.join(paths['failed'], name)):
+                pending.discard(name)
+                failed += 1
+                with open(os.path.join(paths['failed'], name)) as f:
+                    logging.error(f"Job {name} failed:\n{json.load(f).get('error', '')}")
+        if timeout and time.time() - start > timeout:
+            logging.error(f"Timed out waiting for {len(pending)} jobs")
+            return failed + len(pending)
+        if pending:
+            time.sleep(POLL_INTERVAL)
+    return failed
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Warm report worker for output_generator.py and ica_corr.py")
+    parser.add_argument("--spool", default=os.environ.get('REPORT_WORKER_SPOOL'),
+                        help="Spool directory (default: $REPORT_WORKER_SPOOL)")
+    sub = parser.add_subparsers(dest='command', required=True)
+    p_serve = sub.add_parser('serve', help="Run the worker daemon")
+    p_serve.add_argument("--workers", type=int, default=3, help="Concurrent report jobs")
+    p_serve.add_argument("--lease", type=float, default=DEFAULT_LEASE,
+                         help="Seconds before another daemon may requeue a running job that was not renewed")
+    p_submit = sub.add_parser('submit', help="Queue report jobs")
+    p_submit.add_argument("--stage", choices=STAGES, required=True, help="Report stage to run")
+    p_submit.add_argument("--tasks", default=os.environ.get('TASKS', DEFAULT_TASKS), help="Space-separated tasks (ica stage)")
+    p_submit.add_argument("--profile", action="store_true", help="Pass --profile to output_generator")
+    p_submit.add_argument("--quicklook", action="store_true", help="Pass --quicklook to output_generator")
+    p_submit.add_argument("--pipeline", choices=["current", "old_task"], default=os.environ.get('TASK_PIPELINE', 'current'),
+                          help="Pass --pipeline to output_generator (default: $TASK_PIPELINE or current)")
+    p_submit.add_argument("--wait", action="store_true", help="Wait for the jobs and exit non-zero if any failed")
+    p_submit.add_argument("--timeout", type=float, help="Seconds to wait before giving up")
+    p_submit.add_argument("subjects", nargs="+", help="List of subject IDs")
+    args = parser.parse_args(argv)
+
+    if not args.spool:
+        parser.error("No spool directory: pass --spool or set REPORT_WORKER_SPOOL")
+    if args.command == 'serve':
+        serve(args.spool, args.workers, args.lease)
+        return 0
+    names = submit(args.spool, args.stage, args.subjects, args.tasks, args.profile, args.quicklook, args.pipeline)
+    if args.wait:
+        return 1 if wait(args.spool, names, args.timeout) else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
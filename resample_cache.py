@@ -0,0 +1,107 @@
+#!/opt/anaconda3/bin/python
+# Python 3.8.20
+# resample_cache.py: Stat maps resampled onto a background grid, computed once and reused
+# Created for RECOVER project, Oct 2026
+#
+# plot_stat_map, view_img and the mosaic renderer each resample the same z-map onto the
+# subject's T1 grid. Results are keyed by (source file, target affine and shape,
+# interpolation): full volumes are written as uncompressed .nii copies in the
+# nifti_cache.py scratch directory (so they share its LRU disk budget and survive
+# reruns) and reopened with mmap; nilearn skips its own resampling for images that are
+# already on the background grid; maps that are already aligned are passed through as they
+# are. Axial planes sampled by mosaic.py, and whether each map has negative values, are kept
+# in memory. preview_grid() gives the coarse grid of the preview viewers; T1 and maps resampled
+# onto it are cached the same way.
+
+import os
+import hashlib
+import logging
+import tempfile
+import numpy as np
+import nibabel as nib
+from nifti_cache import get_cache, load_img
+
+# Set up logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+_image_memo = {}
+_plane_memo = {}
+_negative_memo = {}
+
+
+def _source_key(path):
+    st = os.stat(path)
+    return f"{os.path.realpath(path)}:{st.st_size}:{st.st_mtime_ns}"
+
+
+def _grid_key(img):
+    return f"{np.asarray(img.affine, dtype=np.float64).tobytes().hex()}:{tuple(img.shape[:3])}"
+
+
+def resampled(path, target_img, interpolation='continuous'):
+    """Image at path resampled onto target_img's grid, from the cache when available."""
+    img = load_img(path)
+    if img.shape[:3] == target_img.shape[:3] and np.allclose(img.affine, target_img.affine):
+        return img  # Already on the grid (e.g. antsApplyTransforms output with the T1 as reference)
+    key = hashlib.sha1(f"{_source_key(path)}:{_grid_key(target_img)}:{interpolation}".encode()).hexdigest()[:16]
+    if key in _image_memo:
+        return _image_memo[key]
+
+    cache = get_cache()
+    name = os.path.basename(path).replace('.nii.gz', '').replace('.nii', '')
+    copy_path = os.path.join(cache.scratch_dir, f"{name}_rs_{key}.nii")
+    if os.path.exists(copy_path):
+        os.utime(copy_path)  # Mark as most recently used for the scratch LRU
+    else:
+        from nilearn.image import resample_to_img
+        img = resample_to_img(img, target_img, interpolation=interpolation)
+        data = np.asarray(img.dataobj, dtype=np.float32)
+        cache.evict(data.nbytes)
+        fd, tmp_path = tempfile.mkstemp(dir=cache.scratch_dir, suffix='.tmp')
+        os.close(fd)
+        try:
+            nib.save(nib.Nifti1Image(data, img.affine), tmp_path + '.nii')
+            os.replace(tmp_path + '.nii', copy_path)  # Atomic, so concurrent readers never see a partial copy
+        finally:
+            for leftover in (tmp_path, tmp_path + '.nii'):
+                if os.path.exists(leftover):
+                    os.remove(leftover)
+        logging.info(f"Resampled copy created: {path} -> {copy_path}")
+    img = cache.load(copy_path)  # Pinned against eviction while the memo holds it
+    _image_memo[key] = img
+    return img
+
+
+def preview_grid(img, voxel_mm):
+    """Empty image on an axis-aligned voxel_mm grid covering img's field of view (for preview viewers)."""
+    shape = np.array(img.shape[:3]) - 1
+    corners = np.array([[i, j, k] for i in (0, shape[0]) for j in (0, shape[1]) for k in (0, shape[2])])
+    world = nib.affines.apply_affine(img.affine, corners)
+    low, high = world.min(axis=0), world.max(axis=0)
+    target_shape = tuple(int(n) for n in np.ceil((high - low) / voxel_mm).astype(int) + 1)
+    affine = np.diag([voxel_mm, voxel_mm, voxel_mm, 1.0])
+    affine[:3, 3] = low
+    return nib.Nifti1Image(np.zeros(target_shape, dtype=np.uint8), affine)
+
+
+def sampled_planes(background, path, ks, order):
+    """mosaic.MosaicBackground.sample_planes for the image at path, computed once per process."""
+    key = (_source_key(path), _grid_key(background.img), tuple(ks), order)
+    if key not in _plane_memo:
+        _plane_memo[key] = background.sample_planes(load_img(path), ks, order=order)
+    return _plane_memo[key]
+
+
+def has_negatives(path):
+    """Whether the map at path has values below zero, computed once per process."""
+    key = _source_key(path)
+    if key not in _negative_memo:
+        _negative_memo[key] = bool(np.nanmin(load_img(path).dataobj) < 0)
+    return _negative_memo[key]
+
+
+def clear():
+    """Forget in-memory results (disk copies stay in the scratch directory)."""
+    _image_memo.clear()
+    _plane_memo.clear()
+    _negative_memo.clear()
@@ -0,0 +1,245 @@
+#!/opt/anaconda3/bin/python
+# Python 3.8.20
+# roi_stats.py: Voxel counts, percentages, Dice and coverage of the post-stats CSV (calc_post_stats_thresh.sh)
+# Created for RECOVER project, Oct 2026
+# Updated to accept SparseMap sidecars (sparse_maps.py), counted by sorted-index intersection, Oct 2026
+# Updated to truncate with exact fractions and at the ratio scale of each stat type, Oct 2026
+# Updated to write the post-stats CSV from sparse maps in place of the fslstats calls, Oct 2026
+#
+# Counts follow fslstats: "-V" counts non-zero voxels and "-k mask -l 0 -V" counts voxels
+# above zero inside the mask. Percentages and Dice are truncated to 3 decimals like bc
+# "scale=3", and the ROI/WB ratio to the scale of its Stat Type (RATIO_DECIMALS), as the shell
+# arithmetic did before the counts moved here.
+# As a script, reads one tab-separated row per line on stdin (ROW_FIELDS: which maps each CSV row
+# counts) and writes the CSV. Every map is loaded once as a SparseMap, so each count is a
+# sorted-index intersection; ROI masks and the maps in --sidecars get their sidecar written on the way.
+# Usage: python roi_stats.py --subject ID --task TASK --csv FILE [--sidecars MAP ...] < rows.tsv
+
+import os
+import sys
+import math
+import logging
+import argparse
+from fractions import Fraction
+import numpy as np
+from nifti_cache import get_data
+import sparse_maps
+from sparse_maps import SparseMap, intersect, intersect_count
+
+# Set up logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+# bc scale of the %ROI/%WB ratio per Stat Type in calc_post_stats_thresh.sh
+RATIO_DECIMALS = {'Z-stat': 2, 'TFCE': 3, 'ICA': 3}
+CSV_COLUMNS = ['Subject', 'Task', 'Space', 'ROI', 'Threshold', 'Stat Type',
+               'Activated Voxels across Whole Brain (counts)', 'Activated Voxels within ROI (counts)',
+               'Activated Voxels across Whole Brain (%)', 'Activated Voxels within ROI (%)', 'Activated ROI/WB (%)',
+               '%Activated ROI/%Activated WB (ratio)', 'Voxels in ROI (counts)', 'Voxels in Whole Brain (counts)',
+               'Dice Coefficient', 'Coverage T-map (%)', 'Coverage Z-map (%)', 'Coverage T-map ROI (%)',
+               'Coverage Z-map ROI (%)']
+# Input row: the voxels of total_map and roi_mask are counted, active_map (> 0) gives the activated
+# voxels within wb_mask (the whole map when empty) and within roi_mask, and compare_map (the Z=3.1
+# map; empty for Z-stat rows) the Dice and coverage columns
+ROW_FIELDS = ['space', 'roi', 'threshold', 'stat_type', 'total_map', 'roi_mask', 'active_map', 'wb_mask', 'compare_map']
+
+
+def load_map(path):
+    """Load a statistical map or ROI mask as an array (memory-mapped when possible)."""
+    return get_data(path)
+
+
+def load_sparse_map(path):
+    """Load a thresholded map or ROI mask from its sparse sidecar (written on first use)."""
+    return sparse_maps.load(path)
+
+
+def count_voxels(img):
+    """Number of non-zero voxels (fslstats -V)."""
+    if isinstance(img, SparseMap):
+        return img.count_nonzero()
+    return int(np.count_nonzero(img))
+
+
+def count_active(img, *masks):
+    """Number of voxels above zero within the non-zero voxels of every mask (fslstats img -k mask -l 0 -V)."""
+    if isinstance(img, SparseMap) and all(isinstance(mask, SparseMap) for mask in masks):
+        index = img.above(0)
+        for mask in masks[:-1]:
+            index = intersect(index, mask.index)
+        return intersect_count(index, masks[-1].index) if masks else int(index.size)
+    if isinstance(img, SparseMap):
+        img = img.to_dense()
+    active = img > 0
+    for mask in masks:
+        if isinstance(mask, SparseMap):
+            mask = mask.to_dense()
+        active &= mask != 0
+    return int(np.count_nonzero(active))
+
+
+def _truncate(value, decimals=3):
+    """Fraction value truncated to decimals places, as bc does at that scale."""
+    factor = 10 ** decimals
+    return Fraction(math.floor(value * factor), factor)
+
+
+def _percentage(numerator, denominator):
+    if denominator <= 0:
+        return Fraction(0)
+    return _truncate(Fraction(numerator, denominator)) * 100
+
+
+def calculate_percentage(numerator, denominator):
+    """Percentage with the same truncation as calculate_percentage in calc_post_stats_thresh.sh."""
+    return float(_percentage(numerator, denominator))
+
+
+def calculate_dice(t_map, z_map):
+    """Dice coefficient between two thresholded maps."""
+    overlap = count_active(t_map, z_map)
+    total_t = count_voxels(t_map)
+    total_z = count_voxels(z_map)
+    if total_t > 0 and total_z > 0:
+        return float(_truncate(Fraction(2 * overlap, total_t + total_z)))
+    return 0.0
+
+
+def calculate_coverage(t_map, z_map):
+    """Coverage percentages of the overlap with the t-map and z-map as denominators."""
+    overlap = count_active(t_map, z_map)
+    total_t = count_voxels(t_map)
+    total_z = count_voxels(z_map)
+    coverage_t = calculate_percentage(overlap, total_t) if total_t > 0 else 0.0
+    coverage_z = calculate_percentage(overlap, total_z) if total_z > 0 else 0.0
+    return coverage_t, coverage_z
+
+
+def compute_roi_stats(thresh_map, z_map, roi_mask, stat_type='Z-stat'):
+    """Activation counts and percentages for one ROI row of the post-stats CSV."""
+    total_voxels = count_voxels(z_map)
+    roi_voxels = count_voxels(roi_mask)
+    activated_voxels_wb = count_active(thresh_map, z_map)
+    activated_voxels_roi = count_active(thresh_map, roi_mask)
+
+    percentage_wb = _percentage(activated_voxels_wb, total_voxels)
+    percentage_roi = _percentage(activated_voxels_roi, roi_voxels)
+    percentage_roi_in_wb = _percentage(activated_voxels_roi, total_voxels)
+    if percentage_wb > 0:
+        ratio = float(_truncate(percentage_roi / percentage_wb, RATIO_DECIMALS[stat_type]))
+    else:
+        ratio = "N/A"
+
+    return {
+        'Activated Voxels across Whole Brain (counts)': activated_voxels_wb,
+        'Activated Voxels within ROI (counts)': activated_voxels_roi,
+        'Activated Voxels across Whole Brain (%)': float(percentage_wb),
+        'Activated Voxels within ROI (%)': float(percentage_roi),
+        'Activated ROI/WB (%)': float(percentage_roi_in_wb),
+        '%Activated ROI/%Activated WB (ratio)': ratio,
+        'Voxels in ROI (counts)': roi_voxels,
+        'Voxels in Whole Brain (counts)': total_voxels,
+    }
+
+
+def _format_percentage(numerator, denominator):
+    if denominator <= 0:
+        return "0.0"
+    return f"{float(_percentage(numerator, denominator)):.3f}"
+
+
+def csv_row(stat_type, total_map, roi_mask, active_map, wb_mask=None, compare_map=None):
+    """Values of one post-stats CSV row from 'Activated Voxels across Whole Brain (counts)' on, as strings."""
+    total_voxels = count_voxels(total_map)
+    roi_voxels = count_voxels(roi_mask)
+    activated_voxels_wb = count_active(active_map, wb_mask) if wb_mask is not None else count_active(active_map)
+    activated_voxels_roi = count_active(active_map, roi_mask)
+
+    percentage_wb = _percentage(activated_voxels_wb, total_voxels)
+    if percentage_wb > 0:
+        ratio = _truncate(_percentage(activated_voxels_roi, roi_voxels) / percentage_wb, RATIO_DECIMALS[stat_type])
+        ratio = f"{float(ratio):.3f}"
+    else:
+        ratio = "N/A"
+    row = [activated_voxels_wb, activated_voxels_roi, _format_percentage(activated_voxels_wb, total_voxels),
+           _format_percentage(activated_voxels_roi, roi_voxels), _format_percentage(activated_voxels_roi, total_voxels),
+           ratio, roi_voxels, total_voxels]
+    if compare_map is None:
+        return row + ["N/A"] * 5  # Dice and coverage are N/A for Z-stat
+
+    # Dice and coverage of active_map (values > 0) against the Z=3.1 map, whole map and within the ROI
+    overlap = count_active(active_map, compare_map)
+    total_t = count_voxels(active_map)
+    total_z = count_voxels(compare_map)
+    dice = "0.0"
+    if total_t > 0 and total_z > 0:
+        dice = f"{float(_truncate(Fraction(2 * overlap, total_t + total_z))):.3f}"
+    activated_voxels_roi_z = count_active(compare_map, roi_mask)
+    # fslstats keeps only the last -k mask, so the shell's "-k <Z=3.1 map> -k <ROI>" overlap was the ROI count
+    overlap_roi = activated_voxels_roi
+    return row + [dice, _format_percentage(overlap, total_t), _format_percentage(overlap, total_z),
+                  _format_percentage(overlap_roi, activated_voxels_roi),
+                  _format_percentage(overlap_roi, activated_voxels_roi_z)]
+
+
+def write_csv(csv_file, subject, task, rows, sidecars=()):
+    """Write the post-stats CSV of one subject and task from ROW_FIELDS dicts, loading each map once.
+
+    ROI masks and the maps in sidecars are read from (or get) their sparse sidecar.
+    """
+    maps = {}
+
+    def sparse(path, write=False):
+        if not path:
+            return None
+        if path not in maps:
+            if not os.path.exists(path):
+                raise FileNotFoundError(f"Map not found: {path}")
+            maps[path] = sparse_maps.load(path, write=write or path in sidecars)
+        return maps[path]
+
+    lines = [",".join(CSV_COLUMNS)]
+    for row in rows:
+        values = csv_row(row['stat_type'], sparse(row['total_map']), sparse(row['roi_mask'], write=True),
+                         sparse(row['active_map']), sparse(row['wb_mask']), sparse(row['compare_map']))
+        lines.append(",".join(str(v) for v in [subject, task, row['space'], row['roi'], row['threshold'],
+                                               row['stat_type']] + values))
+    for path in sidecars:
+        if os.path.exists(path):
+            sparse(path)
+        else:
+            logging.warning(f"Map not found, no sidecar written: {path}")
+    tmp_file = f"{csv_file}.{os.getpid()}.tmp"
+    with open(tmp_file, 'w') as f:
+        f.write("\n".join(lines) + "\n")
+    os.replace(tmp_file, csv_file)
+    return csv_file
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Write the post-stats ROI CSV from tab-separated rows on stdin")
+    parser.add_argument("--subject", required=True, help="Subject ID")
+    parser.add_argument("--task", required=True, help="Task name")
+    parser.add_argument("--csv", required=True, help="Output CSV file")
+    parser.add_argument("--sidecars", nargs="*", default=[], help="Maps whose sparse sidecars are written or refreshed")
+    args = parser.parse_args(argv)
+
+    rows = []
+    for line in sys.stdin:
+        if not line.strip():
+            continue
+        fields = line.rstrip("\n").split("\t")
+        if len(fields) != len(ROW_FIELDS):
+            logging.error(f"Expected {len(ROW_FIELDS)} tab-separated fields, got {len(fields)}: {line.strip()}")
+            return 1
+        rows.append(dict(zip(ROW_FIELDS, fields)))
+    try:
+        write_csv(args.csv, args.subject, args.task, rows, set(args.sidecars))
+    except FileNotFoundError as e:
+        logging.error(str(e))
+        return 1
+    logging.info(f"{len(rows)} rows written to {args.csv}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
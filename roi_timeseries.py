@@ -0,0 +1,126 @@
+#!/opt/anaconda3/bin/python
+# Python 3.8.20
+# roi_timeseries.py: Mean time series of every ROI and hemisphere from one pass over each FEAT run
+# Created for RECOVER project, Oct 2026
+#
+# The subject's MNI ROIs (SMA_PMC, STG, Heschl; whole, left, right) are stacked into one sparse
+# averaging matrix (rows = ROIs, weights 1/voxel count) over the union of their voxels. Each
+# filtered_func_data run is then streamed in volume chunks from its memory-mapped working copy and
+# every chunk is reduced to all ROI means with a single sparse matrix product, so each 4D run is
+# read once whatever the number of ROIs. Results are written per task to
+#   post_stats/sub-<id>_task-<task>_roi_timeseries.npz
+#     timeseries  float32 (ROIs, volumes)    labels  ROI names    n_voxels  voxels per ROI    tr  seconds
+# and read back with load_timeseries(). Runs are skipped when the file is newer than its inputs.
+# Usage: python roi_timeseries.py --sub_dir DIR [--tasks "..."] [--force] <subject_id>
+
+import os
+import sys
+import logging
+import argparse
+import numpy as np
+from scipy import sparse
+from nifti_cache import load_img
+
+# Set up logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+DEFAULT_TASKS = "motor_run-01 motor_run-02 lang"
+CHUNK_SIZE = 20  # Volumes decoded per read when streaming the run
+# ROI label -> file in the subject ROI folder (MNI space, same grid as the FEAT outputs)
+ROI_FILES = {
+    'Whole-brain SMA + PMC': "SMA_PMC_sub.nii.gz",
+    'Left SMA + PMC': "SMA_PMC_sub_left.nii.gz",
+    'Right SMA + PMC': "SMA_PMC_sub_right.nii.gz",
+    'Whole-brain STG': "STG_sub.nii.gz",
+    'Left STG': "STG_sub_left.nii.gz",
+    'Right STG': "STG_sub_right.nii.gz",
+    'Whole-brain Heschl': "Heschl_sub.nii.gz",
+    'Left Heschl': "Heschl_sub_left.nii.gz",
+    'Right Heschl': "Heschl_sub_right.nii.gz",
+}
+
+
+def timeseries_path(sub_dir, subject, task):
+    return os.path.join(sub_dir, "post_stats", f"sub-{subject}_task-{task}_roi_timeseries.npz")
+
+
+def averaging_matrix(roi_paths, shape):
+    """Sparse (ROIs, union voxels) matrix of 1/count weights, the union's flat voxel indices and counts."""
+    masks = []
+    for path in roi_paths:
+        img = load_img(path)
+        if img.shape[:3] != tuple(shape):
+            raise ValueError(f"ROI {path} has shape {img.shape[:3]}, expected {tuple(shape)}")
+        masks.append(np.flatnonzero(np.asarray(img.dataobj).ravel() > 0))
+    union = np.unique(np.concatenate(masks))
+    rows = np.concatenate([np.full(m.size, i) for i, m in enumerate(masks)])
+    cols = np.concatenate([np.searchsorted(union, m) for m in masks])
+    counts = np.array([m.size for m in masks])
+    weights = np.concatenate([np.full(m.size, 1.0 / max(m.size, 1)) for m in masks])
+    matrix = sparse.csr_matrix((weights, (rows, cols)), shape=(len(masks), union.size))
+    return matrix, union, counts
+
+
+def extract(func_file, roi_paths, chunk_size=CHUNK_SIZE):
+    """(ROIs, volumes) mean time series of a 4D run, reading at most chunk_size volumes at a time."""
+    img = load_img(func_file)  # Memory-mapped working copy
+    shape, n_vols = img.shape[:3], img.shape[3]
+    matrix, union, counts = averaging_matrix(roi_paths, shape)
+    timeseries = np.zeros((len(roi_paths), n_vols), dtype=np.float32)
+    for start in range(0, n_vols, chunk_size):
+        stop = min(start + chunk_size, n_vols)
+        chunk = np.asarray(img.dataobj[..., start:stop], dtype=np.float32).reshape(-1, stop - start)
+        timeseries[:, start:stop] = matrix @ chunk[union].astype(np.float64)  # Accumulate sums in double precision
+    tr = float(img.header.get_zooms()[3]) if len(img.header.get_zooms()) > 3 else 0.0
+    return timeseries, counts, tr
+
+
+def extract_task(sub_dir, subject, task, force=False, chunk_size=CHUNK_SIZE):
+    """Write the ROI time series file for one task; returns its path (None if inputs are missing)."""
+    func_file = os.path.join(sub_dir, "fsl_stats", f"sub-{subject}_task-{task}_contrasts.feat", "filtered_func_data.nii.gz")
+    roi_paths = [os.path.join(sub_dir, "ROI", name) for name in ROI_FILES.values()]
+    missing = [p for p in [func_file] + roi_paths if not os.path.exists(p)]
+    if missing:
+        logging.error(f"Missing inputs for sub-{subject} {task}: {', '.join(missing)}")
+        return None
+    out_path = timeseries_path(sub_dir, subject, task)
+    if not force and os.path.exists(out_path):
+        newest = max(os.path.getmtime(p) for p in [func_file] + roi_paths)
+        if os.path.getmtime(out_path) >= newest:
+            logging.info(f"ROI time series up to date: {out_path}")
+            return out_path
+
+    timeseries, counts, tr = extract(func_file, roi_paths, chunk_size)
+    os.makedirs(os.path.dirname(out_path), exist_ok=True)
+    tmp_path = f"{out_path}.{os.getpid()}.tmp"
+    with open(tmp_path, 'wb') as f:
+        np.savez(f, timeseries=timeseries, labels=np.array(list(ROI_FILES)), n_voxels=counts, tr=tr)
+    os.replace(tmp_path, out_path)
+    logging.info(f"ROI time series ({timeseries.shape[0]} ROIs x {timeseries.shape[1]} volumes) saved to {out_path}")
+    return out_path
+
+
+def load_timeseries(sub_dir, subject, task):
+    """Read a task's ROI time series as (timeseries, labels, n_voxels, tr)."""
+    with np.load(timeseries_path(sub_dir, subject, task)) as data:
+        return data['timeseries'], [str(label) for label in data['labels']], data['n_voxels'], float(data['tr'])
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Extract mean time series of all ROIs from each FEAT run in one pass")
+    parser.add_argument("--sub_dir", required=True, help="Subject session folder (derivatives/sub-<id>/ses-01)")
+    parser.add_argument("--tasks", default=os.environ.get('TASKS', DEFAULT_TASKS), help="Space-separated tasks")
+    parser.add_argument("--chunk-size", type=int, default=CHUNK_SIZE, help="Volumes read per chunk")
+    parser.add_argument("--force", action="store_true", help="Extract even if the output is up to date")
+    parser.add_argument("subject", help="Subject ID")
+    args = parser.parse_args(argv)
+
+    failed = 0
+    for task in args.tasks.split():
+        if extract_task(args.sub_dir, args.subject, task, args.force, args.chunk_size) is None:
+            failed += 1
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
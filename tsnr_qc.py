@@ -0,0 +1,195 @@
+#!/opt/anaconda3/bin/python
+# Python 3.8.20
+# tsnr_qc.py: Temporal SNR, mean and SD maps of each preprocessed BOLD run, streamed in one pass
+# Created for RECOVER project, Oct 2026
+#
+# Runs before FEAT so that runs with poor signal are flagged before hours of FEAT and randomise.
+# The fMRIPrep desc-preproc_bold run (found through layout_index.py) is read from its memory-mapped
+# working copy in chunks of CHUNK_SIZE volumes; only brain-mask voxels are kept and each chunk is
+# merged into running per-voxel count, mean and sum of squared deviations (Chan et al. update in
+# float64), so memory stays at a few volumes whatever the run length. Outputs in <sub_dir>/qc:
+#   sub-<id>_task-<task>_tsnr.nii.gz, _mean.nii.gz, _std.nii.gz   voxel maps (tSNR = mean / SD)
+#   sub-<id>_task-<task>_tsnr.json   volumes, brain mean/median tSNR and mean/median tSNR of each
+#                                    atlas ROI ($ROI templates resampled onto the BOLD grid)
+# A run is flagged when its brain median tSNR is below QC_MIN_TSNR (default 30). Runs are skipped
+# when the JSON is newer than the BOLD run and mask. The report shows the summaries (load_summaries).
+# Usage: python tsnr_qc.py --sub_dir DIR [--tasks "..."] [--min-tsnr N] [--check] [--force] <subject_id>
+#   --check exits with status 3 if any of the tasks is flagged (master_workflow.sh QC_SKIP_LOW_TSNR)
+
+import os
+import sys
+import json
+import logging
+import argparse
+import numpy as np
+import nibabel as nib
+from nifti_cache import load_img
+import layout_index
+
+# Set up logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+DEFAULT_TASKS = "motor_run-01 motor_run-02 lang"
+CHUNK_SIZE = 20  # Volumes decoded per read
+MIN_TSNR = 30.0
+FLAGGED_EXIT = 3
+# ROI label -> atlas template in $ROI (MNI space)
+ROI_TEMPLATES = {
+    'SMA + PMC': "SMA_PMC.nii.gz",
+    'STG': "STG.nii.gz",
+    'Heschl': "Heschl.nii.gz",
+}
+
+
+def qc_path(sub_dir, subject, task, kind):
+    ext = 'json' if kind == 'summary' else 'nii.gz'
+    name = 'tsnr' if kind == 'summary' else kind
+    return os.path.join(sub_dir, "qc", f"sub-{subject}_task-{task}_{name}.{ext}")
+
+
+def run_inputs(sub_dir, subject, task):
+    """(BOLD run, brain mask) of a task, from the layout index or the standard fMRIPrep names."""
+    layout = layout_index.get_index(os.path.dirname(os.path.dirname(os.path.abspath(sub_dir))))
+    layout.refresh_subject(subject)
+    entities = dict(subject=subject, datatype='func', space='MNI152NLin6Asym', ext='.nii.gz', **layout_index.task_entities(task))
+    prefix = os.path.join(sub_dir, f"func/sub-{subject}_ses-01_task-{task}_space-MNI152NLin6Asym")
+    bold = layout.get(desc='preproc', suffix='bold', **entities) or f"{prefix}_desc-preproc_bold.nii.gz"
+    mask = layout.get(desc='brain', suffix='mask', **entities) or f"{prefix}_desc-brain_mask.nii.gz"
+    return bold, mask
+
+
+def running_stats(bold_file, mask, chunk_size=CHUNK_SIZE):
+    """(mean, SD, volumes) of the voxels in mask over time, reading chunk_size volumes at a time."""
+    img = load_img(bold_file)  # Memory-mapped working copy
+    n_vols = img.shape[3]
+    index = np.flatnonzero(mask.ravel())
+    count, mean, m2 = 0, np.zeros(index.size), np.zeros(index.size)
+    for start in range(0, n_vols, chunk_size):
+        stop = min(start + chunk_size, n_vols)
+        chunk = np.asarray(img.dataobj[..., start:stop], dtype=np.float32).reshape(-1, stop - start)[index].astype(np.float64)
+        n_b = stop - start
+        mean_b = chunk.mean(axis=1)
+        m2_b = ((chunk - mean_b[:, None]) ** 2).sum(axis=1)
+        delta = mean_b - mean
+        total = count + n_b
+        mean += delta * n_b / total
+        m2 += m2_b + delta ** 2 * count * n_b / total
+        count = total
+    std = np.sqrt(m2 / max(count - 1, 1))
+    return mean, std, count
+
+
+def _to_volume(values, index, shape):
+    volume = np.zeros(int(np.prod(shape)), dtype=np.float32)
+    volume[index] = values
+    return volume.reshape(shape)
+
+
+def roi_masks(roi_dir, ref_img):
+    """{label: boolean mask on ref_img's grid} of the atlas ROIs that exist in roi_dir."""
+    import resample_cache
+    masks = {}
+    for label, name in ROI_TEMPLATES.items():
+        path = os.path.join(roi_dir, name) if roi_dir else ''
+        if not os.path.exists(path):
+            continue
+        roi_img = resample_cache.resampled(path, ref_img, interpolation='nearest')
+        masks[label] = np.asarray(roi_img.dataobj).reshape(ref_img.shape[:3]) > 0
+    return masks
+
+
+def _describe(values):
+    values = values[np.isfinite(values)]
+    if values.size == 0:
+        return {'voxels': 0, 'mean': None, 'median': None}
+    return {'voxels': int(values.size), 'mean': round(float(values.mean()), 2), 'median': round(float(np.median(values)), 2)}
+
+
+def qc_task(sub_dir, subject, task, roi_dir=None, force=False, chunk_size=CHUNK_SIZE):
+    """Write the QC maps and summary of one task; returns the summary (None if the BOLD run is missing)."""
+    bold_file, mask_file = run_inputs(sub_dir, subject, task)
+    if not os.path.exists(bold_file):
+        logging.error(f"BOLD run not found for sub-{subject} {task}: {bold_file}")
+        return None
+    summary_path = qc_path(sub_dir, subject, task, 'summary')
+    inputs = [p for p in (bold_file, mask_file) if os.path.exists(p)]
+    if not force and os.path.exists(summary_path) and os.path.getmtime(summary_path) >= max(os.path.getmtime(p) for p in inputs):
+        logging.info(f"tSNR QC up to date: {summary_path}")
+        with open(summary_path) as f:
+            return json.load(f)
+
+    img = load_img(bold_file)
+    shape, affine = img.shape[:3], img.affine
+    if os.path.exists(mask_file):
+        mask = np.asarray(load_img(mask_file).dataobj).reshape(shape) > 0
+    else:
+        logging.warning(f"Brain mask not found ({mask_file}); using the non-zero voxels of the first volume")
+        mask = np.asarray(img.dataobj[..., 0]) != 0
+    mean, std, n_vols = running_stats(bold_file, mask, chunk_size)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        tsnr = np.where(std > 0, mean / std, 0.0)
+
+    os.makedirs(os.path.dirname(summary_path), exist_ok=True)
+    index = np.flatnonzero(mask.ravel())
+    for kind, values in (('tsnr', tsnr), ('mean', mean), ('std', std)):
+        nib.save(nib.Nifti1Image(_to_volume(values, index, shape), affine), qc_path(sub_dir, subject, task, kind))
+
+    brain = _describe(tsnr)
+    tsnr_volume = _to_volume(tsnr, index, shape)
+    rois = {}
+    for label, roi_mask in roi_masks(roi_dir, nib.Nifti1Image(mask.astype(np.uint8), affine)).items():
+        rois[label] = _describe(tsnr_volume[roi_mask & mask])
+    summary = {'subject': subject, 'task': task, 'bold': bold_file, 'volumes': int(n_vols),
+               'brain': brain, 'rois': rois}
+    tmp_path = f"{summary_path}.{os.getpid()}.tmp"
+    with open(tmp_path, 'w') as f:
+        json.dump(summary, f, indent=2)
+    os.replace(tmp_path, summary_path)
+    logging.info(f"tSNR QC for sub-{subject} {task}: brain median {brain['median']} over {n_vols} volumes; saved to {summary_path}")
+    return summary
+
+
+def is_flagged(summary, min_tsnr=MIN_TSNR):
+    median = summary['brain']['median']
+    return median is None or median < min_tsnr
+
+
+def load_summaries(sub_dir, subject, tasks):
+    """Existing QC summaries of the tasks, in order (tasks without QC are left out)."""
+    summaries = []
+    for task in tasks:
+        path = qc_path(sub_dir, subject, task, 'summary')
+        if os.path.exists(path):
+            with open(path) as f:
+                summaries.append(json.load(f))
+    return summaries
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Streamed tSNR, mean and SD maps of each BOLD run, with ROI tSNR")
+    parser.add_argument("--sub_dir", required=True, help="Subject session folder (derivatives/sub-<id>/ses-01)")
+    parser.add_argument("--tasks", default=os.environ.get('TASKS', DEFAULT_TASKS), help="Space-separated tasks")
+    parser.add_argument("--roi_dir", default=os.environ.get('ROI'), help="Atlas ROI folder (default: $ROI)")
+    parser.add_argument("--min-tsnr", type=float, default=float(os.environ.get('QC_MIN_TSNR', MIN_TSNR)),
+                        help="Flag runs whose brain median tSNR is below this value")
+    parser.add_argument("--chunk-size", type=int, default=CHUNK_SIZE, help="Volumes read per chunk")
+    parser.add_argument("--check", action="store_true", help=f"Exit with status {FLAGGED_EXIT} if any task is flagged")
+    parser.add_argument("--force", action="store_true", help="Recompute even if the outputs are up to date")
+    parser.add_argument("subject", help="Subject ID")
+    args = parser.parse_args(argv)
+
+    failed = flagged = 0
+    for task in args.tasks.split():
+        summary = qc_task(args.sub_dir, args.subject, task, args.roi_dir, args.force, args.chunk_size)
+        if summary is None:
+            failed += 1
+        elif is_flagged(summary, args.min_tsnr):
+            logging.warning(f"sub-{args.subject} {task}: brain median tSNR {summary['brain']['median']} is below {args.min_tsnr:g}")
+            flagged += 1
+    if failed:
+        return 1
+    return FLAGGED_EXIT if args.check and flagged else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,99 @@
+#!/bin/bash
+# unit_status.sh: Isolated, retried (subject, task, stage) units and a batch status report, sourced by master_workflow.sh
+# Created for RECOVER project, Oct 2026
+#
+# Every unit of work runs through run_unit, which captures its output in its own log, retries it
+# UNIT_RETRIES more times after UNIT_RETRY_DELAY seconds if it fails, and appends one JSON line
+# to the batch status file. A failed unit never stops the batch: later stages skip only the units
+# that depend on it (unit_ok). status_report writes <STATUS_DIR>/<batch>.json with every unit,
+# the counts per status and the subjects to rerun, and returns 1 if anything failed.
+#   UNIT_RETRIES      extra attempts after a failure (default 1)
+#   UNIT_RETRY_DELAY  seconds between attempts (default 60)
+#   STATUS_DIR        report and log folder (default $ARCHIVEDIR/batch_status)
+
+UNIT_RETRIES=${UNIT_RETRIES:-1}
+UNIT_RETRY_DELAY=${UNIT_RETRY_DELAY:-60}
+STATUS_DIR=${STATUS_DIR:-${ARCHIVEDIR}/batch_status}
+
+# Start a batch; sets BATCH_ID, STATUS_FILE (JSON lines) and UNIT_LOG_DIR
+status_init() {
+    BATCH_ID=batch_$(date +%Y%m%d_%H%M%S)_$$
+    UNIT_LOG_DIR=${STATUS_DIR}/${BATCH_ID}_logs
+    STATUS_FILE=${STATUS_DIR}/${BATCH_ID}.jsonl
+    mkdir -p "$UNIT_LOG_DIR"
+    : > "$STATUS_FILE"
+    echo "Batch status: ${STATUS_DIR}/${BATCH_ID}.json (unit logs in $UNIT_LOG_DIR)"
+}
+
+_status_line() {
+    # stage subject task status attempts exit_code seconds log
+    printf '{"stage": "%s", "subject": "%s", "task": "%s", "status": "%s", "attempts": %d, "exit_code": %d, "seconds": %d, "log": "%s", "finished": "%s"}\n' \
+        "$1" "$2" "$3" "$4" "$5" "$6" "$7" "$8" "$(date +%Y-%m-%dT%H:%M:%S)" >> "$STATUS_FILE"
+}
+
+# run_unit <stage> <subject> <task|all> <command...>: run one unit with retries; returns its exit code
+run_unit() {
+    local stage=$1 subject=$2 task=$3
+    shift 3
+    local log=${UNIT_LOG_DIR}/sub-${subject}_${task}_${stage}.log
+    local attempt=0 rc=1 start=$SECONDS
+    while [ $attempt -le "$UNIT_RETRIES" ]; do
+        attempt=$((attempt + 1))
+        echo "=== attempt ${attempt}: $* ($(date))" >> "$log"
+        "$@" >> "$log" 2>&1 && rc=0 || rc=$?
+        if [ $rc -eq 0 ]; then
+            break
+        fi
+        echo "${stage} failed for sub-${subject} ${task} (attempt ${attempt}, exit ${rc}); see $log"
+        if [ $attempt -le "$UNIT_RETRIES" ]; then
+            sleep "$UNIT_RETRY_DELAY"
+        fi
+    done
+    if [ $rc -eq 0 ]; then
+        echo "${stage} completed for sub-${subject} ${task} (attempt ${attempt})"
+        _status_line "$stage" "$subject" "$task" ok $attempt 0 $((SECONDS - start)) "$log"
+    else
+        _status_line "$stage" "$subject" "$task" failed $attempt $rc $((SECONDS - start)) "$log"
+    fi
+    return $rc
+}
+
+# skip_unit <stage> <subject> <task> <reason>: record a unit that was not run because a dependency failed
+skip_unit() {
+    echo "Skipping $1 for sub-$2 $3: $4"
+    _status_line "$1" "$2" "$3" skipped 0 0 0 ""
+}
+
+# unit_ok <stage> <subject> [task]: true unless that unit (or the subject's "all" unit) failed or was skipped in this batch
+unit_ok() {
+    local stage=$1 subject=$2 task=${3:-all}
+    ! grep -E "\"stage\": \"${stage}\", \"subject\": \"${subject}\", \"task\": \"(${task}|all)\", \"status\": \"(failed|skipped)\"" \
+        "$STATUS_FILE" > /dev/null 2>&1
+}
+
+# Write <STATUS_DIR>/<batch>.json and print a summary; returns 1 if any unit failed or was skipped
+status_report() {
+    local report=${STATUS_DIR}/${BATCH_ID}.json
+    "$PYTHON" - "$STATUS_FILE" "$report" "$BATCH_ID" <<'EOF'
+import sys, json
+status_file, report_path, batch = sys.argv[1:4]
+units = [json.loads(line) for line in open(status_file) if line.strip()]
+counts = {}
+for unit in units:
+    counts[unit['status']] = counts.get(unit['status'], 0) + 1
+rerun = sorted({u['subject'] for u in units if u['status'] != 'ok'})
+report = {'batch': batch, 'counts': counts, 'rerun_subjects': rerun,
+          'failed': [u for u in units if u['status'] == 'failed'], 'units': units}
+with open(report_path, 'w') as f:
+    json.dump(report, f, indent=2)
+print(f"Batch {batch}: " + ', '.join(f"{k}: {v}" for k, v in sorted(counts.items())))
+for unit in report['failed']:
+    print(f"  FAILED {unit['stage']} sub-{unit['subject']} {unit['task']} (exit {unit['exit_code']}): {unit['log']}")
+if rerun:
+    print(f"  Rerun: {' '.join(rerun)}")
+sys.exit(1 if rerun else 0)
+EOF
+    local rc=$?
+    rm -f "$STATUS_FILE"
+    return $rc
+}
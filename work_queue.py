@@ -0,0 +1,410 @@
+#!/opt/anaconda3/bin/python
+# Python 3.8.20
+# work_queue.py: Shared-filesystem work queue that spreads (subject, stage) units over many workers and hosts
+# Created for RECOVER project, Oct 2026
+#
+# The queue is a directory on the shared ARCHIVEDIR (default $ARCHIVEDIR/work_queue):
+#   <queue>/units/<subject>__<stage>.json    queued units
+#   <queue>/leases/<unit>.lease              claim held by one worker (created with O_EXCL)
+#   <queue>/done/<unit>.json                 finished units with timing
+#   <queue>/failed/<unit>.json               failed units with the exit code
+#   <queue>/logs/<unit>.log                  output of the unit's command
+# A worker claims a unit whose dependencies are done by creating its lease file exclusively,
+# renews the lease while the command runs, and removes it when the unit is recorded. A lease
+# that is not renewed within --lease seconds (worker or host died) is broken by renaming it
+# away, which only one worker can do, and the unit is claimed again. The holder renews by the same
+# rename and puts the new record back with os.link, which fails if another worker created a lease
+# meanwhile; a lease that is gone, taken over or already expired stops the command. Workers leave
+# a unit alone while its lease is moved aside, unless the moved file is older than --lease. Hosts must
+# share a roughly synchronised clock (NTP); keep --lease well above the heartbeat interval.
+# Usage:
+#   python work_queue.py enqueue [--stages feat,calc,...] <subject_id1> ...
+#   python work_queue.py work [--command TEMPLATE] [--exit-when-idle]     (any number, any host)
+#   python work_queue.py status [--json]
+#   python work_queue.py requeue [--failed] [<unit> ...]
+
+import os
+import sys
+import json
+import time
+import shlex
+import socket
+import logging
+import argparse
+import threading
+import subprocess
+
+# Set up logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+# Pipeline stages in order, with the master_workflow.sh flag and the stages each depends on
+STAGES = {
+    'feat': ('f', ()),
+    'randomise': ('p', ('feat',)),
+    'ica': ('i', ('feat',)),
+    'calc': ('c', ('feat', 'randomise', 'ica')),  # Post-stats read the ICA dual-regression maps
+    'output': ('o', ('calc',)),
+}
+QUEUE_DIRS = ('units', 'leases', 'done', 'failed', 'logs')
+DEFAULT_TASKS = "motor_run-01 motor_run-02 lang"
+DEFAULT_LEASE = 600  # Seconds a claim stays valid without renewal
+POLL_INTERVAL = 5  # Seconds between queue scans when no unit can be claimed
+DEFAULT_COMMAND = "bash {scripts}/master_workflow.sh -{flag} {subject}"
+
+
+def default_queue():
+    """$WORK_QUEUE_DIR, or work_queue/ under $ARCHIVEDIR."""
+    if os.environ.get('WORK_QUEUE_DIR'):
+        return os.environ['WORK_QUEUE_DIR']
+    if os.environ.get('ARCHIVEDIR'):
+        return os.path.join(os.environ['ARCHIVEDIR'], "work_queue")
+    return None
+
+
+def queue_paths(queue):
+    """Create the queue folders if needed and return their paths by name."""
+    paths = {name: os.path.join(queue, name) for name in QUEUE_DIRS}
+    for path in paths.values():
+        os.makedirs(path, exist_ok=True)
+    return paths
+
+
+def unit_name(subject, stage):
+    return f"{subject}__{stage}"
+
+
+def _write_json(path, record):
+    tmp_path = f"{path}.{socket.gethostname()}.{os.getpid()}.tmp"
+    with open(tmp_path, 'w') as f:
+        json.dump(record, f, indent=2)
+    os.replace(tmp_path, path)
+
+
+def _read_json(path):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (FileNotFoundError, ValueError):
+        return None  # Removed, or still being written by another worker
+
+
+class Lease:
+    """Exclusive, renewable claim on one unit, stored as <queue>/leases/<unit>.lease."""
+
+    def __init__(self, leases_dir, name, duration):
+        self.path = os.path.join(leases_dir, f"{name}.lease")
+        self.duration = duration
+        self.owner = f"{socket.gethostname()}:{os.getpid()}:{threading.get_ident()}:{time.time_ns()}"
+        self.lost = threading.Event()
+        self._stop_event = threading.Event()
+        self._thread = None
+
+    def _record(self):
+        now = time.time()
+        return {'owner': self.owner, 'host': socket.gethostname(), 'pid': os.getpid(),
+                'renewed': now, 'expires': now + self.duration}
+
+    def acquire(self):
+        """Create the lease file if no one holds it; break it first if it has expired."""
+        leases_dir, prefix = os.path.split(f"{self.path}.held.")
+        for filename in os.listdir(leases_dir):
+            if not filename.startswith(prefix):
+                continue
+            held_path = os.path.join(leases_dir, filename)
+            try:
+                if os.stat(held_path).st_mtime + self.duration >= time.time():
+                    return False  # Its holder is renewing or releasing it
+                os.remove(held_path)  # Left by a worker that died while renewing
+            except FileNotFoundError:
+                pass
+        current = _read_json(self.path)
+        if current is not None and current.get('expires', 0) < time.time():
+            stale_path = f"{self.path}.expired.{time.time_ns()}"
+            try:
+                os.rename(self.path, stale_path)  # Only one worker wins the rename
+            except FileNotFoundError:
+                return False
+            moved = _read_json(stale_path)
+            if moved is not None and moved.get('owner') != current.get('owner'):
+                # Another worker broke the lease and claimed the unit between our read and rename
+                try:
+                    os.link(stale_path, self.path)
+                except FileExistsError:
+                    pass
+                os.remove(stale_path)
+                return False
+            logging.warning(f"Broke expired lease {os.path.basename(self.path)} held by {current.get('host')}:{current.get('pid')}")
+            os.remove(stale_path)
+        try:
+            fd = os.open(self.path, os.O_CREAT | os.O_EXCL | os.O_WRONLY, 0o644)
+        except FileExistsError:
+            return False
+        with os.fdopen(fd, 'w') as f:
+            json.dump(self._record(), f)
+        return True
+
+    def _take(self):
+        """Move our lease file to a private name; returns (path, record), or None if it is not ours any more."""
+        held_path = f"{self.path}.held.{time.time_ns()}"
+        try:
+            os.rename(self.path, held_path)  # Atomic: a worker breaking the lease gets either ours or nothing
+        except FileNotFoundError:
+            return None
+        held = _read_json(held_path)
+        if held is None or held.get('owner') != self.owner:
+            try:
+                os.link(held_path, self.path)  # Another worker's lease: put it back unless it was replaced again
+            except FileExistsError:
+                pass
+            os.remove(held_path)
+            return None
+        return held_path, held
+
+    def renew(self):
+        """Extend the lease; marks it lost if it was taken over or had already expired."""
+        taken = self._take()
+        if taken is None:
+            self.lost.set()
+            return False
+        held_path, held = taken
+        if held.get('expires', 0) < time.time():
+            os.remove(held_path)  # Others may already have seen it expired and started the unit
+            self.lost.set()
+            return False
+        tmp_path = f"{self.path}.{socket.gethostname()}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump(self._record(), f)
+        try:
+            os.link(tmp_path, self.path)  # Fails if another worker claimed the unit while the lease was aside
+            renewed = True
+        except FileExistsError:
+            renewed = False
+        os.remove(tmp_path)
+        os.remove(held_path)
+        if not renewed:
+            self.lost.set()
+        return renewed
+
+    def start_heartbeat(self, interval):
+        def beat():
+            while not self._stop_event.wait(interval):
+                if not self.renew():
+                    logging.error(f"Lease {os.path.basename(self.path)} was lost")
+                    return
+        self._thread = threading.Thread(target=beat, daemon=True)
+        self._thread.start()
+
+    def release(self):
+        self._stop_event.set()
+        if self._thread is not None:
+            self._thread.join()
+        taken = self._take()
+        if taken is not None:
+            os.remove(taken[0])
+
+
+def enqueue(queue, subjects, stages, tasks=DEFAULT_TASKS, force=False):
+    """Queue one unit per (subject, stage); finished units are kept unless force is set."""
+    paths = queue_paths(queue)
+    names = []
+    for subject in subjects:
+        for stage in stages:
+            name = unit_name(subject, stage)
+            if force:
+                for folder in ('done', 'failed'):
+                    try:
+                        os.remove(os.path.join(paths[folder], f"{name}.json"))
+                    except FileNotFoundError:
+                        pass
+            _write_json(os.path.join(paths['units'], f"{name}.json"),
+                        {'subject': subject, 'stage': stage, 'tasks': tasks,
+                         'queued': time.strftime('%Y-%m-%dT%H:%M:%S')})
+            names.append(name)
+    logging.info(f"Queued {len(names)} units for {len(subjects)} subjects in {queue}")
+    return names
+
+
+def unit_states(queue):
+    """State of every queued unit: done, failed, blocked (a dependency failed), running, ready or waiting."""
+    paths = queue_paths(queue)
+    units = {}
+    for filename in sorted(os.listdir(paths['units'])):
+        if filename.endswith('.json'):
+            unit = _read_json(os.path.join(paths['units'], filename))
+            if unit is not None:
+                units[filename[:-len('.json')]] = unit
+    done = {f[:-len('.json')] for f in os.listdir(paths['done']) if f.endswith('.json')}
+    failed = {f[:-len('.json')] for f in os.listdir(paths['failed']) if f.endswith('.json')}
+    now = time.time()
+
+    states = {}
+
+    def state_of(name):
+        if name in states:
+            return states[name]
+        if name in done:
+            state = 'done'
+        elif name in failed:
+            state = 'failed'
+        else:
+            unit = units[name]
+            deps = [unit_name(unit['subject'], dep) for dep in STAGES[unit['stage']][1]]
+            dep_states = [state_of(dep) for dep in deps if dep in units or dep in done or dep in failed]
+            lease = _read_json(os.path.join(paths['leases'], f"{name}.lease"))
+            if any(s in ('failed', 'blocked') for s in dep_states):
+                state = 'blocked'
+            elif lease is not None and lease.get('expires', 0) >= now:
+                state = 'running'
+            elif all(s == 'done' for s in dep_states):
+                state = 'ready'
+            else:
+                state = 'waiting'
+        states[name] = state
+        return state
+
+    for name in units:
+        state_of(name)
+    return {name: (units[name], states[name]) for name in units}
+
+
+def run_unit(queue, name, unit, command, lease):
+    """Run one claimed unit's command and record the result unless the lease was lost."""
+    paths = queue_paths(queue)
+    flag = STAGES[unit['stage']][0]
+    scripts = os.environ.get('SCRIPTSDIR', os.path.dirname(os.path.abspath(__file__)))
+    cmd = command.format(subject=shlex.quote(unit['subject']), stage=unit['stage'], flag=flag,
+                         tasks=shlex.quote(unit['tasks']), scripts=scripts)
+    env = dict(os.environ, TASKS=unit['tasks'])
+    log_path = os.path.join(paths['logs'], f"{name}.log")
+    start = time.time()
+    logging.info(f"Running {name} on {socket.gethostname()}: {cmd}")
+    with open(log_path, 'a') as log:
+        log.write(f"=== {time.strftime('%Y-%m-%dT%H:%M:%S')} {socket.gethostname()}:{os.getpid()} {cmd}\n")
+        log.flush()
+        proc = subprocess.Popen(cmd, shell=True, stdout=log, stderr=subprocess.STDOUT, env=env)
+        while proc.poll() is None:
+            if lease.lost.wait(1.0):
+                logging.error(f"Stopping {name}: lease taken over by another worker")
+                proc.terminate()
+                proc.wait()
+                return None
+    record = dict(unit, host=socket.gethostname(), pid=os.getpid(), returncode=proc.returncode,
+                  seconds=round(time.time() - start, 3), log=log_path,
+                  finished=time.strftime('%Y-%m-%dT%H:%M:%S'))
+    status = 'done' if proc.returncode == 0 else 'failed'
+    _write_json(os.path.join(paths[status], f"{name}.json"), record)
+    if status == 'done':
+        logging.info(f"Finished {name} in {record['seconds']}s")
+    else:
+        logging.error(f"Failed {name} (exit {proc.returncode}); see {log_path}")
+    return status
+
+
+def work(queue, command=DEFAULT_COMMAND, lease_seconds=DEFAULT_LEASE, poll=POLL_INTERVAL,
+         exit_when_idle=False, stages=None):
+    """Claim and run ready units until stopped (or until nothing is left, with exit_when_idle)."""
+    paths = queue_paths(queue)
+    completed = 0
+    logging.info(f"Worker {socket.gethostname()}:{os.getpid()} pulling from {queue}")
+    while True:
+        states = unit_states(queue)
+        claimed = False
+        for name, (unit, state) in states.items():
+            if state != 'ready' or (stages and unit['stage'] not in stages):
+                continue
+            lease = Lease(paths['leases'], name, lease_seconds)
+            if not lease.acquire():
+                continue  # Claimed by another worker since the scan
+            if any(os.path.exists(os.path.join(paths[folder], f"{name}.json")) for folder in ('done', 'failed')):
+                lease.release()  # Recorded by a worker whose lease we just broke, or failed since the scan
+                continue
+            lease.start_heartbeat(max(lease_seconds / 4, 1))
+            try:
+                if run_unit(queue, name, unit, command, lease) is not None:
+                    completed += 1
+            finally:
+                lease.release()
+            claimed = True
+            break  # Rescan: dependencies may have changed
+        if claimed:
+            continue
+        pending = [name for name, (unit, state) in states.items()
+                   if state in ('ready', 'running', 'waiting') and not (stages and unit['stage'] not in stages)]
+        if exit_when_idle and not pending:
+            logging.info(f"Queue idle; worker ran {completed} units")
+            return completed
+        time.sleep(poll)
+
+
+def requeue(queue, names=None, failed_only=False):
+    """Forget the recorded result of the given units (default: every failed unit) so they run again."""
+    paths = queue_paths(queue)
+    folders = ('failed',) if failed_only or not names else ('failed', 'done')
+    if not names:
+        names = [f[:-len('.json')] for f in os.listdir(paths['failed']) if f.endswith('.json')]
+    for name in names:
+        for folder in folders:
+            try:
+                os.remove(os.path.join(paths[folder], f"{name}.json"))
+                logging.info(f"Requeued {name}")
+            except FileNotFoundError:
+                pass
+    return names
+
+
+def print_status(queue, as_json=False):
+    states = unit_states(queue)
+    if as_json:
+        print(json.dumps({name: state for name, (unit, state) in states.items()}, indent=2))
+        return
+    counts = {}
+    for name, (unit, state) in states.items():
+        counts[state] = counts.get(state, 0) + 1
+        print(f"{unit['subject']:<20} {unit['stage']:<10} {state}")
+    print(', '.join(f"{state}: {count}" for state, count in sorted(counts.items())))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Shared-filesystem work queue for RECOVER pipeline stages")
+    parser.add_argument("--queue", default=default_queue(),
+                        help="Queue directory on the shared filesystem (default: $WORK_QUEUE_DIR or $ARCHIVEDIR/work_queue)")
+    sub = parser.add_subparsers(dest='action', required=True)
+    p_enqueue = sub.add_parser('enqueue', help="Queue (subject, stage) units")
+    p_enqueue.add_argument("--stages", default=','.join(STAGES), help="Comma-separated stages (default: all)")
+    p_enqueue.add_argument("--tasks", default=os.environ.get('TASKS', DEFAULT_TASKS), help="Space-separated tasks")
+    p_enqueue.add_argument("--force", action="store_true", help="Run units again even if already done")
+    p_enqueue.add_argument("subjects", nargs="+", help="List of subject IDs")
+    p_work = sub.add_parser('work', help="Claim and run units")
+    p_work.add_argument("--command", default=os.environ.get('WORK_QUEUE_COMMAND', DEFAULT_COMMAND),
+                        help="Command template with {subject}, {stage}, {flag}, {tasks}, {scripts}")
+    p_work.add_argument("--lease", type=float, default=DEFAULT_LEASE, help="Lease duration in seconds")
+    p_work.add_argument("--poll", type=float, default=POLL_INTERVAL, help="Seconds between scans when idle")
+    p_work.add_argument("--stages", help="Only run these comma-separated stages on this worker")
+    p_work.add_argument("--exit-when-idle", action="store_true", help="Exit once no unit is ready, running or waiting")
+    p_status = sub.add_parser('status', help="Show the state of every unit")
+    p_status.add_argument("--json", action="store_true", help="Print states as JSON")
+    p_requeue = sub.add_parser('requeue', help="Run finished or failed units again")
+    p_requeue.add_argument("--failed", action="store_true", help="Only failed units")
+    p_requeue.add_argument("units", nargs="*", help="Unit names (<subject>__<stage>); default: all failed")
+    args = parser.parse_args(argv)
+
+    if not args.queue:
+        parser.error("No queue directory: pass --queue or set WORK_QUEUE_DIR or ARCHIVEDIR")
+    if args.action == 'enqueue':
+        stages = [s for s in args.stages.split(',') if s]
+        unknown = [s for s in stages if s not in STAGES]
+        if unknown:
+            parser.error(f"Unknown stages: {', '.join(unknown)} (choose from {', '.join(STAGES)})")
+        enqueue(args.queue, args.subjects, stages, args.tasks, args.force)
+    elif args.action == 'work':
+        stages = args.stages.split(',') if args.stages else None
+        work(args.queue, args.command, args.lease, args.poll, args.exit_when_idle, stages)
+    elif args.action == 'status':
+        print_status(args.queue, args.json)
+    else:
+        requeue(args.queue, args.units, args.failed)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())